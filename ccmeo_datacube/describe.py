@@ -34,16 +34,22 @@ d.search(bbox=bbox,datetime_filter=datetime,collections=collections)
 
 """
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
 import os
 import pathlib
+import struct
 import sys
 from typing import Tuple
 
 # Python custom packages
 import geopandas
+import numpy
 import pandas
 import requests
 import shapely
+import shapely.wkb
 import sqlite3
 
 _CHILD_LEVEL = 1
@@ -51,13 +57,22 @@ _DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
 if _DIR_NEEDED not in sys.path:
     sys.path.insert(0,_DIR_NEEDED)
     
-from ccmeo_datacube.utils import nrcan_requests_ca_patch, print_time, valid_rfc3339
+from ccmeo_datacube.utils import import_pyarrow, nrcan_requests_ca_patch, print_time, valid_rfc3339
+
+# Number of STAC API requests sent at the same time
+_MAX_WORKERS = 8
+# Number of rows per row group of the GeoParquet files, the bbox statistics
+# of each row group allow the readers to skip the groups outside their extent
+_PARQUET_ROW_GROUP = 8192
+# Number of items written at once to the geopackage by the streaming search
+_STREAM_BATCH = 5000
 
 @print_time
 @nrcan_requests_ca_patch
 def collections(out_file:str='./data/collections/dce.gpkg',
               urls:list= ['https://datacube.services.geo.ca/api'],
-              geojson:bool=False):
+              geojson:bool=False,
+              incremental:bool=False):
     
     """
     Scrapes '/collections' endpoint result to collection and asset pgpk.
@@ -71,6 +86,11 @@ def collections(out_file:str='./data/collections/dce.gpkg',
          The default is ['https://datacube.services.geo.ca/api']
     geojson : bool, optional
         If geojson output should be created. The default is False.
+    incremental : bool, optional
+        Update the existing geopackage instead of rebuilding it, only the
+        collections changed since the last run (STAC 'updated' or ETag, 
+        saved in the table dce_describe_state) are scraped again and upserted.
+        The geojson outputs are not created in this mode. The default is False.
 
     Returns
     -------
@@ -95,6 +115,13 @@ def collections(out_file:str='./data/collections/dce.gpkg',
     if not parent.is_dir():
         parent.mkdir(parents=True,exist_ok=True)
 
+    if incremental:
+        print('Scraping STAC, changed collections only',file=sys.stdout)
+        for url in urls:
+            _update_describe(name,url)
+        print(f'Done.  Data is here : {name.absolute().parent}',file=sys.stdout)
+        return
+
     # If gpkg exists delete it
     if name.is_file():
       name.unlink(missing_ok=True)
@@ -130,7 +157,10 @@ def search(out_file:str='./data/search/dce.gpkg',
            bbox:str=None,
            datetime_filter:str=None,
            collections:str=None,
-           geojson:bool=False):
+           geojson:bool=False,
+           incremental:bool=False,
+           parquet:bool=False,
+           stream:bool=False):
     
     """
     Scrapes '/search endpoint to collection, item, and asset geopackage.
@@ -152,6 +182,20 @@ def search(out_file:str='./data/search/dce.gpkg',
         The default is None.
     geojson : bool, optional
         If geojson output should be created. The default is False.
+    incremental : bool, optional
+        Update the existing geopackage instead of rebuilding it, only the items
+        of the collections changed since the last run (STAC 'updated' or ETag, 
+        or a different bbox or datetime filter) are searched again and upserted.
+        New items of a collection whose metadata did not change are not picked up.
+        The geojson and parquet outputs are not created in this mode. The default is False.
+    parquet : bool, optional
+        If GeoParquet output of dce_item and dce_asset should be created, 
+        partitioned by collection in <out_file stem>_parquet (requires pyarrow).
+        The default is False.
+    stream : bool, optional
+        Write the search results to the geopackage page by page (bounded memory,
+        each page requested once) instead of building the dataframes in memory.
+        The geojson and parquet outputs are not created in this mode. The default is False.
 
     Returns
     -------
@@ -176,6 +220,13 @@ def search(out_file:str='./data/search/dce.gpkg',
     if not parent.is_dir():
         parent.mkdir(parents=True,exist_ok=True)
 
+    if incremental:
+        print('Scraping STAC, changed collections only')
+        for url in urls:
+            _update_describe(name,url,bbox,datetime_filter,collections,search=True)
+        print(f'Done.  Data is here : {name.absolute().parent}')
+        return
+
     # If gpkg exists delete it
     if name.is_file():
       name.unlink(missing_ok=True)
@@ -183,6 +234,15 @@ def search(out_file:str='./data/search/dce.gpkg',
     # Set up seed name for geojson files
     g_name = name.with_suffix('.geojson')
     
+    if stream:
+        print('Scraping STAC, streaming the pages to file')
+        if _stream_search(name,urls,bbox,datetime_filter,collections):
+            print(f'Done.  Data is here : {name.absolute().parent}')
+        else:
+            print(f'No items for the search, no file created')
+            name.unlink(missing_ok=True)
+        return
+
     print('Scraping STAC')
 
     list_gdf_collection = []
@@ -210,6 +270,9 @@ def search(out_file:str='./data/search/dce.gpkg',
 
         if geojson:
             _write_to_json(g_name,name,gdf_collection,df_a,gdf_collection_asset,gdf_i)
+
+        if parquet:
+            _write_to_parquet(name.with_name(f'{name.stem}_parquet'),df_a,gdf_i)
             
         print(f'Done.  Data is here : {name.absolute().parent}')
 
@@ -246,15 +309,21 @@ def search_to_gdf(url,df_asset):
     
     return gdf_collection,gdf_collection_asset
 
-def collections_to_gdf(url:str='https://datacube.services.geo.ca/api'):
+def collections_to_gdf(url:str='https://datacube.services.geo.ca/api',
+                       max_workers:int=_MAX_WORKERS):
     """
     Converts STAC API collections results to collection, item, asset geodataframes
 
+    The first item of each collection (for the asset description) is requested
+    in parallel, the rows keep the order of the collections.
+
     Parameters
     ----------
     url : str, optional
         root url to the stac api. 
         The default is 'https://datacube.services.geo.ca/api'.
+    max_workers : int, optional
+        Number of item requests sent at the same time. The default is _MAX_WORKERS.
     
 
     Returns
@@ -267,41 +336,41 @@ def collections_to_gdf(url:str='https://datacube.services.geo.ca/api'):
         A geodataframe of STAC collection and asset per collection information.
 
     """
-    collections = []
-    assets=[]
+    return _collections_json_to_gdf(_list_collections(url),url,max_workers)
 
+def _list_collections(url:str)->list:
+    """Returns the STAC collections (as dict) of all the pages of the '/collections' endpoint"""
+    colls = []
     # Get a list of collections from /collections endpoint
     collections_url = f'{url}/collections'
     next_page = collections_url
-    returned = 0
-    matched = 0
     while next_page:
         r = requests.get(next_page)
         if r.status_code == 200:
             j = r.json()
-            # For each collection pull out the collection and asset descriptions
-            for coll in j['collections']:
-                collection = _parse_collection(coll,url)
-                collections.append(collection)
-                # Get STAC items
-                item_url = f'{url}/collections/{coll["id"]}/items'
-                print(f'Scraping assets from {item_url}')
-                ri = requests.get(item_url)
-                if ri.status_code == 200:
-                    ji = ri.json()
-                    # Parse out asset description from first item
-                    items,t_assets = _parse_items_assets(ji,url,just_one=True)
-                    # Append each asset per item to asset list
-                    for t_asset in t_assets:
-                        assets.append(t_asset)
-            
-
+            colls.extend(j['collections'])
             links = j['links']
             next_page = _get_next_page(links)
-
         else:
             next_page = None
+    return colls
 
+def _collections_json_to_gdf(colls:list,url:str,max_workers:int=_MAX_WORKERS):
+    """Converts STAC collections (as dict) to collection, asset and collection_asset dataframes, see collections_to_gdf()"""
+    collections = []
+    assets=[]
+    item_urls = []
+    # For each collection pull out the collection and asset descriptions
+    for coll in colls:
+        collection = _parse_collection(coll,url)
+        collections.append(collection)
+        item_urls.append(f'{url}/collections/{coll["id"]}/items')
+
+    # Get the STAC items of all the collections, executor.map keeps the order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for t_assets in executor.map(lambda item_url:_first_item_assets(item_url,url), item_urls):
+            # Append each asset per item to asset list
+            assets.extend(t_assets)
     
     # Create asset geodataframe
     item_header,asset_header = _ia_headers()
@@ -317,6 +386,18 @@ def collections_to_gdf(url:str='https://datacube.services.geo.ca/api'):
     
     return gdf_c,df_a,gdf_ca
 
+def _first_item_assets(item_url:str,url:str)->list:
+    """Returns the parsed assets of the first item of a collection items endpoint"""
+    print(f'Scraping assets from {item_url}')
+    # Only the first feature is parsed
+    ri = requests.get(item_url,params={'limit':1})
+    if ri.status_code == 200:
+        ji = ri.json()
+        # Parse out asset description from first item
+        items,t_assets = _parse_items_assets(ji,url,just_one=True)
+        return t_assets
+    return []
+
 def _search_pages(url:str)->list:
     """
     A valid list of urls based on stac api link['next'] for the search endpoint
@@ -459,16 +540,151 @@ def _items_assets_to_gdf(url:str='https://datacube.services.geo.ca/api',
         print(f'No items for api requests : {search_url} ')
         return None,None
 
-def _col_id_to_gdf(coll_df:pandas.DataFrame,url:str):
+def _stream_search(name:pathlib.Path,
+                   urls:list,
+                   bbox:str=None,
+                   dt:str=None,
+                   cols:str=None)->int:
+    """
+    Writes a search to the geopackage page by page, with bounded memory
+
+    The search is POSTed once per url and the next links are followed once,
+    the items of the pages are appended to dce_item by batches of _STREAM_BATCH.
+    Only the assets (one per collection and asset key) and the collections are 
+    kept in memory. Everything is written in a single transaction (see _gpkg_writer()).
+
+    Parameters
+    ----------
+    name : pathlib.Path
+        The geopackage name and path, must not exist.
+    urls : list
+        The STAC API root urls.
+    bbox : str, optional
+        BBOX to use as search filter. The default is None.
+    dt : str, optional
+        Datetime to use as search filter in STAC API formate.
+        The default is None.
+    cols : str, optional
+        A csv of collections in STAC API format.
+        The default is None.
+
+    Returns
+    -------
+    int
+        The number of items written.
+
+    """
+    n_items = 0
+    list_gdf_collection = []
+    list_df_asset = []
+    item_header,asset_header = _ia_headers()
+    with _gpkg_writer(name) as conn:
+        for url in urls:
+            assets = {}
+            batch = []
+            for j in _stream_search_pages(url,_search_body(bbox,dt,cols)):
+                t_items,t_assets = _parse_items_assets(j,url)
+                batch.extend(t_items)
+                for t_asset in t_assets:
+                    assets.setdefault(t_asset[0],t_asset)
+                if len(batch) >= _STREAM_BATCH:
+                    n_items += _append_items(conn,batch)
+                    batch = []
+            if batch:
+                n_items += _append_items(conn,batch)
+            if assets:
+                df_asset = pandas.DataFrame(list(assets.values()),columns=asset_header)
+                gdf_c,_ = search_to_gdf(url,df_asset)
+                if gdf_c is not None:
+                    list_gdf_collection.append(gdf_c)
+                list_df_asset.append(df_asset)
+        print(f'{n_items} items written to {name.absolute()}')
+        if n_items:
+            print('Indexing item table')
+            _index_gpkg_table(conn,'dce_item')
+        if list_gdf_collection:
+            _write_collections_assets(conn,pandas.concat(list_gdf_collection),pandas.concat(list_df_asset))
+    return n_items
+
+def _append_items(conn:sqlite3.Connection,items:list)->int:
+    """Appends parsed items to dce_item (created on the first call), returns the number of items"""
+    item_header,_ = _ia_headers()
+    gdf_item = geopandas.GeoDataFrame(items,columns=item_header,geometry='geometry',crs='EPSG:4326')
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'dce_item'").fetchone() is None:
+        # The geometry type of the next pages is not known
+        _create_gpkg_table(conn,'dce_item',gdf_item,geom_type='GEOMETRY')
+    _insert_gpkg_rows(conn,'dce_item',gdf_item)
+    return len(items)
+
+def _search_body(bbox:str=None,dt:str=None,cols:str=None)->dict:
+    """Returns the json body of a POST search"""
+    body = {}
+    if bbox:
+        body['bbox'] = [float(v) for v in bbox.split(',')]
+    if dt:
+        datetime_filter = valid_rfc3339(dt)
+        if datetime_filter:
+            body['datetime'] = datetime_filter
+        else:
+            print(f"Invalid datetime filter {dt}")
+    if cols:
+        body['collections'] = cols.split(',')
+    return body
+
+def _stream_search_pages(url:str,body:dict):
+    """
+    Yields the json of each page of a POST '/search', each page is requested once
+
+    Franklin STAC API generates a next link even when there is no next page,
+    the pages stop when the returned items reach the matched items (context)
+    or when a page has no items.
+    """
+    request = {'method':'POST','href':f'{url}/search','body':body}
+    returned = 0
+    while request:
+        print(f'_stream_search_pages {request["href"]}')
+        if request['method'] == 'POST':
+            r = requests.post(request['href'],json=request['body'])
+        else:
+            r = requests.get(request['href'])
+        if r.status_code != 200:
+            print(f'Search page not available ({r.status_code}) : {request["href"]}')
+            return
+        j = r.json()
+        yield j
+        features = j.get('features',[])
+        context = j.get('context') or {}
+        returned += context.get('returned',len(features))
+        matched = context.get('matched')
+        if not features or (matched is not None and returned >= matched):
+            return
+        request = _next_request(j.get('links',[]),request)
+
+def _next_request(links:list,previous:dict):
+    """Returns the next page request {'method','href','body'} from STAC API links list or None"""
+    for link in links:
+        if link['rel'] == 'next':
+            method = link.get('method','GET').upper()
+            body = link.get('body')
+            if method == 'POST' and (body is None or link.get('merge')):
+                body = {**previous['body'],**(body or {})}
+            return {'method':method,'href':link['href'],'body':body}
+    return None
+
+def _col_id_to_gdf(coll_df:pandas.DataFrame,url:str,max_workers:int=_MAX_WORKERS):
     """
     Converts collection_ids to a GeoDataFrame     
 
+    The collections are requested in parallel, the rows keep the order of coll_df.
+
     Parameters
     ----------
     coll_df : pandas.DataFrame
         A dataframe with unique column values.
     url : str
         The root url.
+    max_workers : int, optional
+        Number of collection requests sent at the same time. The default is _MAX_WORKERS.
 
     Returns
     -------
@@ -476,15 +692,11 @@ def _col_id_to_gdf(coll_df:pandas.DataFrame,url:str):
         GeoDataFrame with collection level geometry.
 
     """
-    collections = []
     gdf = None
-    for cid in coll_df['collection_id'].values:
-        c_url = f'{url}/collections/{cid}'
-        c = requests.get(c_url)
-        if c.status_code == 200:
-            c_j = c.json()
-            collection_record = _parse_collection(c_j,url)
-            collections.append(collection_record)
+    c_urls = [f'{url}/collections/{cid}' for cid in coll_df['collection_id'].values]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records = list(executor.map(lambda c_url:_collection_record(c_url,url), c_urls))
+    collections = [record for record in records if record is not None]
     if len(collections) > 0:
         header = _c_headers()
         gdf = geopandas.GeoDataFrame(collections,columns=header,
@@ -492,6 +704,14 @@ def _col_id_to_gdf(coll_df:pandas.DataFrame,url:str):
                                  crs='EPSG:4326')
     return gdf
 
+def _collection_record(c_url:str,url:str):
+    """Returns the parsed collection of a collection endpoint or None"""
+    c = requests.get(c_url)
+    if c.status_code == 200:
+        c_j = c.json()
+        return _parse_collection(c_j,url)
+    return None
+
 def _parse_collection(j:dict,url:str)->dict:
     """Parses STAC collection results for collection information
     
@@ -643,26 +863,419 @@ def _create_db(name:str,gdf_c:geopandas.GeoDataFrame,
                df_a:pandas.DataFrame,
                gdf_ca:geopandas.GeoDataFrame,
                gdf_i:geopandas.GeoDataFrame=None)->str:
-    """Creates tables from dataframes and views from sql"""
-    # Write out to gpkg
-    print('Writing collection table')
-    gdf_c.to_file(name, layer='dce_collection', driver="GPKG",mode='w')
-    print('Writing collection asset table')
-    gdf_ca.to_file(name,layer='dce_collection_asset', driver="GPKG",mode='w')
+    """
+    Creates tables from dataframes and views from sql
 
-    print('Writing asset table')
-    conn = sqlite3.connect(name)
-    df_a.to_sql(name='dce_asset',con=conn,if_exists='replace')
-    conn.commit()
-    conn.close()
-    
-    if isinstance(gdf_i,geopandas.GeoDataFrame):
-        print('Writing item table')
-        gdf_i.to_file(name, layer='dce_item', driver="GPKG",mode='w')
+    The geopackage is written with a single connection in a single transaction 
+    (see _gpkg_writer()), the spatial indexes are built once the rows 
+    are inserted. dce_collection_asset is a view joining dce_collection and 
+    dce_asset on collection_id (gdf_ca is only written as a table when the 
+    two tables can not be joined).
+    """
+    with _gpkg_writer(name) as conn:
+        if isinstance(gdf_i,geopandas.GeoDataFrame):
+            print('Writing item table')
+            _write_gpkg_table(conn,'dce_item',gdf_i)
+        _write_collections_assets(conn,gdf_c,df_a,gdf_ca)
 
     # TODO decide what else to do with gpkg
     return
 
+@contextmanager
+def _gpkg_writer(name:pathlib.Path):
+    """
+    Yields a connection to a new geopackage in a single transaction (WAL journal while 
+    writing), committed at the end or rolled back if an error occurs
+    """
+    conn = _gpkg_connect(name)
+    # Transactions are handled explicitly, the table creations are part of the transaction
+    conn.isolation_level = None
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('BEGIN')
+        _init_gpkg(conn)
+        yield conn
+        conn.execute('COMMIT')
+        # The geopackage is distributed as a single file
+        conn.execute('PRAGMA journal_mode=DELETE')
+    except:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def _write_collections_assets(conn:sqlite3.Connection,
+                              gdf_c:geopandas.GeoDataFrame,
+                              df_a:pandas.DataFrame,
+                              gdf_ca:geopandas.GeoDataFrame=None):
+    """Writes the collection and asset tables and the collection asset view"""
+    print('Writing collection table')
+    _write_gpkg_table(conn,'dce_collection',gdf_c)
+    print('Writing asset table')
+    _write_gpkg_table(conn,'dce_asset',df_a)
+    print('Writing collection asset view')
+    if 'collection_id' in gdf_c.columns and 'collection_id' in df_a.columns:
+        _create_collection_asset_view(conn,gdf_c,df_a)
+    else:
+        _write_gpkg_table(conn,'dce_collection_asset',gdf_ca)
+
+def _init_gpkg(conn:sqlite3.Connection):
+    """Creates the geopackage metadata tables (GeoPackage 1.2)"""
+    conn.execute('PRAGMA application_id = 1196444487')
+    conn.execute('PRAGMA user_version = 10200')
+    conn.execute('CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL,srs_id INTEGER NOT NULL PRIMARY KEY,'
+                 'organization TEXT NOT NULL,organization_coordsys_id INTEGER NOT NULL,'
+                 'definition TEXT NOT NULL,description TEXT)')
+    conn.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)',
+                     [('Undefined cartesian SRS',-1,'NONE',-1,'undefined','undefined cartesian coordinate reference system'),
+                      ('Undefined geographic SRS',0,'NONE',0,'undefined','undefined geographic coordinate reference system')])
+    conn.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY,data_type TEXT NOT NULL,"
+                 "identifier TEXT UNIQUE,description TEXT DEFAULT '',"
+                 "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),"
+                 "min_x DOUBLE,min_y DOUBLE,max_x DOUBLE,max_y DOUBLE,srs_id INTEGER,"
+                 "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+    conn.execute('CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL,column_name TEXT NOT NULL,'
+                 'geometry_type_name TEXT NOT NULL,srs_id INTEGER NOT NULL,z TINYINT NOT NULL,m TINYINT NOT NULL,'
+                 'CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),'
+                 'CONSTRAINT uk_gc_table_name UNIQUE (table_name),'
+                 'CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),'
+                 'CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))')
+    conn.execute('CREATE TABLE gpkg_extensions (table_name TEXT,column_name TEXT,extension_name TEXT NOT NULL,'
+                 'definition TEXT NOT NULL,scope TEXT NOT NULL,'
+                 'CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))')
+
+def _gpkg_srs_id(conn:sqlite3.Connection,crs)->int:
+    """Returns the srs_id of crs, added to gpkg_spatial_ref_sys if needed (0 when crs is None)"""
+    if crs is None:
+        return 0
+    epsg = crs.to_epsg()
+    srs_id = epsg if epsg else 100000
+    if conn.execute('SELECT 1 FROM gpkg_spatial_ref_sys WHERE srs_id = ?',(srs_id,)).fetchone() is None:
+        conn.execute('INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)',
+                     (crs.name,srs_id,'EPSG' if epsg else 'NONE',srs_id,crs.to_wkt('WKT1_GDAL'),None))
+    return srs_id
+
+def _sql_type(dtype)->str:
+    """Returns the geopackage column type of a pandas dtype"""
+    if pandas.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    if pandas.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pandas.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+def _write_gpkg_table(conn:sqlite3.Connection,table:str,df:pandas.DataFrame):
+    """
+    Writes a (Geo)DataFrame as a new geopackage table with an integer fid, 
+    a features table with its rtree spatial index for a GeoDataFrame, 
+    otherwise an attributes table. The index is filled once the rows are inserted.
+    """
+    _create_gpkg_table(conn,table,df)
+    _insert_gpkg_rows(conn,table,df)
+    if isinstance(df,geopandas.GeoDataFrame):
+        _index_gpkg_table(conn,table)
+
+def _create_gpkg_table(conn:sqlite3.Connection,table:str,df:pandas.DataFrame,geom_type:str=None):
+    """
+    Creates an empty geopackage table with the columns of df and registers it
+    (features for a GeoDataFrame, otherwise attributes). The geometry type is the 
+    one of df unless geom_type is given. The extent is set by _index_gpkg_table().
+    """
+    is_features = isinstance(df,geopandas.GeoDataFrame)
+    columns = [col for col in df.columns if not (is_features and col == df.geometry.name)]
+    definitions = ['"fid" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL']
+    if is_features:
+        if geom_type is None:
+            geom_types = df.geometry.geom_type.dropna().unique()
+            geom_type = geom_types[0].upper() if len(geom_types) == 1 else 'GEOMETRY'
+        srs_id = _gpkg_srs_id(conn,df.crs)
+        definitions.append(f'"geom" {geom_type}')
+    definitions.extend(f'"{col}" {_sql_type(df[col].dtype)}' for col in columns)
+    conn.execute(f'CREATE TABLE "{table}" ({", ".join(definitions)})')
+    if not is_features:
+        conn.execute("INSERT INTO gpkg_contents (table_name,data_type,identifier) VALUES (?,'attributes',?)",
+                     (table,table))
+        return
+    conn.execute("INSERT INTO gpkg_contents (table_name,data_type,identifier,srs_id) "
+                 "VALUES (?,'features',?,?)",(table,table,srs_id))
+    conn.execute('INSERT INTO gpkg_geometry_columns VALUES (?,?,?,?,0,0)',(table,'geom',geom_type,srs_id))
+
+def _insert_gpkg_rows(conn:sqlite3.Connection,table:str,df:pandas.DataFrame):
+    """Appends the rows of a (Geo)DataFrame to a geopackage table created by _create_gpkg_table()"""
+    is_features = isinstance(df,geopandas.GeoDataFrame)
+    columns = [col for col in df.columns if not (is_features and col == df.geometry.name)]
+    values = df[columns].astype(object).where(df[columns].notna(),None)
+    names = list(columns)
+    rows = [values[col].tolist() for col in columns]
+    if is_features:
+        srs_id, = conn.execute('SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?',(table,)).fetchone()
+        names.insert(0,'geom')
+        rows.insert(0,[_gpkg_blob(geom,srs_id) for geom in df.geometry])
+    sql_names = ','.join(f'"{col}"' for col in names)
+    conn.executemany(f'INSERT INTO "{table}" ({sql_names}) VALUES ({",".join("?"*len(names))})',
+                     zip(*rows))
+
+def _index_gpkg_table(conn:sqlite3.Connection,table:str):
+    """
+    Creates and fills the rtree spatial index of a features table (gpkg_rtree_index 
+    extension) from the inserted rows, then its triggers, and sets the table extent
+    """
+    rtree = f'rtree_{table}_geom'
+    conn.execute(f'CREATE VIRTUAL TABLE "{rtree}" USING rtree(id, minx, maxx, miny, maxy)')
+    conn.execute(f'INSERT INTO "{rtree}" SELECT "fid",ST_MinX("geom"),ST_MaxX("geom"),ST_MinY("geom"),ST_MaxY("geom") '
+                 f'FROM "{table}" WHERE "geom" NOT NULL AND NOT ST_IsEmpty("geom")')
+    conn.execute(f'UPDATE gpkg_contents SET (min_x,min_y,max_x,max_y) = '
+                 f'(SELECT min(minx),min(miny),max(maxx),max(maxy) FROM "{rtree}") WHERE table_name = ?',(table,))
+    conn.execute("INSERT INTO gpkg_extensions VALUES (?,'geom','gpkg_rtree_index',"
+                 "'http://www.geopackage.org/spec120/#extension_rtree','write-only')",(table,))
+    insert = (f'INSERT OR REPLACE INTO "{rtree}" VALUES (NEW."fid",ST_MinX(NEW."geom"),ST_MaxX(NEW."geom"),'
+              'ST_MinY(NEW."geom"),ST_MaxY(NEW."geom"));')
+    triggers = {
+        'insert':f'AFTER INSERT ON "{table}" WHEN (NEW."geom" NOT NULL AND NOT ST_IsEmpty(NEW."geom")) BEGIN {insert} END',
+        'update1':f'AFTER UPDATE OF "geom" ON "{table}" WHEN OLD."fid" = NEW."fid" AND '
+                  f'(NEW."geom" NOTNULL AND NOT ST_IsEmpty(NEW."geom")) BEGIN {insert} END',
+        'update2':f'AFTER UPDATE OF "geom" ON "{table}" WHEN OLD."fid" = NEW."fid" AND '
+                  f'(NEW."geom" ISNULL OR ST_IsEmpty(NEW."geom")) BEGIN DELETE FROM "{rtree}" WHERE id = OLD."fid"; END',
+        'update3':f'AFTER UPDATE ON "{table}" WHEN OLD."fid" != NEW."fid" AND '
+                  f'(NEW."geom" NOTNULL AND NOT ST_IsEmpty(NEW."geom")) BEGIN DELETE FROM "{rtree}" WHERE id = OLD."fid"; {insert} END',
+        'update4':f'AFTER UPDATE ON "{table}" WHEN OLD."fid" != NEW."fid" AND '
+                  f'(NEW."geom" ISNULL OR ST_IsEmpty(NEW."geom")) BEGIN DELETE FROM "{rtree}" WHERE id IN (OLD."fid", NEW."fid"); END',
+        'delete':f'AFTER DELETE ON "{table}" WHEN OLD."geom" NOT NULL BEGIN DELETE FROM "{rtree}" WHERE id = OLD."fid"; END'}
+    for suffix,trigger in triggers.items():
+        conn.execute(f'CREATE TRIGGER "{rtree}_{suffix}" {trigger}')
+
+def _create_collection_asset_view(conn:sqlite3.Connection,gdf_c:geopandas.GeoDataFrame,df_a:pandas.DataFrame):
+    """
+    Creates dce_collection_asset, a features view of dce_collection joined with dce_asset 
+    on collection_id, with the columns of gdf_c.merge(df_a,on='collection_id')
+    """
+    c_columns = [col for col in gdf_c.columns if col != gdf_c.geometry.name]
+    a_columns = [col for col in df_a.columns if col != 'collection_id']
+    select = ['c."geom" AS "geom"']
+    for col in c_columns:
+        alias = f'{col}_x' if col in a_columns else col
+        select.append(f'c."{col}" AS "{alias}"')
+    for col in a_columns:
+        alias = f'{col}_y' if col in c_columns else col
+        select.append(f'a."{col}" AS "{alias}"')
+    conn.execute(f'CREATE VIEW "dce_collection_asset" AS SELECT {", ".join(select)} '
+                 'FROM "dce_collection" c JOIN "dce_asset" a ON a."collection_id" = c."collection_id"')
+    geom_type,srs_id = conn.execute('SELECT geometry_type_name,srs_id FROM gpkg_geometry_columns '
+                                    "WHERE table_name = 'dce_collection'").fetchone()
+    conn.execute("INSERT INTO gpkg_contents (table_name,data_type,identifier,min_x,min_y,max_x,max_y,srs_id) "
+                 "SELECT 'dce_collection_asset','features','dce_collection_asset',min_x,min_y,max_x,max_y,srs_id "
+                 "FROM gpkg_contents WHERE table_name = 'dce_collection'")
+    conn.execute("INSERT INTO gpkg_geometry_columns VALUES ('dce_collection_asset','geom',?,?,0,0)",
+                 (geom_type,srs_id))
+
+def _update_describe(name:pathlib.Path,
+                     url:str,
+                     bbox:str=None,
+                     dt:str=None,
+                     cols:str=None,
+                     search:bool=False):
+    """
+    Scrapes the collections changed since the last run and upserts them in the geopackage
+
+    The version of each collection (STAC 'updated' or the ETag of 
+    /collections/{id}) is saved in the dce_describe_state table. The rows of 
+    the changed and removed collections are deleted and inserted again in 
+    all the tables, in a single transaction. When the geopackage does not 
+    exist, it is created with all the collections. With cols, the other
+    collections of the geopackage are left as is.
+
+    With search=True, the version is still the collection 'updated' or ETag,
+    new items in a collection whose metadata did not change are not searched
+    again, run a full search (incremental=False) to pick them up.
+
+    Parameters
+    ----------
+    name : pathlib.Path
+        The geopackage name and path.
+    url : str
+        The root STAC API url.
+    bbox : str, optional
+        BBOX search filter (search=True). The default is None.
+    dt : str, optional
+        Datetime search filter (search=True). The default is None.
+    cols : str, optional
+        A csv of collections. The default is None, all the collections.
+    search : bool, optional
+        If the items are scraped (describe.search()). The default is False.
+
+    Returns
+    -------
+    list
+        The collection ids scraped again.
+
+    """
+    search_filter = f'bbox={bbox};datetime={dt}' if search else ''
+    state = _read_describe_state(name,url) if name.is_file() else {}
+    colls = _list_collections(url)
+    # The removed collections are the ones no longer in the API, not the ones
+    # filtered out by cols, their rows and state are left as is
+    api_ids = {coll['id'] for coll in colls}
+    if cols:
+        wanted = cols.split(',')
+        colls = [coll for coll in colls if coll['id'] in wanted]
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        versions = list(executor.map(lambda coll:_collection_version(coll,url,state.get(coll['id'])), colls))
+    versions = {coll['id']:(updated,etag,search_filter) for coll,(updated,etag) in zip(colls,versions)}
+    # Without updated and ETag, the collection is always scraped
+    changed = [cid for cid,version in versions.items()
+               if version[:2] == (None,None) or state.get(cid) != version]
+    removed = [cid for cid in state if cid not in api_ids]
+    print(f'{len(changed)} changed and {len(removed)} removed collection(s) out of {len(versions)} for {url}')
+    if not changed and not removed:
+        return []
+
+    gdf_i = None
+    if search:
+        gdf_c = df_a = gdf_ca = None
+        if changed:
+            gdf_i,df_a = _items_assets_to_gdf(url,bbox,dt,','.join(changed))
+            if df_a is not None:
+                gdf_c,gdf_ca = search_to_gdf(url,df_a)
+    else:
+        gdf_c,df_a,gdf_ca = _collections_json_to_gdf([coll for coll in colls if coll['id'] in changed],url)
+
+    created = not name.is_file()
+    if created:
+        if gdf_c is None or gdf_c.empty:
+            print(f'No collections for api requests : {url}')
+            return []
+        print(f'Writing to file {name.absolute()}')
+        _create_db(name,gdf_c,df_a,gdf_ca,gdf_i)
+    else:
+        print(f'Upserting {len(changed)} collection(s) into {name.absolute()}')
+    
+    conn = _gpkg_connect(name)
+    try:
+        # A single transaction, the geopackage is never partially updated
+        with conn:
+            ids = changed + removed
+            if not created:
+                tables = [('dce_collection',gdf_c),('dce_collection_asset',gdf_ca),('dce_asset',df_a)]
+                if search:
+                    tables.append(('dce_item',gdf_i))
+                for table,df in tables:
+                    _upsert_rows(conn,table,df,url,ids)
+            conn.execute('CREATE TABLE IF NOT EXISTS dce_describe_state '
+                         '(collection_id TEXT, stac_url TEXT, updated TEXT, etag TEXT, search_filter TEXT, '
+                         'PRIMARY KEY (collection_id, stac_url))')
+            conn.executemany('DELETE FROM dce_describe_state WHERE collection_id = ? AND stac_url = ?',
+                             [(cid,url) for cid in ids])
+            conn.executemany('INSERT INTO dce_describe_state VALUES (?,?,?,?,?)',
+                             [(cid,url,*versions[cid]) for cid in changed])
+    finally:
+        conn.close()
+    return changed
+
+def _collection_version(coll:dict,url:str,previous:tuple=None)->tuple:
+    """
+    Returns the version (updated,etag) of a collection
+
+    The STAC 'updated' of the collection is used when available, otherwise
+    the ETag of /collections/{id} with a conditional request (304 when unchanged)
+    """
+    updated = coll.get('updated') or coll.get('properties',{}).get('updated')
+    if updated:
+        return str(updated),None
+    headers = {}
+    if previous and previous[1]:
+        headers['If-None-Match'] = previous[1]
+    r = requests.get(f'{url}/collections/{coll["id"]}',headers=headers)
+    if r.status_code == 304:
+        return tuple(previous[:2])
+    etag = r.headers.get('ETag') if r.status_code == 200 else None
+    return None,etag if isinstance(etag,str) else None
+
+def _read_describe_state(name:pathlib.Path,url:str)->dict:
+    """Returns the {collection_id:(updated,etag,search_filter)} saved in the geopackage for url"""
+    conn = sqlite3.connect(name)
+    try:
+        rows = conn.execute('SELECT collection_id,updated,etag,search_filter FROM dce_describe_state '
+                            'WHERE stac_url = ?',(url,)).fetchall()
+    except sqlite3.OperationalError:
+        # Geopackage created by a full run
+        rows = []
+    finally:
+        conn.close()
+    return {row[0]:tuple(row[1:]) for row in rows}
+
+def _gpkg_connect(name:pathlib.Path)->sqlite3.Connection:
+    """
+    Returns a sqlite3 connection to a geopackage with the ST_ functions used
+    by the GDAL spatial index triggers (ST_IsEmpty, ST_MinX, ST_MaxX, ST_MinY, ST_MaxY)
+    """
+    conn = sqlite3.connect(name)
+    conn.create_function('ST_IsEmpty',1,lambda blob:int(_gpkg_envelope(blob) is None),deterministic=True)
+    for i,func in enumerate(['ST_MinX','ST_MaxX','ST_MinY','ST_MaxY']):
+        conn.create_function(func,1,lambda blob,i=i:(_gpkg_envelope(blob) or [None]*4)[i],deterministic=True)
+    return conn
+
+def _gpkg_blob(geom,srs_id:int=4326):
+    """Returns the geopackage binary (header with envelope and WKB) of a shapely geometry"""
+    if geom is None:
+        return None
+    if geom.is_empty:
+        # Empty flag, no envelope, little endian
+        return b'GP\x00\x11' + struct.pack('<i',srs_id) + geom.wkb
+    minx,miny,maxx,maxy = geom.bounds
+    # Envelope [minx,maxx,miny,maxy], little endian
+    return b'GP\x00\x03' + struct.pack('<i4d',srs_id,minx,maxx,miny,maxy) + geom.wkb
+
+def _gpkg_envelope(blob)->tuple:
+    """Returns the (minx,maxx,miny,maxy) of a geopackage binary, None if empty"""
+    if blob is None or bytes(blob[:2]) != b'GP':
+        return None
+    flags = blob[3]
+    if flags & 0x10:
+        return None
+    order = '<' if flags & 0x01 else '>'
+    if (flags >> 1) & 0x07:
+        return struct.unpack(f'{order}4d',blob[8:40])
+    minx,miny,maxx,maxy = shapely.wkb.loads(bytes(blob[8:])).bounds
+    return minx,maxx,miny,maxy
+
+def _upsert_rows(conn:sqlite3.Connection,
+                 table:str,
+                 df:pandas.DataFrame,
+                 url:str,
+                 collection_ids:list):
+    """
+    Deletes the rows of collection_ids from url in table, then inserts the rows of df
+    (the geometry is written in the geopackage geometry column of the table)
+    """
+    kind = conn.execute('SELECT type FROM sqlite_master WHERE name = ?',(table,)).fetchone()
+    if kind is None:
+        print(f'WARNING : no table {table} to update')
+        return
+    if kind[0] == 'view':
+        # dce_collection_asset follows its tables
+        return
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+    url_col = 'stac_url' if 'stac_url' in columns else 'stac_url_x'
+    conn.executemany(f'DELETE FROM "{table}" WHERE collection_id = ? AND "{url_col}" = ?',
+                     [(cid,url) for cid in collection_ids])
+    if df is None or df.empty:
+        return
+    geom_col = conn.execute('SELECT column_name,srs_id FROM gpkg_geometry_columns WHERE table_name = ?',
+                            (table,)).fetchone()
+    names = [col for col in df.columns if col in columns]
+    values = df[names].astype(object).where(df[names].notna(),None)
+    if geom_col and isinstance(df,geopandas.GeoDataFrame):
+        names.append(geom_col[0])
+        values[geom_col[0]] = [_gpkg_blob(geom,geom_col[1]) for geom in df.geometry]
+    sql_names = ','.join(f'"{col}"' for col in names)
+    conn.executemany(f'INSERT INTO "{table}" ({sql_names}) VALUES ({",".join("?"*len(names))})',
+                     values.itertuples(index=False,name=None))
+    conn.execute('UPDATE gpkg_contents SET last_change = strftime(\'%Y-%m-%dT%H:%M:%fZ\',\'now\') '
+                 'WHERE table_name = ?',(table,))
+
 def _write_to_json(g_name:str,
                    name:str,
                    gdf_c:geopandas.GeoDataFrame,
@@ -710,6 +1323,69 @@ def _write_to_json(g_name:str,
                  orient='records')
     return
 
+def _write_to_parquet(p_dir:pathlib.Path,
+                      df_a:pandas.DataFrame,
+                      gdf_i:geopandas.GeoDataFrame):
+    """
+    Writes dce_item and dce_asset to GeoParquet datasets partitioned by collection
+
+    p_dir/dce_item/collection_id=<id>/*.parquet and p_dir/dce_asset/collection_id=<id>/*.parquet
+    The items are sorted by their bbox inside each collection and the bbox is 
+    written as a covering struct column (xmin,ymin,xmax,ymax, GeoParquet 1.1), 
+    so the row groups outside an extent are skipped from their statistics.
+    Read back with extract.read_describe_parquet().
+
+    Parameters
+    ----------
+    p_dir : pathlib.Path
+        The output directory, the existing datasets are replaced.
+    df_a : pandas.DataFrame
+        The asset df.
+    gdf_i : geopandas.GeoDataFrame
+        The item gdf.
+
+    Returns
+    -------
+    None.
+
+    """
+    pyarrow,dataset = import_pyarrow()
+    print(f'Writing item and asset parquet {p_dir}')
+    
+    bounds = gdf_i.geometry.bounds
+    order = numpy.lexsort((bounds.miny.to_numpy(),bounds.minx.to_numpy(),gdf_i.collection_id.to_numpy()))
+    gdf_i = gdf_i.iloc[order]
+    bounds = bounds.iloc[order]
+    columns = [col for col in gdf_i.columns if col != gdf_i.geometry.name]
+    table = pyarrow.Table.from_pandas(pandas.DataFrame(gdf_i[columns]),preserve_index=False)
+    table = table.append_column('geometry',pyarrow.array(gdf_i.geometry.to_wkb().tolist(),pyarrow.binary()))
+    table = table.append_column('bbox',pyarrow.StructArray.from_arrays(
+        [pyarrow.array(bounds[col].to_numpy()) for col in ('minx','miny','maxx','maxy')],
+        names=['xmin','ymin','xmax','ymax']))
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'geo':json.dumps(_geoparquet_metadata(gdf_i)).encode()})
+
+    for layer,data in (('dce_item',table),('dce_asset',pyarrow.Table.from_pandas(df_a,preserve_index=False))):
+        dataset.write_dataset(data,p_dir/layer,format='parquet',
+                              partitioning=['collection_id'],partitioning_flavor='hive',
+                              existing_data_behavior='delete_matching',
+                              max_rows_per_group=_PARQUET_ROW_GROUP,
+                              min_rows_per_group=min(_PARQUET_ROW_GROUP,max(len(data),1)))
+    return
+
+def _geoparquet_metadata(gdf:geopandas.GeoDataFrame)->dict:
+    """The GeoParquet 1.1 'geo' metadata of the geometry column, with the bbox covering column"""
+    valid = gdf.geometry.notna() & ~gdf.geometry.is_empty
+    column = {'encoding':'WKB',
+              'geometry_types':sorted(gdf.geometry[valid].geom_type.unique().tolist()),
+              'covering':{'bbox':{'xmin':['bbox','xmin'],'ymin':['bbox','ymin'],
+                                  'xmax':['bbox','xmax'],'ymax':['bbox','ymax']}}}
+    if valid.any():
+        column['bbox'] = gdf.geometry[valid].total_bounds.tolist()
+    if gdf.crs is not None:
+        column['crs'] = gdf.crs.to_json_dict()
+    return {'version':'1.1.0','primary_column':'geometry','columns':{'geometry':column}}
+
 #functions wrapper for CLI
 def wrapper_collections(args):
     output_path=args.output_path
@@ -718,7 +1394,7 @@ def wrapper_collections(args):
     for url in urls.split(','):
         list_urls.append(url)
     
-    collections(out_file=output_path, urls=list_urls)
+    collections(out_file=output_path, urls=list_urls, incremental=args.incremental)
     return
     
 def wrapper_search(args):
@@ -738,7 +1414,10 @@ def wrapper_search(args):
            bbox=bbox, 
            datetime_filter=datetime, 
            collections=collections, 
-           geojson=geojson)
+           geojson=geojson,
+           incremental=args.incremental,
+           parquet=args.parquet,
+           stream=args.stream)
     return
 
 # CLI
@@ -759,6 +1438,9 @@ def _handle_cli():
                         type=str,
                         default='https://datacube.services.geo.ca/api',
                         help="List of STAC API urls to scrape. The default is None, which scrapes the collecitons available inside the datacube prod ['https://datacube.services.geo.ca/api'].")
+    parser_collections.add_argument('-incremental',
+                        action='store_true',
+                        help='Only scrape the collections changed since the last run and upsert them in the existing gpkg.')
     parser_collections.set_defaults(func=wrapper_collections)
     
     #To call the decribe.search()
@@ -788,6 +1470,15 @@ def _handle_cli():
                         type=bool,
                         default=False,
                         help='If geojson output should be created. The default is False.')
+    parser_search.add_argument('-parquet',
+                        action='store_true',
+                        help='If GeoParquet output of the items and assets, partitioned by collection, should be created (requires pyarrow).')
+    parser_search.add_argument('-stream',
+                        action='store_true',
+                        help='Write the search results to the gpkg page by page with bounded memory.')
+    parser_search.add_argument('-incremental',
+                        action='store_true',
+                        help='Only search the collections changed since the last run and upsert them in the existing gpkg.')
     parser_search.set_defaults(func=wrapper_search)
     
     
@@ -37,16 +37,23 @@ Developed by:
 
 """
 # Python standard library
+import base64
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache, partial
+import hashlib
 # from functools import wraps
+import json
 import math
 import os
 import pathlib
 from pathlib import Path
 import re
+import shutil
 import sys
 from tempfile import TemporaryDirectory
-from typing import Union, Tuple
+import time
+from typing import NamedTuple, Union, Tuple
 import xml.etree.ElementTree as et
 
 
@@ -57,6 +64,7 @@ import pandas
 import numpy
 import rasterio
 from rasterio import warp
+from rasterio.io import MemoryFile
 from rasterio.transform import Affine, from_origin
 from rasterio.shutil import copy as rscopy
 import requests
@@ -64,6 +72,7 @@ from shapely.geometry import box, mapping, shape
 import shapely
 import rioxarray
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from rasterio.warp import aligned_target, calculate_default_transform
 
 # Local code
@@ -73,7 +82,8 @@ _DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
 if _DIR_NEEDED not in sys.path:
     sys.path.insert(0,_DIR_NEEDED)
 
-from ccmeo_datacube.utils import nrcan_requests_ca_patch, valid_rfc3339
+from ccmeo_datacube.utils import import_pyarrow, nrcan_requests_ca_patch, valid_rfc3339
+import ccmeo_datacube.geometry as dcg
 
 # Decorators
 def win_ssl_patch(f):
@@ -131,7 +141,8 @@ def wcs(mosaic:bool,
          out_dir:str,
          method:str,
          overviews:bool,
-         suffix:str=None)->str:
+         suffix:str=None,
+         wcs_cache:str=None)->str:
     
     dex=DatacubeExtract()
     #Condition : if hrdem-wcs is asked along with mosaic==True, a message is returned to the user
@@ -139,8 +150,8 @@ def wcs(mosaic:bool,
         print('INFORMATION : hrdem-wcs collection is already a mosaic, no mosaic processing is done, normal extraction will be performed...')
     
     print(f'collection: {collection}, asset: {asset}')
-    poly = dex.bbox_to_poly(bbox=bbox)
-    poly_dic = dex.poly_to_dict(poly)
+    poly = dcg.bbox_to_poly(bbox)
+    poly_dic = dcg.poly_to_dict(poly)
     study_area = 'wcs_extract'
     srv_id='elevation'
         # datetime filter should not be passed to tifftag_datetime
@@ -175,7 +186,8 @@ def wcs(mosaic:bool,
                                             suffix=suffix,
                                             method=method,
                                             overviews=overviews,
-                                            tifftag_datetime=tifftag_datetime)
+                                            tifftag_datetime=tifftag_datetime,
+                                            wcs_cache=wcs_cache)
         return out_file
     
     
@@ -236,16 +248,8 @@ def cog_chip(url:str,
                                                   bbox_crs=bbox_crs,
                                                   resampling_method=method)
     if profile and params:
-        if resolution and resolution != in_res :
-            if suffix:
-                out_file = out_dir.joinpath(f"{clip_file.stem}-clip-{profile['crs'].to_epsg()}-resample-{resolution}m-{suffix}{clip_file.suffix}")
-            else:
-                out_file = out_dir.joinpath(f"{clip_file.stem}-clip-{profile['crs'].to_epsg()}-resample-{resolution}m{clip_file.suffix}")
-        else:
-            if suffix:
-                out_file = out_dir.joinpath(f"{clip_file.stem}-clip-{profile['crs'].to_epsg()}-{suffix}{clip_file.suffix}")
-            else:
-                out_file = out_dir.joinpath(f"{clip_file.stem}-clip-{profile['crs'].to_epsg()}{clip_file.suffix}")
+        out_file = cog_chip_file_name(url, out_dir, profile['crs'].to_epsg(), 
+                                      resolution, in_res, suffix)
         
         # print(clip_file)
         print(out_file)
@@ -262,6 +266,19 @@ def cog_chip(url:str,
         return None
 
 
+
+def cog_chip_file_name(url:str, out_dir, epsg:int, resolution:float, in_res:int, suffix:str):
+    """Return the path of the cog_chip() output of url for the resolution"""
+    clip_file = pathlib.Path(url)
+    out_dir = pathlib.Path(out_dir)
+    if resolution and resolution != in_res :
+        if suffix:
+            return out_dir.joinpath(f"{clip_file.stem}-clip-{epsg}-resample-{resolution}m-{suffix}{clip_file.suffix}")
+        return out_dir.joinpath(f"{clip_file.stem}-clip-{epsg}-resample-{resolution}m{clip_file.suffix}")
+    if suffix:
+        return out_dir.joinpath(f"{clip_file.stem}-clip-{epsg}-{suffix}{clip_file.suffix}")
+    return out_dir.joinpath(f"{clip_file.stem}-clip-{epsg}{clip_file.suffix}")
+
     
 def mosaic(df:pandas.DataFrame,
             orderby:str,
@@ -274,7 +291,10 @@ def mosaic(df:pandas.DataFrame,
             out_crs:str,
             out_dir:str,
             out_file:str,
-            overviews:bool)->dict:
+            overviews:bool,
+            engine:str='warped',
+            resume:bool=False,
+            reducers:list=None)->dict:
     """
     Mosaics a list of urls, reverse painters based on date or resolution
 
@@ -308,6 +328,16 @@ def mosaic(df:pandas.DataFrame,
         DESCRIPTION.
     overviews : bool
         DESCRIPTION.
+    engine : str, optional
+        Name of the mosaic engine, one of the keys of MOSAIC_ENGINES
+        ('warped', 'window' or 'gdal'). The default is 'warped'.
+    resume : bool, optional
+        Continue a mosaic interrupted in a previous run from its checkpoint
+        instead of starting over. The default is False.
+    reducers : list, optional
+        Per pixel reducers of all the files ('first', 'min', 'max', 'mean', 'count', 'median'),
+        one band per reducer, see reduce_mosaic(). engine is not used when reducers are given.
+        The default is None, which keeps the first valid value in the order of the files.
 
     Returns
     -------
@@ -317,7 +347,11 @@ def mosaic(df:pandas.DataFrame,
 
     """
     
-    dex=DatacubeExtract()
+    if reducers:
+        mosaic_func = partial(reduce_mosaic, reducers=reducers)
+        engine = 'reduce'
+    else:
+        mosaic_func = mosaic_engine(engine)
     #potentiellement prendre le bord dans le futur
     out_crs = rasterio.crs.CRS.from_string(out_crs)
         
@@ -354,26 +388,22 @@ def mosaic(df:pandas.DataFrame,
                                      new_dtype=in_meta['dtype'])
 
     #Create list of parameters and output profile using the same tool as the extract_cogchips()
-    list_params=[]
-    for url in urls:
-        dict_file = {}
-        params = get_extract_params(out_profile, 
-                                        src_res=df.query('url==@url')['item_resolution'].values[0],#row.item_resolution, 
-                                        src_crs=f"EPSG:{df.query('url==@url')['item_epsg'].values[0]}", 
-                                        dst_res=resolution, 
-                                        resampling_method=method)
-        
-        dict_file['file']=url
-        dict_file['params']=params
-        list_params.append(dict_file)
+    list_params = plan_mosaic(df, urls, out_profile, resolution, method)
+
+    #Sources and settings saved in the mosaic metadata for update_mosaic()
+    footprints = source_footprints(urls, out_crs)
+    tags = mosaic_tags(df, urls, footprints, orderby=orderby, desc=desc,
+                       method=method, resolution=resolution, reducers=reducers)
 
-    print('Starting mosaic process for each assets...')
+    print(f'Starting mosaic process for each assets with engine "{engine}"...')
+    dict_mosaic = None
     #Call the mosaic tool 
     if list_params and out_profile:
         #TODO : validate that the file does not exist or delete file
         out_path = pathlib.Path(os.path.join(out_dir, out_file))
-        dex.check_outfile(out_path)
-        files_used, file_unused = warped_mosaic(list_params, out_path, out_profile, overviews=overviews)
+        DatacubeExtract.check_outfile(out_path)
+        files_used, file_unused = mosaic_func(list_params, out_path, out_profile, 
+                                              overviews=overviews, resume=resume, tags=tags)
         dict_mosaic = {out_path:files_used}
         #TODO : do something with the file unused
     else:
@@ -381,6 +411,535 @@ def mosaic(df:pandas.DataFrame,
 
     return dict_mosaic
 
+@win_ssl_patch
+def batch_mosaic(df:pandas.DataFrame,
+                 aoi_profiles:dict,
+                 out_paths:dict,
+                 orderby:str='date',
+                 desc:bool=True,
+                 method:str='nearest',
+                 overviews:bool=False,
+                 max_open:int=32)->list:
+    """
+    Create one first valid mosaic per area of interest (AOI) from the same list of items, 
+    each source is opened once and each of its blocks is warped once, the pixels are then 
+    written to every AOI output that needs them (neighbouring or overlapping AOIs share
+    the reads).
+
+    The AOI grids must share the same crs and resolution and be aligned on the same
+    lattice, which is the case of the grids of get_output_dimension() 
+    (lowest common multiple of the resolutions).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Items of all the AOIs (asset_urls() of the union of the AOIs).
+    aoi_profiles : dict
+        {aoi name:output profile} 
+    out_paths : dict
+        {aoi name:output path}
+    orderby : str, optional
+        Order of the items, see order_by(). The default is 'date'.
+    desc : bool, optional
+        Descending order. The default is True (latest on top).
+    method : str, optional
+        Resampling method. The default is 'nearest'.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cogs. The default is False.
+    max_open : int, optional
+        Maximum number of AOI outputs opened at the same time, the outputs are
+        opened when first written and the least recently used is closed. 
+        The default is 32.
+
+    Returns
+    -------
+    list
+        [{out_path:files used}, ...] one dictionnary per AOI with at least one file used.
+
+    """
+    names = list(aoi_profiles)
+    if not names:
+        return []
+    first = aoi_profiles[names[0]]
+    out_crs = first['crs']
+    res = first['transform'].a
+    nodata = first['nodata']
+    resampling = resample_value(method)
+    # AOI bounds (left, bottom, right, top) in out_crs
+    aoi_bounds = numpy.array([rasterio.transform.array_bounds(p['height'], p['width'], p['transform'])
+                              for p in aoi_profiles.values()])
+
+    df, urls = order_by(df, method=orderby, desc=desc)
+    footprints = source_footprints(urls, out_crs)
+    used = {name:[] for name in names}
+
+    env = _mosaic_env()
+    with env:
+        outputs = OrderedDict()
+        out_profiles = {name:_add_bigtiff(aoi_profiles[name], verbose=False) for name in names}
+        # Outputs of a previous run are not reused, see _open_output_cached()
+        for name in names:
+            if os.path.exists(f'{out_paths[name]}.temp'):
+                os.remove(f'{out_paths[name]}.temp')
+        try:
+            for url in urls:
+                left, bottom, right, top = footprints[url]
+                hits = numpy.nonzero((aoi_bounds[:, 0] < right) & (aoi_bounds[:, 2] > left) &
+                                     (aoi_bounds[:, 1] < top) & (aoi_bounds[:, 3] > bottom))[0]
+                if not len(hits):
+                    continue
+                print(''.rjust(75, '-'))
+                print(f'{url} : {len(hits)} AOI(s)')
+                # Grid of the union of the AOIs under the source, on the lattice of the AOI grids
+                u_left = max(aoi_bounds[hits, 0].min(), math.floor(left/res)*res)
+                u_top = min(aoi_bounds[hits, 3].max(), math.ceil(top/res)*res)
+                u_right = min(aoi_bounds[hits, 2].max(), math.ceil(right/res)*res)
+                u_bottom = max(aoi_bounds[hits, 1].min(), math.floor(bottom/res)*res)
+                u_transform = from_origin(u_left, u_top, res, res)
+                u_width = int(round((u_right - u_left)/res))
+                u_height = int(round((u_top - u_bottom)/res))
+                if u_width <= 0 or u_height <= 0:
+                    continue
+                # Offsets (row, col) of each AOI grid in the union grid
+                offsets = {i:(int(round((u_top - aoi_bounds[i, 3])/res)),
+                              int(round((aoi_bounds[i, 0] - u_left)/res))) for i in hits}
+
+                with rasterio.open(url) as src:
+                    with rasterio.vrt.WarpedVRT(src, crs=out_crs, transform=u_transform,
+                                                width=u_width, height=u_height,
+                                                resampling=resampling,
+                                                nodata=nodata) as vrt:
+                        for row in range(0, u_height, 512):
+                            for col in range(0, u_width, 512):
+                                height = min(512, u_height - row)
+                                width = min(512, u_width - col)
+                                targets = []
+                                for i in hits:
+                                    profile = aoi_profiles[names[i]]
+                                    r0, c0 = offsets[i]
+                                    rows = (max(row, r0), min(row + height, r0 + profile['height']))
+                                    cols = (max(col, c0), min(col + width, c0 + profile['width']))
+                                    if rows[0] < rows[1] and cols[0] < cols[1]:
+                                        targets.append((i, rows, cols))
+                                if not targets:
+                                    continue
+                                # Each block of the source is warped once for all the AOIs
+                                block = vrt.read(1, window=rasterio.windows.Window(col, row, width, height))
+                                valid = ~_nodata_mask(block, nodata)
+                                if not valid.any():
+                                    continue
+                                for i, rows, cols in targets:
+                                    r0, c0 = offsets[i]
+                                    part = (slice(rows[0] - row, rows[1] - row), slice(cols[0] - col, cols[1] - col))
+                                    if not valid[part].any():
+                                        continue
+                                    out_window = rasterio.windows.Window(cols[0] - c0, rows[0] - r0,
+                                                                         cols[1] - cols[0], rows[1] - rows[0])
+                                    out_img = _open_output_cached(outputs, f'{out_paths[names[i]]}.temp',
+                                                                  out_profiles[names[i]], max_open)
+                                    existing = out_img.read(1, window=out_window)
+                                    empty = _nodata_mask(existing, nodata) & valid[part]
+                                    if empty.any():
+                                        existing[empty] = block[part][empty]
+                                        out_img.write(existing, 1, window=out_window)
+                                        if url not in used[names[i]]:
+                                            used[names[i]].append(url)
+        finally:
+            for out_img in outputs.values():
+                out_img.close()
+
+        out_files = []
+        for name in names:
+            temp_file = f'{out_paths[name]}.temp'
+            if not used[name]:
+                print(f'No valid values for {name}, no output created')
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                continue
+            DatacubeExtract.check_outfile(out_paths[name])
+            _finalize_mosaic(temp_file, out_paths[name], aoi_profiles[name], overviews,
+                             resampling=resampling, used_file=used[name])
+            out_files.append({out_paths[name]:used[name]})
+    return out_files
+
+
+#Datacube standard grid, national EPSG:3979 grid shared by all the extractions
+#(same origin as extract_fabdem.datacube_standard_transform())
+STANDARD_GRID_CRS = 'EPSG:3979'
+STANDARD_GRID_ORIGIN = (-2600010.0, 3914910.0)
+#Size in pixels of the tiles of the tile store (one cog block)
+_STORE_TILE_SIZE = 512
+
+
+def standard_grid_dimension(bbox:str, bbox_crs:str, resolution:float)->Tuple[Affine,int,int]:
+    """
+    Return the grid of the bbox snapped on the datacube standard grid
+    (STANDARD_GRID_ORIGIN in STANDARD_GRID_CRS) at resolution
+
+    Returns
+    -------
+    Tuple[Affine,int,int]
+        transform, height, width
+
+    """
+    left, bottom, right, top = dcg.transform_bbox(bbox, bbox_crs, STANDARD_GRID_CRS)
+    origin_x, origin_y = STANDARD_GRID_ORIGIN
+    col_start = math.floor((left - origin_x)/resolution)
+    col_end = math.ceil((right - origin_x)/resolution)
+    row_start = math.floor((origin_y - top)/resolution)
+    row_end = math.ceil((origin_y - bottom)/resolution)
+    transform = from_origin(origin_x + col_start*resolution, origin_y - row_start*resolution,
+                            resolution, resolution)
+    return transform, row_end - row_start, col_end - col_start
+
+
+def standard_tile_transform(row:int, col:int, resolution:float)->Affine:
+    """Return the transform of the tile (row, col) of the standard grid at resolution"""
+    origin_x, origin_y = STANDARD_GRID_ORIGIN
+    size = _STORE_TILE_SIZE*resolution
+    return from_origin(origin_x + col*size, origin_y - row*size, resolution, resolution)
+
+
+def item_version(url:str, item_datetime, updated=None)->str:
+    """
+    Return the key of a version of an item in the tile store, '<file name>/<datetime>'.
+    The last update of the item is used when known, so a modified item gets new tiles.
+    """
+    stamp = updated if updated is not None and not pandas.isna(updated) else item_datetime
+    stamp = re.sub(r'[^0-9A-Za-z]', '', str(stamp)) or 'na'
+    return f'{pathlib.Path(str(url)).stem}/{stamp}'
+
+
+def tile_store_path(tile_store, collection:str, asset:str, version:str, 
+                    resolution:float, row:int, col:int,
+                    method:str='nearest', dtype:str=None, nodata=None)->pathlib.Path:
+    """
+    Return the path of a tile in the tile store, 
+    <tile_store>/<collection>/<asset>/<item version>/<resolution>m/<method>/<dtype>_<nodata>/<row>_<col>.tif
+
+    The tiles warped with another resampling method, data type or nodata are other tiles.
+    """
+    nodata_key = 'none' if nodata is None else f'{nodata:g}'
+    return (pathlib.Path(tile_store)/str(collection)/str(asset or 'data')/version/
+            f'{resolution:g}m'/method/f'{dtype or "source"}_{nodata_key}'/f'{row}_{col}.tif')
+
+
+def store_tile(url:str, 
+               path:pathlib.Path, 
+               row:int, 
+               col:int, 
+               resolution:float,
+               method:str='nearest',
+               nodata=None,
+               dtype:str=None,
+               datasets:OrderedDict=None)->Union[numpy.ndarray, None]:
+    """
+    Return the values of an item on the tile (row, col) of the standard grid, 
+    read from the tile store or warped from the source and saved in the tile store.
+
+    A tile without valid values is saved as an empty '.empty' file, so the source is 
+    not warped again. The tiles are written to a temp file then moved, a tile of the 
+    store is never partially written.
+
+    Parameters
+    ----------
+    url : str
+        Path or url of the item.
+    path : pathlib.Path
+        Path of the tile in the tile store (see tile_store_path()).
+    row, col : int
+        Index of the tile on the standard grid.
+    resolution : float
+        Resolution of the tile.
+    method : str, optional
+        Resampling method. The default is 'nearest'.
+    nodata : optional
+        Nodata value of the tile. The default is None.
+    dtype : str, optional
+        Data type of the tile. The default is None, the data type of the source.
+    datasets : OrderedDict, optional
+        Sources already opened (see _open_cached()). The default is None.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        The (_STORE_TILE_SIZE, _STORE_TILE_SIZE) values, None when the tile has no valid values.
+
+    """
+    path = pathlib.Path(path)
+    empty_path = path.with_suffix('.empty')
+    if path.is_file():
+        with rasterio.open(path) as tile:
+            return tile.read(1)
+    if empty_path.is_file():
+        return None
+
+    if datasets is None:
+        datasets = OrderedDict()
+    src = _open_cached(datasets, url)
+    transform = standard_tile_transform(row, col, resolution)
+    with rasterio.vrt.WarpedVRT(src, crs=STANDARD_GRID_CRS, transform=transform,
+                                width=_STORE_TILE_SIZE, height=_STORE_TILE_SIZE,
+                                resampling=resample_value(method), nodata=nodata) as vrt:
+        data = vrt.read(1)
+    if dtype:
+        data = data.astype(dtype)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if _nodata_mask(data, nodata).all():
+        empty_path.touch()
+        return None
+    profile = update_profile(in_profile=default_profile(),
+                             new_crs=rasterio.crs.CRS.from_string(STANDARD_GRID_CRS),
+                             new_height=_STORE_TILE_SIZE,
+                             new_width=_STORE_TILE_SIZE,
+                             new_transform=transform,
+                             new_blocksize=_STORE_TILE_SIZE,
+                             new_nodata=nodata,
+                             new_dtype=data.dtype.name)
+    temp_file = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.temp')
+    with rasterio.open(temp_file, 'w', **profile) as tile:
+        tile.write(data, 1)
+    os.replace(temp_file, path)
+    return data
+
+
+def tile_mosaic(df:pandas.DataFrame,
+                bbox:str,
+                bbox_crs:str,
+                resolution:float,
+                tile_store,
+                out_path,
+                orderby:str='date',
+                desc:bool=True,
+                method:str='nearest',
+                overviews:bool=False)->Union[dict, None]:
+    """
+    Create a first valid mosaic on the datacube standard grid from the tile store.
+
+    Each item is warped on the tiles of the standard grid (STANDARD_GRID_ORIGIN in 
+    EPSG:3979, _STORE_TILE_SIZE pixels) and the tiles are saved in the tile store, keyed by 
+    collection, asset, item version, resolution, resampling method, data type, nodata 
+    and tile row/col (see tile_store_path()). 
+    The tiles already in the store are only read, so repeated or overlapping requests 
+    warp only the tiles they are the first to need. For each tile, the items are read 
+    in order until the tile is full.
+
+    The output grid is snapped on the standard grid, not on the lowest common multiple
+    grid of get_output_dimension().
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Items of one collection and asset, created from asset_urls(). 
+        The column 'item_updated', when present, is part of the item version.
+    bbox : str
+        Extent of the mosaic 'minx,miny,maxx,maxy'.
+    bbox_crs : str
+        Crs of the bbox.
+    resolution : float
+        Resolution of the mosaic.
+    tile_store : str or pathlib.Path
+        Root directory of the tile store.
+    out_path : str or pathlib.Path
+        Path of the output mosaic.
+    orderby : str, optional
+        Order of the items, see order_by(). The default is 'date'.
+    desc : bool, optional
+        Descending order. The default is True (latest on top).
+    method : str, optional
+        Resampling method. The default is 'nearest'.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cog. The default is False.
+
+    Returns
+    -------
+    dict or None
+        {out_path:files used}, None if there is no valid values in the bbox.
+
+    """
+    df, urls = order_by(df, method=orderby, desc=desc)
+    out_crs = rasterio.crs.CRS.from_string(STANDARD_GRID_CRS)
+    dst_transform, dst_height, dst_width = standard_grid_dimension(bbox, bbox_crs, resolution)
+    in_meta = read_profile(urls[0], ['nodata', 'dtype'])
+    nodata = in_meta['nodata']
+    dtype = in_meta['dtype']
+    out_profile = update_profile(in_profile=default_profile(),
+                                 new_crs=out_crs,
+                                 new_height=dst_height,
+                                 new_width=dst_width,
+                                 new_transform=dst_transform,
+                                 new_blocksize=512,
+                                 new_nodata=nodata,
+                                 new_dtype=dtype)
+    out_profile = _add_bigtiff(out_profile)
+
+    updated = df['item_updated'] if 'item_updated' in df.columns else [None]*len(df)
+    versions = {url:item_version(url, dt, up) for url, dt, up in zip(df.url, df.item_datetime, updated)}
+    collections = dict(zip(df.url, df.collection_id))
+    assets = dict(zip(df.url, df.asset_key)) if 'asset_key' in df.columns else {}
+    footprints = source_footprints(urls, out_crs)
+    tags = mosaic_tags(df, urls, footprints, orderby=orderby, desc=desc,
+                       method=method, resolution=resolution)
+
+    size = _STORE_TILE_SIZE
+    origin_x, origin_y = STANDARD_GRID_ORIGIN
+    row_off = int(round((origin_y - dst_transform.f)/resolution))
+    col_off = int(round((dst_transform.c - origin_x)/resolution))
+    fill_value = nodata if nodata is not None else 0
+    resampling = resample_value(method)
+    out_path = pathlib.Path(out_path)
+    temp_file = f'{out_path}.temp'
+    used = []
+    read_tiles = 0
+    new_tiles = 0
+
+    print(f'Mosaic from the tile store {tile_store}...')
+    with _mosaic_env():
+        datasets = OrderedDict()
+        out_img = rasterio.open(temp_file, 'w', **out_profile)
+        try:
+            for t_row in range(row_off//size, (row_off + dst_height - 1)//size + 1):
+                for t_col in range(col_off//size, (col_off + dst_width - 1)//size + 1):
+                    # Part of the tile in the output
+                    rows = (max(t_row*size, row_off), min((t_row + 1)*size, row_off + dst_height))
+                    cols = (max(t_col*size, col_off), min((t_col + 1)*size, col_off + dst_width))
+                    part = (slice(rows[0] - t_row*size, rows[1] - t_row*size),
+                            slice(cols[0] - t_col*size, cols[1] - t_col*size))
+                    t_left, t_top = origin_x + t_col*size*resolution, origin_y - t_row*size*resolution
+                    t_right, t_bottom = t_left + size*resolution, t_top - size*resolution
+                    tile = numpy.full((size, size), fill_value, dtype=dtype)
+                    missing = numpy.zeros((size, size), dtype=bool)
+                    missing[part] = True
+                    for url in urls:
+                        left, bottom, right, top = footprints[url]
+                        if not (left < t_right and right > t_left and bottom < t_top and top > t_bottom):
+                            continue
+                        path = tile_store_path(tile_store, collections[url], assets.get(url),
+                                               versions[url], resolution, t_row, t_col,
+                                               method=method, dtype=dtype, nodata=nodata)
+                        if path.is_file() or path.with_suffix('.empty').is_file():
+                            read_tiles += 1
+                        else:
+                            new_tiles += 1
+                        data = store_tile(url, path, t_row, t_col, resolution, method=method,
+                                          nodata=nodata, dtype=dtype, datasets=datasets)
+                        if data is None:
+                            continue
+                        fill = missing & ~_nodata_mask(data, nodata)
+                        if fill.any():
+                            tile[fill] = data[fill]
+                            missing &= ~fill
+                            if url not in used:
+                                used.append(url)
+                        if not missing.any():
+                            break
+                    out_window = rasterio.windows.Window(cols[0] - col_off, rows[0] - row_off,
+                                                         cols[1] - cols[0], rows[1] - rows[0])
+                    out_img.write(tile[part], 1, window=out_window)
+        finally:
+            for src in datasets.values():
+                src.close()
+            out_img.close()
+
+        print(f'Tile store : {read_tiles} tile(s) read, {new_tiles} tile(s) created')
+        if not used:
+            print(f'No valid values in {bbox}, no output created')
+            os.remove(temp_file)
+            return None
+        DatacubeExtract.check_outfile(out_path)
+        _finalize_mosaic(temp_file, out_path, out_profile, overviews,
+                         resampling=resampling, tags=tags, used_file=used)
+    return {out_path:used}
+
+
+def plan_mosaic(df:pandas.DataFrame, 
+                urls:list, 
+                out_profile:dict, 
+                resolution:float, 
+                method:str)->list:
+    """
+    Create the list of parameters of the mosaic engines, the sources are grouped by 
+    crs (item_epsg) and resolution and the extraction parameters are created once per group
+    and shared by all the sources of the group.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Items of the mosaic, with the columns url, item_epsg and item_resolution.
+    urls : list
+        Ordered list of the urls of the mosaic.
+    out_profile : dict
+        Profile of the mosaic.
+    resolution : float
+        Resolution of the mosaic.
+    method : str
+        Resampling method.
+
+    Returns
+    -------
+    list
+        [{'file':url, 'params':extract params, 'group':'EPSG:XXXX'}, ...] in the order of urls.
+
+    """
+    items = df.drop_duplicates('url').set_index('url')
+    group_params = {}
+    list_params = []
+    for url in urls:
+        epsg = int(items.at[url, 'item_epsg'])
+        src_res = items.at[url, 'item_resolution']
+        key = (epsg, src_res)
+        if key not in group_params:
+            group_params[key] = get_extract_params(out_profile, 
+                                                   src_res=src_res, 
+                                                   src_crs=dcg.crs_from_epsg(epsg), 
+                                                   dst_res=resolution, 
+                                                   resampling_method=method)
+        list_params.append({'file':url, 'params':group_params[key], 'group':f'EPSG:{epsg}'})
+
+    groups = pandas.Series([p['group'] for p in list_params]).value_counts()
+    print(f'{len(list_params)} files in {len(groups)} crs group(s) : '
+          f'{", ".join(f"{g} ({n})" for g, n in groups.items())}')
+    return list_params
+
+
+class GroupTimer():
+    """
+    Time spent per group of sources (ex: crs group of plan_mosaic()) by a mosaic engine.
+
+    start(params) stops the current source and starts timing the source of params 
+    (dictionnary of list_of_params), stop() stops the current source.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.files = {}
+        self._group = None
+        self._start = None
+
+    def start(self, params:dict):
+        self.stop()
+        self._group = params.get('group') or 'all'
+        self._start = time.perf_counter()
+        self.files.setdefault(self._group, set()).add(params['file'])
+
+    def stop(self):
+        if self._group is not None:
+            self.timings[self._group] = (self.timings.get(self._group, 0.) 
+                                         + time.perf_counter() - self._start)
+        self._group = None
+
+    def report(self)->pandas.DataFrame:
+        """Print and return the time spent per group"""
+        self.stop()
+        report = pandas.DataFrame({'group':list(self.timings),
+                                   'files':[len(self.files[g]) for g in self.timings],
+                                   'seconds':[round(t, 3) for t in self.timings.values()]})
+        if not report.empty:
+            print('Time spent per crs group :')
+            print(report.to_string(index=False))
+        return report
+
+
 #Test pour le window mosaic 
 def mosaic_by_window(df:pandas.DataFrame,
                     orderby:str,
@@ -393,73 +952,306 @@ def mosaic_by_window(df:pandas.DataFrame,
                     out_crs:str,
                     out_dir:str,
                     out_file:str,
-                    overviews:bool)->dict:
-    """Mosaics a list of urls, reverse painters based on date or resolution"""
-    
-    dex=DatacubeExtract()
-    #potentiellement prendre le bord dans le futur
-    out_crs = rasterio.crs.CRS.from_string(out_crs)
-        
-    if desc:
-        order_method = 'descending'
-    else:
-        order_method = 'ascending'
-    print(f'Files order will be determine by {orderby} {order_method}')
+                    overviews:bool,
+                    resume:bool=False)->dict:
+    """Mosaics a list of urls, reverse painters based on date or resolution
+    Same as mosaic(engine='window')"""
     
-    #Order file by the method defined by the user
-    # TODO use the more efficient urls = df.url.values.list with a sort
-    df,urls = order_by(df, method=orderby, desc=desc)
+    return mosaic(df=df,orderby=orderby,resolution=resolution,desc=desc,
+                  list_resolutions=list_resolutions,bbox=bbox,bbox_crs=bbox_crs,
+                  method=method,out_crs=out_crs,out_dir=out_dir,out_file=out_file,
+                  overviews=overviews,engine='window',resume=resume)
+@win_ssl_patch
+def update_mosaic(existing_path:Union[str, pathlib.Path],
+                  df:pandas.DataFrame)->dict:
+    """
+    Updates a mosaic created by mosaic() with the items added, changed (datetime) 
+    or removed since its creation, instead of creating the whole mosaic again.
+
+    The sources used to create the mosaic are read from its metadata (DCE_MOSAIC_SOURCES),
+    compared to df and only the output blocks under the footprint of the new, changed 
+    or removed items are recomposed, with all the sources in the order of the mosaic 
+    (DCE_MOSAIC_SETTINGS). The overview tiles of those blocks are then recomputed.
+
+    Parameters
+    ----------
+    existing_path : str or pathlib.Path
+        Path of the mosaic to update.
+    df : pandas.DataFrame
+        Dataframe with columns : 'url','collection_id','item_datetime',
+                                'item_resolution','item_epsg','asset_key'
+        Fresh result of asset_url() for the collection and extent of the mosaic
+
+    Raises
+    ------
+    ValueError
+        If the mosaic metadata (created by mosaic()) are missing.
+
+    Returns
+    -------
+    dict
+        Key is the mosaic path and values are the path to each cog used in the mosaic.
+
+    """
+    existing_path = pathlib.Path(existing_path)
+    info = read_mosaic_tags(existing_path)
+    if not info:
+        raise ValueError(f'{existing_path} has no mosaic metadata, it must be created with mosaic()')
+    settings = info['settings']
+    if settings.get('reducers'):
+        raise ValueError(f'{existing_path} is a reduced mosaic ({settings["reducers"]}), '
+                         'update is only available for first valid mosaics')
+    old_sources = {source['url']:source for source in info['sources']}
+
+    df, urls = order_by(df, method=settings['orderby'], desc=settings['desc'])
+    new_datetimes = {url:str(dt) for url, dt in zip(df.url, df.item_datetime)}
+    added = [url for url in urls if url not in old_sources]
+    changed = [url for url in urls if url in old_sources 
+               and new_datetimes[url] != old_sources[url]['datetime']]
+    removed = [url for url in old_sources if url not in new_datetimes]
+    print(f'Mosaic update : {len(added)} new, {len(changed)} changed and {len(removed)} removed items')
+    if not (added or changed or removed):
+        print(f'{existing_path} is up to date')
+        return {existing_path:info['files_used']}
+
+    with rasterio.open(existing_path) as src:
+        profile = src.profile
+        overview_factors = src.overviews(1)
+    blocksize = (profile['blockysize'], profile['blockxsize'])
+    shape = (math.ceil(profile['height']/blocksize[0]), math.ceil(profile['width']/blocksize[1]))
+
+    footprints = {url:source['bounds'] for url, source in old_sources.items()}
+    footprints.update(source_footprints(added + changed, profile['crs']))
+
+    #Output blocks under the new, changed and removed items
+    touched = numpy.zeros(shape, dtype=bool)
+    for url in added + changed + removed:
+        r0, r1, c0, c1 = _touched_blocks(footprints[url], profile['transform'], blocksize, shape)
+        touched[r0:r1, c0:c1] = True
+    blocks = list(zip(*numpy.nonzero(touched)))
+    print(f'Recomposition of {len(blocks)} of {touched.size} blocks...')
+
+    temp_file = f'{existing_path}.temp'
+    shutil.copyfile(existing_path, temp_file)
+    resampling = resample_value(settings['method'])
+    used = set()
+    with _mosaic_env():
+        with rasterio.open(temp_file, 'r+') as dst:
+            nodata = dst.nodata
+            for r, c in blocks:
+                window = _block_window(r, c, blocksize, dst.shape)
+                dst.write(numpy.full((window.height, window.width), nodata, dst.dtypes[0]), 
+                          1, window=window)
+            full = numpy.zeros(shape, dtype=bool)
+            for url in urls:
+                r0, r1, c0, c1 = _touched_blocks(footprints.get(url), profile['transform'], blocksize, shape)
+                url_blocks = [(r, c) for r, c in blocks 
+                              if r0 <= r < r1 and c0 <= c < c1 and not full[r, c]]
+                if not url_blocks:
+                    continue
+                with rasterio.open(url) as src:
+                    for r, c in url_blocks:
+                        window = _block_window(r, c, blocksize, dst.shape)
+                        existing_arr = dst.read(1, window=window)
+                        destination = numpy.full(existing_arr.shape, nodata, dst.dtypes[0])
+                        warp.reproject(source=rasterio.band(src, 1),
+                                       destination=destination,
+                                       src_nodata=src.nodata,
+                                       dst_transform=rasterio.windows.transform(window, dst.transform),
+                                       dst_crs=dst.crs,
+                                       dst_nodata=nodata,
+                                       resampling=resampling)
+                        no_data_mask = _nodata_mask(existing_arr, nodata)
+                        fill = no_data_mask & ~_nodata_mask(destination, nodata)
+                        if not fill.any():
+                            continue
+                        existing_arr[fill] = destination[fill]
+                        dst.write(existing_arr, 1, window=window)
+                        full[r, c] = not _nodata_mask(existing_arr, nodata).any()
+                        used.add(url)
+
+        #Only the overview tiles of the recomposed blocks are computed again, with
+        #build_overviews on the block and a halo so they are the same as the ones of a new mosaic
+        if overview_factors:
+            print(f'Update of overview levels {overview_factors}...')
+            _update_overviews(temp_file, blocks, blocksize, overview_factors, resampling)
+
+        files_used = [url for url in urls if url in used or url in info['files_used']]
+        footprints = {url:footprints[url] for url in urls}
+        tags = mosaic_tags(df, urls, footprints, orderby=settings['orderby'], desc=settings['desc'],
+                           method=settings['method'], resolution=settings['resolution'])
+        tags['DCE_FILES_USED'] = json.dumps(files_used)
+        with rasterio.open(temp_file, 'r+') as dst:
+            dst.update_tags(**tags)
+
+        if overview_factors:
+            #Copy to restore the cog layout (tiles rewritten are at the end of the temp file)
+            with rasterio.open(temp_file) as temp_mosaic:
+                rscopy(temp_mosaic, f'{temp_file}.cog', copy_src_overviews=True, **profile)
+            os.replace(f'{temp_file}.cog', existing_path)
+            os.remove(temp_file)
+        else:
+            os.replace(temp_file, existing_path)
+    print(f'Mosaic updated : {existing_path}')
     
-    #Get the output extent based on the bbox
-    (dst_transform, 
-     dst_height,
-     dst_width) = get_output_dimension(list_resolutions, 
-                                           bbox=bbox, 
-                                           bbox_crs=bbox_crs, 
-                                           out_crs=out_crs, 
-                                           out_res=resolution)	
+    return {existing_path:files_used}
 
-    #get input nodata value and dtype to add to the output_profile
-    in_meta = read_profile(urls[0], ['nodata', 'dtype'])
 
-    #create the profile for the extracted cog chip
-    out_profile = update_profile(in_profile=default_profile(),
-                                     new_crs=out_crs,
-                                     new_height=dst_height,
-                                     new_width=dst_width,
-                                     new_transform=dst_transform,
-                                     new_blocksize=512,
-                                     new_nodata=in_meta['nodata'],
-                                     new_dtype=in_meta['dtype'])
+def _update_overviews(path, blocks:list, blocksize:tuple, factors:list, resampling):
+    """
+    Compute again the overview tiles of the blocks (row, col) of path.
 
-    #Create list of parameters and output profile using the same tool as the extract_cogchips()
-    list_params=[]
-    for url in urls:
-        dict_file = {}
-        params = get_extract_params(out_profile, 
-                                        src_res=df.query('url==@url')['item_resolution'].values[0],#row.item_resolution, 
-                                        src_crs=f"EPSG:{df.query('url==@url')['item_epsg'].values[0]}", 
-                                        dst_res=resolution, 
-                                        resampling_method=method)
-        
-        dict_file['file']=url
-        dict_file['params']=params
-        list_params.append(dict_file)
+    Each block is copied with a halo (aligned on the largest factor) in a memory file where
+    the overviews are built like build_overviews() of the whole file, the part of each level 
+    under the block is then written to the overviews of path.
+    """
+    step = max(factors)
+    halo = 4*step
+    #OVERVIEW_LEVEL=NONE, otherwise GDAL reads the decimated window from the old overview
+    base = rasterio.open(path, OVERVIEW_LEVEL='NONE')
+    ovrs = []
+    try:
+        for level in range(len(factors)):
+            ovrs.append(rasterio.open(path, 'r+', OVERVIEW_LEVEL=level))
+        for r, c in blocks:
+            window = _block_window(r, c, blocksize, base.shape)
+            col0 = max(0, window.col_off - halo)//step*step
+            row0 = max(0, window.row_off - halo)//step*step
+            col1 = min(base.width, window.col_off + window.width + halo)
+            row1 = min(base.height, window.row_off + window.height + halo)
+            halo_window = rasterio.windows.Window(col0, row0, col1 - col0, row1 - row0)
+            arr = base.read(1, window=halo_window)
+            with MemoryFile() as memfile:
+                with memfile.open(driver='GTiff', height=arr.shape[0], width=arr.shape[1], count=1,
+                                  dtype=arr.dtype, crs=base.crs, nodata=base.nodata,
+                                  transform=base.window_transform(halo_window)) as mem:
+                    mem.write(arr, 1)
+                    mem.build_overviews(factors, resampling)
+                for level, (factor, ovr) in enumerate(zip(factors, ovrs)):
+                    #Overview pixels under the block
+                    col_off = window.col_off//factor
+                    row_off = window.row_off//factor
+                    width = min(math.ceil((window.col_off + window.width)/factor), ovr.width) - col_off
+                    height = min(math.ceil((window.row_off + window.height)/factor), ovr.height) - row_off
+                    with memfile.open(OVERVIEW_LEVEL=level) as mem_ovr:
+                        ovr_arr = mem_ovr.read(1, window=rasterio.windows.Window(col_off - col0//factor,
+                                                                                 row_off - row0//factor,
+                                                                                 width, height))
+                    ovr.write(ovr_arr, 1, window=rasterio.windows.Window(col_off, row_off, width, height))
+    finally:
+        for ovr in ovrs:
+            ovr.close()
+        base.close()
+
+
+@win_ssl_patch
+def source_footprints(urls:list, out_crs, max_workers:int=8)->dict:
+    """
+    Return the bounds of each url in out_crs, only the headers of the files are read (in parallel)
+
+    Parameters
+    ----------
+    urls : list
+        List of the path or url of the files.
+    out_crs : str or rasterio.crs.CRS
+        The crs of the bounds.
+    max_workers : int, optional
+        Number of files read at the same time. The default is 8.
+
+    Returns
+    -------
+    dict
+        {url:[left, bottom, right, top]}
+
+    """
+    def _header(url):
+        with _mosaic_env():
+            with rasterio.open(url) as src:
+                return src.crs.to_wkt(), tuple(src.bounds)
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        headers = list(executor.map(_header, urls))
+    #The bounds are reprojected once the headers are read, all the bounds of a crs at once
+    groups = {}
+    for url, (src_wkt, bounds) in zip(urls, headers):
+        groups.setdefault(src_wkt, []).append((url, bounds))
+    footprints = {}
+    for src_wkt, group in groups.items():
+        out_bounds = dcg.transform_bboxes([bounds for _, bounds in group], src_wkt, out_crs,
+                                          densify_pts=21)
+        footprints.update({url:b.tolist() for (url, _), b in zip(group, out_bounds)})
+    return {url:footprints[url] for url in urls}
+
+
+def mosaic_tags(df:pandas.DataFrame, urls:list, footprints:dict, 
+                orderby:str, desc:bool, method:str, resolution:float,
+                reducers:list=None)->dict:
+    """
+    Return the metadata tags describing how a mosaic is created, used by update_mosaic()
+
+    DCE_MOSAIC_SETTINGS : order and resampling of the mosaic
+    DCE_MOSAIC_SOURCES : ordered list of the sources with their datetime and bounds
+    """
+    datetimes = dict(zip(df.url, df.item_datetime))
+    settings = {'orderby':orderby, 'desc':bool(desc), 'method':method, 'resolution':resolution}
+    if reducers:
+        settings['reducers'] = list(reducers)
+    sources = [{'url':url, 'datetime':str(datetimes.get(url)), 'bounds':footprints.get(url)}
+               for url in urls]
+    return {'DCE_MOSAIC_SETTINGS':json.dumps(settings),
+            'DCE_MOSAIC_SOURCES':json.dumps(sources)}
+
+
+def read_mosaic_tags(path)->Union[dict, None]:
+    """
+    Read the metadata tags written by mosaic()
+
+    Returns
+    -------
+    dict or None
+        {'settings':dict, 'sources':list, 'files_used':list}, None if the file has no mosaic tags.
+
+    """
+    with rasterio.open(path) as src:
+        tags = src.tags()
+    if 'DCE_MOSAIC_SETTINGS' not in tags or 'DCE_MOSAIC_SOURCES' not in tags:
+        return None
+    return {'settings':json.loads(tags['DCE_MOSAIC_SETTINGS']),
+            'sources':json.loads(tags['DCE_MOSAIC_SOURCES']),
+            'files_used':json.loads(tags.get('DCE_FILES_USED', '[]'))}
+
+
+def _block_window(row, col, blocksize, shape):
+    """Return the window of the block (row, col) of a raster of shape (height, width)"""
+    by, bx = blocksize
+    return rasterio.windows.Window(col*bx, row*by, 
+                                   min(bx, shape[1]-col*bx), 
+                                   min(by, shape[0]-row*by))
+
+
+def _touched_blocks(bounds, transform, blocksize, shape):
+    """Return the (row_start, row_stop, col_start, col_stop) of the blocks under bounds"""
+    if bounds is None:
+        return 0, 0, 0, 0
+    window = rasterio.windows.from_bounds(*bounds, transform=transform)
+    by, bx = blocksize
+    r0 = max(int(math.floor(window.row_off))//by, 0)
+    c0 = max(int(math.floor(window.col_off))//bx, 0)
+    r1 = min(math.ceil((window.row_off + window.height)/by), shape[0])
+    c1 = min(math.ceil((window.col_off + window.width)/bx), shape[1])
+    return r0, max(r1, r0), c0, max(c1, c0)
+
+
+def _nodata_mask(arr, nodata):
+    """Return the mask of the nodata values of arr"""
+    if nodata is None:
+        return numpy.zeros(arr.shape, dtype=bool)
+    if numpy.isnan(nodata):
+        return numpy.isnan(arr)
+    return arr == nodata
 
-    print('Starting mosaic process for each assets...')
-    #Call the mosaic tool 
-    if list_params and out_profile:
-        #TODO : validate that the file does not exist or delete file
-        out_path = pathlib.Path(os.path.join(out_dir, out_file))
-        dex.check_outfile(out_path)
-        files_used, file_unused = window_mosaic(list_params, out_path, out_profile, overviews=overviews)
-        # files_used, file_unused = warped_mosaic(list_params, out_path, out_profile, overviews=overviews)
-        dict_mosaic = {out_path:files_used}
-        #TODO : do something with the file unused
-    else:
-        print('Ending extraction processus...')
 
-    return dict_mosaic
 #Sub-level extract methods
 def default_profile():
     default_profile = {'driver': 'GTiff',
@@ -517,6 +1309,8 @@ def bbox_windows(img_path:str,
 
     Memory light, window based image access
     Image read, write, reproject etc. now possible for portion of image
+    The windows are computed with numpy on the block grid of the image, 
+    cached by path (see bbox_block_arrays())
 
     Potential for concurrent processing (multi-threading)
 
@@ -568,48 +1362,108 @@ def bbox_windows(img_path:str,
     https://rasterio.readthedocs.io/en/latest/topics/concurrency.html
     """
 
-    # Create the tap window for the image and get the image blocksize
+    blocks = bbox_block_arrays(img_path, bbox, bbox_crs, band=band, clip=clip)
+    return [rasterio.windows.Window(col_off, row_off, width, height)
+            for col_off, row_off, width, height in zip(blocks['col_off'].tolist(),
+                                                       blocks['row_off'].tolist(),
+                                                       blocks['width'].tolist(),
+                                                       blocks['height'].tolist())]
+
+
+class BlockGrid(NamedTuple):
+    """Georeferencing and internal block size of an image"""
+    transform: Affine
+    crs: rasterio.crs.CRS
+    width: int
+    height: int
+    block_height: int
+    block_width: int
+
+
+@lru_cache(maxsize=256)
+def image_block_grid(img_path:str, band:int=1)->BlockGrid:
+    """
+    Return the BlockGrid of a band of an image, the header is read only once per image path.
+    Use image_block_grid.cache_clear() if an image is replaced by another one with the same path.
+    """
     with rasterio.open(img_path) as img:
-        w_tap = tap_window(img.transform,bbox,bbox_crs, img.crs)
-        pix_per_block = img.block_shapes[0][0]
-    
-        # Calculate the block window start indices
-        block_col_index_start = math.floor(w_tap.col_off/pix_per_block)
-        block_row_index_start = math.floor(w_tap.row_off/pix_per_block)
-    
-        # Calculate the number of block windows required
-        col_index_start = block_col_index_start*pix_per_block
-        row_index_start = block_row_index_start*pix_per_block
-    
-        diff_block_col_start = w_tap.col_off - col_index_start
-        diff_block_row_start = w_tap.row_off - row_index_start
-    
-        corrected_width = w_tap.width+diff_block_col_start
-        corrected_height = w_tap.height+diff_block_row_start
-    
-        num_block_cols = math.ceil(corrected_width/pix_per_block)
-        num_block_rows = math.ceil(corrected_height/pix_per_block)
-    
-        # num_block_cols = math.ceil(w_tap.width/pix_per_block)
-        # num_block_rows = math.ceil(w_tap.height/pix_per_block)
-    
-    
-        # Use range and pix_per_block to calculate all block windows required
-        extract_windows = []
-        for bl_idx_row in range(block_row_index_start,block_row_index_start+num_block_rows):
-            for bl_idx_col in range(block_col_index_start,block_col_index_start+num_block_cols):
-                extract_window = img.block_window(band,bl_idx_row,bl_idx_col)
-                # print(f'Extract Window : {extract_window}')
-                if clip:
-                    # Clip the block window limits to tap window limits
-                    current_window = clip_window(win=extract_window,clip_to=w_tap)
-                    if current_window:
-                        extract_windows.append(current_window)
-                else:
-                    # Use full block window
-                    extract_windows.append(extract_window)
-    
-    return extract_windows
+        block_height, block_width = img.block_shapes[band-1]
+        return BlockGrid(img.transform, img.crs, img.width, img.height, 
+                         block_height, block_width)
+
+
+def bbox_block_arrays(img_path:str,
+                      bbox:str,
+                      bbox_crs:str,
+                      band:int=1,
+                      clip:bool=True)->dict:
+    """
+    Vectorized version of bbox_windows(), the blocks that intersect the tap version of bbox
+    are returned as numpy arrays instead of a list of windows.
+
+    The block grid of the image is cached by path (image_block_grid()), so the image is
+    opened only the first time.
+
+    Parameters
+    ----------
+    img_path : str
+        The path to the image.
+    bbox : str
+        The image bbox (minx,miny,maxx,maxy).  The box is converted to tap
+    bbox_crs : str
+        The EPSG code as string.
+    band : int, optional
+        The image band to be. The default is 1.
+    clip : bool, optional
+        If true image block windows are clipepd to  tap input window.
+        The default is True.
+
+    Returns
+    -------
+    dict
+        {'block_row', 'block_col', 'row_off', 'col_off', 'height', 'width'}, 
+        one numpy.ndarray (int64) per key, blocks in row major order.
+        Blocks outside of the image are not returned.
+
+    """
+    grid = image_block_grid(str(img_path), band)
+    w_tap = tap_window(grid.transform, bbox, bbox_crs, grid.crs)
+    tap_row_min, tap_col_min = int(w_tap.row_off), int(w_tap.col_off)
+    tap_row_max = tap_row_min + int(w_tap.height)
+    tap_col_max = tap_col_min + int(w_tap.width)
+    bh, bw = grid.block_height, grid.block_width
+
+    # Range of the block indices under the tap window, inside the image
+    row_start = max(tap_row_min//bh, 0)
+    row_stop = min(-(-tap_row_max//bh), -(-grid.height//bh))
+    col_start = max(tap_col_min//bw, 0)
+    col_stop = min(-(-tap_col_max//bw), -(-grid.width//bw))
+    rows, cols = numpy.meshgrid(numpy.arange(row_start, max(row_stop, row_start), dtype='int64'),
+                                numpy.arange(col_start, max(col_stop, col_start), dtype='int64'),
+                                indexing='ij')
+    rows, cols = rows.ravel(), cols.ravel()
+
+    # Block windows, the last row and column of blocks are truncated by the image limits
+    row_off = rows*bh
+    col_off = cols*bw
+    height = numpy.minimum(bh, grid.height - row_off)
+    width = numpy.minimum(bw, grid.width - col_off)
+
+    if clip:
+        # Clip the block window limits to tap window limits
+        row_max = numpy.minimum(row_off + height, tap_row_max)
+        col_max = numpy.minimum(col_off + width, tap_col_max)
+        row_off = numpy.maximum(row_off, tap_row_min)
+        col_off = numpy.maximum(col_off, tap_col_min)
+        height = row_max - row_off
+        width = col_max - col_off
+        keep = (height > 0) & (width > 0)
+        rows, cols = rows[keep], cols[keep]
+        row_off, col_off, height, width = row_off[keep], col_off[keep], height[keep], width[keep]
+
+    return {'block_row':rows, 'block_col':cols,
+            'row_off':row_off, 'col_off':col_off,
+            'height':height, 'width':width}
 
 
 def tap_window(img_transform,
@@ -641,18 +1495,15 @@ def tap_window(img_transform,
 
     """
     
-    dex = DatacubeExtract()
     if bbox_crs != img_crs:
-        geom_d = dex.poly_to_dict((dex.bbox_to_poly(bbox)))
-        geom_p = dex.transform_dict_to_poly(geom_d,bbox_crs,img_crs)
-        bbox = geom_p.bounds
+        bbox = dcg.transform_bbox(bbox,bbox_crs,img_crs)
         #Doesnt change anything.
         # bbox = (bbox_temp[0] - 500 , bbox_temp[1]-500,bbox_temp[2]+500, bbox_temp[3]+500)
         # print('Test: adding a buffer around the bbox before reprojection')
 
     else:
         #Convert bbox str to tuple
-        bbox = dex.bbox_to_tuple(bbox)
+        bbox = dcg.bbox_to_tuple(bbox)
     # bbox = tuple(float(v) for v in bbox.split(','))
     # Original window based on original bounds
     w_orig = rasterio.windows.from_bounds(*bbox,transform=img_transform)
@@ -735,6 +1586,7 @@ def resample_value(resample:str='bilinear'):
     ----------
     resample : str, optional
         The name of the resampling method. The default is 'bilinear'.
+        A rasterio.enums.Resampling is returned as is.
 
     Returns
     -------
@@ -742,6 +1594,8 @@ def resample_value(resample:str='bilinear'):
         The rasterio.enums.Resampling.<name>.value.
 
     """
+    if isinstance(resample, rasterio.enums.Resampling):
+        return resample
 
     try:
         value = [r for r in rasterio.enums.Resampling if r.name == resample][0]
@@ -954,15 +1808,11 @@ def get_output_dimension(resolutions:list,
         Width of the output raster in the output resolution.
 
     """
-    dex = DatacubeExtract()
-    
     #Reproject the bbox if out_crs is different from input crs
     if out_crs != bbox_crs:
-        geom_d = dex.poly_to_dict(dex.bbox_to_poly(bbox)) #mapping(box(*[float(v) for v in bbox.split(',')])
-        geom_p = dex.transform_dict_to_poly(geom_d,bbox_crs,out_crs) #shape(warp.transform_geom(in_crs,out_crs,geom_d))
-        bbox_tuple = geom_p.bounds
+        bbox_tuple = dcg.transform_bbox(bbox,bbox_crs,out_crs)
     else:
-        bbox_tuple = dex.bbox_to_tuple(bbox) #tuple(float(v) for v in bbox.split(','))
+        bbox_tuple = dcg.bbox_to_tuple(bbox)
     
     #Get bbox bounds
     (bbox_w,
@@ -993,6 +1843,96 @@ def get_output_dimension(resolutions:list,
     return dst_transform, dst_height, dst_width
 
 
+def aggregate_resolution(in_path, 
+                         out_path, 
+                         factor:int, 
+                         method:str='nearest',
+                         overviews:bool=False):
+    """
+    Create a coarser resolution raster from an already extracted raster by block aggregation,
+    without reading the sources again. 
+
+    The output grid has the same origin as in_path and a resolution factor times coarser,
+    since the extent of the extractions is aligned on the lowest common multiple of all
+    the resolutions (calc_lcm_bounds()), the coarser grid covers exactly the same extent.
+
+    Parameters
+    ----------
+    in_path : str or pathlib.Path
+        Path of the finer resolution raster.
+    out_path : str or pathlib.Path
+        Path of the coarser resolution raster.
+    factor : int
+        Ratio between the output and the input resolution.
+    method : str, optional
+        Resampling method, 'nearest' takes the pixel under the center of the coarse pixel,
+        'min', 'max', 'med' and 'mode' take the min, max, median or most frequent valid value,
+        the other methods ('bilinear', 'average', 'cubic', ...) take the mean of the valid 
+        values (area average). The default is 'nearest'.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cog. The default is False.
+
+    Returns
+    -------
+    out_path : pathlib.Path
+        Path of the coarser resolution raster.
+
+    """
+    factor = int(factor)
+    if factor < 1:
+        raise ValueError(f'The aggregation factor must be a positive integer, got {factor}')
+    out_path = pathlib.Path(out_path)
+    temp_file = f'{out_path}.temp'
+    with rasterio.open(in_path) as src:
+        profile = src.profile.copy()
+        nodata = src.nodata
+        profile.update(width=math.ceil(src.width/factor),
+                       height=math.ceil(src.height/factor),
+                       transform=src.transform*Affine.scale(factor))
+        print(f'Aggregation of {pathlib.Path(in_path).name} to {abs(profile["transform"].a)}m ({method})...')
+        with rasterio.open(temp_file, 'w', **profile) as dst:
+            for _, window in dst.block_windows(1):
+                in_window = rasterio.windows.Window(window.col_off*factor, window.row_off*factor,
+                                                    window.width*factor, window.height*factor)
+                arr = src.read(window=in_window, boundless=True, masked=True,
+                               fill_value=nodata if nodata is not None else 0)
+                block = _aggregate_block(arr, factor, method)
+                if numpy.issubdtype(numpy.dtype(profile['dtype']), numpy.integer):
+                    block = numpy.ma.round(block)
+                dst.write(block.filled(nodata if nodata is not None else 0).astype(profile['dtype']), 
+                          window=window)
+    _finalize_mosaic(temp_file, out_path, profile, overviews, resampling=resample_value(method))
+    return out_path
+
+
+def _aggregate_block(arr:numpy.ma.MaskedArray, factor:int, method:str)->numpy.ma.MaskedArray:
+    """Aggregate the (bands, height*factor, width*factor) masked array by factor x factor cells"""
+    bands, height, width = arr.shape
+    height, width = height//factor, width//factor
+    cells = arr.reshape(bands, height, factor, width, factor)
+    if method == 'nearest':
+        return cells[:, :, factor//2, :, factor//2]
+    cells = cells.transpose(0, 1, 3, 2, 4).reshape(bands, height, width, factor*factor)
+    if method == 'min':
+        return cells.min(axis=-1)
+    if method == 'max':
+        return cells.max(axis=-1)
+    if method == 'med':
+        return numpy.ma.median(cells, axis=-1)
+    if method == 'mode':
+        values = cells.astype('float64').filled(numpy.nan)
+        ordered = numpy.sort(values, axis=-1)
+        #length of the run of equal values ending at each position
+        same = numpy.concatenate([numpy.zeros(ordered.shape[:-1] + (1,), bool),
+                                  ordered[..., 1:] == ordered[..., :-1]], axis=-1)
+        runs = numpy.zeros(ordered.shape, 'int32')
+        for i in range(1, ordered.shape[-1]):
+            runs[..., i] = numpy.where(same[..., i], runs[..., i-1] + 1, 0)
+        mode = numpy.take_along_axis(ordered, runs.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+        return numpy.ma.masked_invalid(mode)
+    return cells.mean(axis=-1)
+
+
 @win_ssl_patch
 def prepare_extract_cogchip(in_path:str,
                         bbox:str,
@@ -1038,7 +1978,6 @@ def prepare_extract_cogchip(in_path:str,
 
     """
     # print(os.getenv('GDAL_HTTP_UNSAFESSL'))
-    dex = DatacubeExtract()
 
     # env = rasterio.Env(GDAL_HTTP_UNSAFESSL='YES')
     env = rasterio.Env()
@@ -1167,7 +2106,6 @@ def extract_cogchip(in_path:str,
         String of the path to the output raster.
 
     """
-    dex = DatacubeExtract()
     #TODO : Explore standart env. setup
     #TODO : Create a function for setting up the env.
     env = rasterio.Env(
@@ -1211,7 +2149,7 @@ def extract_cogchip(in_path:str,
                             temp_file = pathlib.Path(temp_dir,f'{out_path.name}.temp')
                             temp = cog.rio.to_raster(temp_file, windowed=True, lock=threading.Lock(), **out_profile)
                             with rasterio.open(temp_file, 'r+') as dst:
-                                dst = dex.add_overviews(dst, resample=extract_params['resampling'])
+                                dst = DatacubeExtract.add_overviews(dst, resample=extract_params['resampling'])
                                 rscopy(dst,out_path,copy_src_overviews=True,**out_profile)
     
                     else:
@@ -1326,7 +2264,9 @@ def order_by(dataframe:pandas.DataFrame,
 def warped_mosaic(list_of_params, 
                   out_path, 
                   out_profile,  
-                  overviews=False):
+                  overviews=False,
+                  resume=False,
+                  tags=None):
     
     """
     Parameters
@@ -1346,6 +2286,12 @@ def warped_mosaic(list_of_params,
         Profile of the output raster.
     overviews : bool, optional
         Trigger the creation of overviews to the ouput cog. The default is False.
+    resume : bool, optional
+        Continue the mosaic from the checkpoint of a previous run (temp file 
+        and its checkpoint beside the output). The default is False.
+    tags : dict, optional
+        Metadata tags written to the output. The list of files used is always 
+        written (DCE_FILES_USED). The default is None.
 
     Returns
     -------
@@ -1355,32 +2301,31 @@ def warped_mosaic(list_of_params,
     """
     #Write file on top of each other with the warped method
     #All file must have same crs, same number of bands and same datatype
-    dex = DatacubeExtract()
-    #TODO : Explore standart env. setup
-    #TODO : Create a function for setting up the env.
-    env = rasterio.Env(
-        GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR", # a way to disable loading of side-car or auxiliary files
-        CPL_VSIL_CURL_USE_HEAD=False, #pas certaine de ce que ca fait
-        CPL_VSIL_CURL_ALLOWED_EXTENSIONS="TIF", #considering only files that ends with .tif
-        GDAL_NUM_THREADS='ALL_CPUS',#Enable multi-threaded compression by specifying the number of worker threads
-        # GDAL_HTTP_UNSAFESSL=1,
-        # CPL_CURL_VERBOSE=1,
-        # CURL_CA_BUNDLE='/space/partner/nrcan/geobase/work/opt/miniconda-datacube/envs/datacube-usecase/lib/python3.9/site-packages/certifi/cacert.pem',
-        # REQUESTS_CA_BUNDLE='/space/partner/nrcan/geobase/work/opt/miniconda-datacube/envs/datacube-usecase/lib/python3.9/site-packages/certifi/cacert.pem'
-          )
+    env = _mosaic_env()
 
     band=1
     temp_file = f'{out_path}.temp'
     
     out_profile = _add_bigtiff(out_profile)
+    extract_params = list_of_params[-1]['params']
         
     with env:
-        with rasterio.open(temp_file, mode="w+", **out_profile) as out_img:
-            used_file = []
-            unused_file = []
+        timer = GroupTimer()
+        out_img, state = open_mosaic_temp(temp_file, out_profile,
+                                           [p['file'] for p in list_of_params], resume)
+        used_file = state['used_file']
+        unused_file = state['unused_file']
+        try:
             #TODO: add color palettes if exist
             #TODO: add datetime (question is which datetime? oldest of files or date of creation?)
-            for params in list_of_params:
+            for i, params in enumerate(list_of_params):
+                if i < state['next_source']:
+                    continue
+                if i > state['next_source']:
+                    #All the sources before i are written
+                    state['next_source'] = i
+                    out_img = checkpoint_mosaic(out_img, temp_file, state)
+                timer.start(params)
                 file = params['file']
                 extract_params = params['params']
                 with rasterio.open(file) as src:
@@ -1394,7 +2339,7 @@ def warped_mosaic(list_of_params,
                             
                             print(''.rjust(75, '-'))
                             #Validate that the output mosaic window for this file is not already filled up with values
-                            if out_img.read_masks(window=dst_window).all():
+                            if _window_is_covered(state, dst_window) or out_img.read_masks(window=dst_window).all():
                                 #Si toutes les valeurs du mask sont valide, donc pas du nodata on skip l'image
                                 print(f'Extent covered by {file} is already filled in mosaic, skipping file...')
                                 unused_file.append(file)
@@ -1436,23 +2381,18 @@ def warped_mosaic(list_of_params,
                     new_data = existing_arr
                     new_data[no_data_mask] = window_arr[no_data_mask]
                     out_img.write(new_data,indexes=band,window=dst_window)
+                    _update_coverage(state, dst_window, new_data, out_img.nodata)
                     
                     #Populate the list of file used inside the mosaic
                     used_file.append(file)
+        finally:
+            out_img.close()
 
         #Adding overviews if needed
-        if overviews:
-            print(''.rjust(75, ' '))
-            print('Creation of overviews...')
-            with rasterio.open(temp_file, 'r+') as temp_mosaic:
-                temp_mosaic = dex.add_overviews(temp_mosaic, resample=extract_params['resampling'])
-                rscopy(temp_mosaic,out_path,copy_src_overviews=True,**out_profile)
-            os.remove(temp_file)
-           
-        else:
-            print(''.rjust(75, ' '))
-            print('No overviews added to the mosaic')
-            os.rename(temp_file, out_path)
+        timer.report()
+        _finalize_mosaic(temp_file, out_path, out_profile, overviews,
+                         resampling=extract_params['resampling'],
+                         tags=tags, used_file=used_file)
             
                
                    
@@ -1463,7 +2403,9 @@ def warped_mosaic(list_of_params,
 def window_mosaic(list_of_params, 
                   out_path, 
                   out_profile,  
-                  overviews=False):
+                  overviews=False,
+                  resume=False,
+                  tags=None):
     
     """
     Parameters
@@ -1483,6 +2425,12 @@ def window_mosaic(list_of_params,
         Profile of the output raster.
     overviews : bool, optional
         Trigger the creation of overviews to the ouput cog. The default is False.
+    resume : bool, optional
+        Continue the mosaic from the checkpoint of a previous run (temp file 
+        and its checkpoint beside the output). The default is False.
+    tags : dict, optional
+        Metadata tags written to the output. The list of files used is always 
+        written (DCE_FILES_USED). The default is None.
 
     Returns
     -------
@@ -1492,32 +2440,31 @@ def window_mosaic(list_of_params,
     """
     #Write file on top of each other with the warped method
     #All file must have same crs, same number of bands and same datatype
-    dex =  DatacubeExtract()
-    #TODO : Explore standart env. setup
-    #TODO : Create a function for setting up the env.
-    env = rasterio.Env(
-        GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR", # a way to disable loading of side-car or auxiliary files
-        CPL_VSIL_CURL_USE_HEAD=False, #pas certaine de ce que ca fait
-        CPL_VSIL_CURL_ALLOWED_EXTENSIONS="TIF", #considering only files that ends with .tif
-        GDAL_NUM_THREADS='ALL_CPUS',#Enable multi-threaded compression by specifying the number of worker threads
-        # GDAL_HTTP_UNSAFESSL=1,
-        # CPL_CURL_VERBOSE=1,
-        # CURL_CA_BUNDLE='/space/partner/nrcan/geobase/work/opt/miniconda-datacube/envs/datacube-usecase/lib/python3.9/site-packages/certifi/cacert.pem',
-        # REQUESTS_CA_BUNDLE='/space/partner/nrcan/geobase/work/opt/miniconda-datacube/envs/datacube-usecase/lib/python3.9/site-packages/certifi/cacert.pem'
-          )
+    env = _mosaic_env()
 
     band=1
     temp_file = f'{out_path}.temp'
     
     out_profile = _add_bigtiff(out_profile)
+    extract_params = list_of_params[-1]['params']
         
     with env:
-        with rasterio.open(temp_file, mode="w+", **out_profile) as out_img:
-            used_file = []
-            unused_file = []
+        timer = GroupTimer()
+        out_img, state = open_mosaic_temp(temp_file, out_profile,
+                                           [p['file'] for p in list_of_params], resume)
+        used_file = state['used_file']
+        unused_file = state['unused_file']
+        try:
             #TODO: add color palettes if exist
             #TODO: add datetime (question is which datetime? oldest of files or date of creation?)
-            for params in list_of_params:
+            for i, params in enumerate(list_of_params):
+                if i < state['next_source']:
+                    continue
+                if i > state['next_source']:
+                    #All the sources before i are written
+                    state.update(next_source=i, completed_blocks=0, current_used=False)
+                    out_img = checkpoint_mosaic(out_img, temp_file, state)
+                timer.start(params)
                 file = params['file']
                 extract_params = params['params']
                 with rasterio.open(file) as src:
@@ -1533,14 +2480,13 @@ def window_mosaic(list_of_params,
                               'there will be resampling...')
                     
                     with rasterio.vrt.WarpedVRT(src, **extract_params) as vrt:
-                        #count the number of block_windows for the file
-                        total_win = 0
-                        not_used_window = 0
-                        for rc,src_window in vrt.block_windows(band):
-                            #count the total number of window (there must be a better way to do it....)
-                            total_win = total_win+1
-                            #get the input nodata value
-                            in_nodata = vrt.nodata
+                        #get the input nodata value
+                        in_nodata = vrt.nodata
+                        written_blocks = 0
+                        for block_index, (rc,src_window) in enumerate(vrt.block_windows(band)):
+                            #Blocks already done before the checkpoint
+                            if block_index < state['completed_blocks']:
+                                continue
                             
                             # #Calcul de la fenetre dans le fichier output
                             input_extent = rasterio.windows.bounds(src_window,
@@ -1548,98 +2494,732 @@ def window_mosaic(list_of_params,
                             dst_window = rasterio.windows.from_bounds(*input_extent, out_img.transform)
                           
                             #Validate that the output mosaic window for this file is not already filled up with values
-                            if out_img.read_masks(window=dst_window).all():
+                            if _window_is_covered(state, dst_window) or out_img.read_masks(window=dst_window).all():
                                 #Si toutes les valeurs du mask sont valide, donc pas du nodata on skip l'image
                                 #TODO: modify the message to take into account the window, and only includ it in the log 
-                                # print(f'Extent covered by {file} is already filled in mosaic, skipping file...')
-                                # unused_file.append(file)
-                                not_used_window = not_used_window+1
                                 continue
                             
                             window_arr = vrt.read(band,window=src_window)
                             #Pour valider qu'il y a autre chose que tu nodata dans le input file window
                             if numpy.all((window_arr == in_nodata)):
-                                # print('All no data')
-                                # unused_file.append(file)
-                                not_used_window = not_used_window+1
-            
-                            else:
+                                continue
                                
-                                # Read values already written to current window
-                                # In out_crs spatial coords
-                                existing_arr = out_img.read(band,window=dst_window)
-                                
-                                # print(f'Update values in mosaic with value from : {file}')
-                                # Make an existing window no_data mask
-                                no_data_mask = (existing_arr == out_img.nodata)
-                                #Modify window_arr no data to out_img to data
-                                window_arr[window_arr == in_nodata] = out_img.nodata
-                                
-                                # LOG.debug(f'no_data_mask shape {no_data_mask.shape}')
-                                new_data = existing_arr
+                            # Read values already written to current window
+                            # In out_crs spatial coords
+                            existing_arr = out_img.read(band,window=dst_window)
+                            
+                            # Make an existing window no_data mask
+                            no_data_mask = (existing_arr == out_img.nodata)
+                            #Modify window_arr no data to out_img to data
+                            window_arr[window_arr == in_nodata] = out_img.nodata
+                            
+                            new_data = existing_arr
+                            
+                            #Pour le resampling                                
+                            if out_res != in_res:
                                 
-                                #Pour le resampling                                
-                                if out_res != in_res:
-                                    
-                                    # Get the source and destination transforms
-                                    src_window_transform = rasterio.windows.transform(src_window,vrt.transform)
-                                    dst_window_transform = rasterio.windows.transform(dst_window,out_img.transform)
+                                # Get the source and destination transforms
+                                src_window_transform = rasterio.windows.transform(src_window,vrt.transform)
+                                dst_window_transform = rasterio.windows.transform(dst_window,out_img.transform)
+                            
+                                # Create a destination array filled with no data
+                                #I believe that this introduce some errors at the marging of the projects when using resampling method 'bilinear'
+                                destination = numpy.zeros((int(dst_window.height),int(dst_window.width)),dt)
+                                destination[destination==0] = out_img.nodata
                                 
-                                    # Create a destination array filled with no data
-                                    #I believe that this introduce some errors at the marging of the projects when using resampling method 'bilinear'
-                                    destination = numpy.zeros((int(dst_window.height),int(dst_window.width)),dt)
-                                    destination[destination==0] = out_img.nodata
-                                    
-                                    
-                                    rasterio.warp.reproject(window_arr,
-                                                            destination,
-                                                            src_transform=src_window_transform,
-                                                            src_crs=vrt.crs,
-                                                            dst_transform=dst_window_transform,
-                                                            dst_crs=out_profile['crs'],
-                                                            resampling=extract_params['resampling'],
-                                                            src_nodata=in_nodata)
-                                    
-                                    new_data[no_data_mask] = destination[no_data_mask]
-                                else :
-                                    new_data[no_data_mask] = window_arr[no_data_mask]
                                 
-                                #Write to the outfile
-                                out_img.write(new_data,indexes=band,window=dst_window)
+                                rasterio.warp.reproject(window_arr,
+                                                        destination,
+                                                        src_transform=src_window_transform,
+                                                        src_crs=vrt.crs,
+                                                        dst_transform=dst_window_transform,
+                                                        dst_crs=out_profile['crs'],
+                                                        resampling=extract_params['resampling'],
+                                                        src_nodata=in_nodata)
                                 
+                                new_data[no_data_mask] = destination[no_data_mask]
+                            else :
+                                new_data[no_data_mask] = window_arr[no_data_mask]
+                            
+                            #Write to the outfile
+                            out_img.write(new_data,indexes=band,window=dst_window)
+                            _update_coverage(state, dst_window, new_data, out_img.nodata)
+                            state['current_used'] = True
+                            
+                            written_blocks += 1
+                            if written_blocks % _CHECKPOINT_BLOCKS == 0:
+                                state['completed_blocks'] = block_index + 1
+                                out_img = checkpoint_mosaic(out_img, temp_file, state)
                                 
-                    if not_used_window == total_win:
+                    if not state['current_used']:
                         #Only happens if all the windows in the file were skiped
                         print(f'Extent covered by {file} is already filled in mosaic, skipping file...')
                         unused_file.append(file)
                     else :
                         used_file.append(file)
                         print(f'Updated values in mosaic with values from : {file}')
+        finally:
+            out_img.close()
                                 
-                    # break
         #Adding overviews if needed
-        if overviews:
-            print(''.rjust(75, ' '))
-            print('Creation of overviews...')
-            with rasterio.open(temp_file, 'r+') as temp_mosaic:
-                temp_mosaic = dex.add_overviews(temp_mosaic, resample=extract_params['resampling'])
-                rscopy(temp_mosaic,out_path,copy_src_overviews=True,**out_profile)
-            os.remove(temp_file)
-           
-        else:
-            print(''.rjust(75, ' '))
-            print('No overviews added to the mosaic')
-            os.rename(temp_file, out_path)
-            
-               
+        timer.report()
+        _finalize_mosaic(temp_file, out_path, out_profile, overviews,
+                         resampling=extract_params['resampling'],
+                         tags=tags, used_file=used_file)
                    
     return used_file, unused_file #list of file used inside the mosaic
 
 
+@win_ssl_patch
+def gdal_warp_mosaic(list_of_params, 
+                     out_path, 
+                     out_profile,  
+                     overviews=False,
+                     resume=False,
+                     tags=None,
+                     num_threads:int=None,
+                     warp_mem_limit:int=512):
+    
+    """
+    Mosaic engine that lets GDAL warp every source directly on the output grid.
+
+    The sources are painted in reverse order of list_of_params (lowest priority first)
+    inside the same output dataset, in the same way gdalwarp handles a list of inputs :
+    the valid pixels of a source overwrite the output, the nodata pixels are left untouched.
+    The first source of the list is therefore on top of the mosaic. The warping, resampling
+    and chunking is done by GDAL (GDALChunkAndWarpMulti) with multiple threads and a bounded
+    warp memory, without going through a WarpedVRT and a numpy array of the whole source.
+
+    The target grid is the output profile, created from get_output_dimension() which
+    is already the -tap equivalent grid.
+
+    Parameters
+    ----------
+    list_of_params : list of dictionnary
+        Dictionnary of input file path and extraction paramters for each file to includ in the mosaic
+        Same as for warped_mosaic(), only the 'resampling' value of 'params' is used.
+    out_path : pathlib.Path
+        pathlib.Path of the output result from the extraction
+    out_profile : dict
+        Profile of the output raster.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cog. The default is False.
+    resume : bool, optional
+        Continue the mosaic from the checkpoint of a previous run (temp file 
+        and its checkpoint beside the output). The default is False.
+    tags : dict, optional
+        Metadata tags written to the output. The list of files used is always 
+        written (DCE_FILES_USED). The default is None.
+    num_threads : int, optional
+        Number of threads used by the GDAL warper. The default is None, 
+        which uses all the cpus available.
+    warp_mem_limit : int, optional
+        Memory limit of the GDAL warper in MB. The default is 512.
+
+    Returns
+    -------
+    used_file : list
+        List of the files intersecting the output extent. GDAL resolves the overlaps
+        internally, so a file entirely hidden by files with higher priority is still listed.
+    unused_file : list
+        List of the files outside of the output extent.
+
+    """
+    if num_threads is None:
+        num_threads = os.cpu_count()
+
+    env = _mosaic_env()
+    band=1
+    temp_file = f'{out_path}.temp'
+    
+    out_profile = _add_bigtiff(out_profile)
+    out_bounds = rasterio.transform.array_bounds(out_profile['height'],
+                                                 out_profile['width'],
+                                                 out_profile['transform'])
+    resampling = resample_value('nearest')
+    
+    #Lowest priority first, the first file of the list is written last (on top)
+    list_of_params = list_of_params[::-1]
+    with env:
+        timer = GroupTimer()
+        out_img, state = open_mosaic_temp(temp_file, out_profile,
+                                           [p['file'] for p in list_of_params], resume)
+        used_file = state['used_file']
+        unused_file = state['unused_file']
+        try:
+            for i, params in enumerate(list_of_params):
+                if i < state['next_source']:
+                    continue
+                if i > state['next_source']:
+                    #All the sources before i are written
+                    state['next_source'] = i
+                    out_img = checkpoint_mosaic(out_img, temp_file, state)
+                timer.start(params)
+                file = params['file']
+                resampling = params['params']['resampling']
+                with rasterio.open(file) as src:
+                    src_bounds = warp.transform_bounds(src.crs, out_img.crs, *src.bounds)
+                    if (src_bounds[0] >= out_bounds[2] or src_bounds[2] <= out_bounds[0] or 
+                        src_bounds[1] >= out_bounds[3] or src_bounds[3] <= out_bounds[1]):
+                        print(f'{file} does not intersect the mosaic extent, skipping file...')
+                        unused_file.insert(0, file)
+                        continue
+                    print(''.rjust(75, '-'))
+                    print(file)
+                    warp.reproject(source=rasterio.band(src, band),
+                                   destination=rasterio.band(out_img, band),
+                                   src_nodata=src.nodata,
+                                   dst_nodata=out_img.nodata,
+                                   resampling=resampling,
+                                   init_dest_nodata=False,
+                                   num_threads=num_threads,
+                                   warp_mem_limit=warp_mem_limit)
+                    used_file.insert(0, file)
+        finally:
+            out_img.close()
+
+        timer.report()
+        _finalize_mosaic(temp_file, out_path, out_profile, overviews,
+                         resampling=resampling, tags=tags, used_file=used_file)
+                   
+    return used_file, unused_file #list of file used inside the mosaic
+
+
+@win_ssl_patch
+def reduce_mosaic(list_of_params, 
+                  out_path, 
+                  out_profile,  
+                  overviews=False,
+                  resume=False,
+                  tags=None,
+                  reducers=('first',)):
+    """
+    Mosaic engine that reduces all the sources per pixel (temporal composite) 
+    instead of keeping the first valid value.
+
+    The output is created block by block, every source intersecting the block is warped
+    on the block grid and added to streaming reducers (running min, max, sum and count and
+    a bounded memory approximate median, see BlockReducer), so only one block of each
+    reducer is in memory at any time. One band is written per reducer (float32), 
+    the band description is the name of the reducer.
+
+    Parameters
+    ----------
+    list_of_params : list of dictionnary
+        Dictionnary of input file path and extraction paramters for each file to includ in the mosaic
+        Same as for warped_mosaic(), only the 'resampling' value of 'params' is used.
+    out_path : pathlib.Path
+        pathlib.Path of the output result from the extraction
+    out_profile : dict
+        Profile of the output raster, count and dtype are replaced.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cog. The default is False.
+    resume : bool, optional
+        Continue the mosaic from the checkpoint of a previous run (temp file 
+        and its checkpoint beside the output). The default is False.
+    tags : dict, optional
+        Metadata tags written to the output. The default is None.
+    reducers : list, optional
+        Reducers to compute, in the order of the output bands, 
+        from BlockReducer.REDUCERS ('first', 'min', 'max', 'mean', 'count', 'median').
+        The default is ('first',).
+
+    Raises
+    ------
+    ValueError
+        If a reducer does not exist.
+
+    Returns
+    -------
+    used_file : list
+        List of the files with valid values in the mosaic extent.
+    unused_file : list
+        List of the other files.
+
+    """
+    reducers = list(reducers)
+    invalid = [r for r in reducers if r not in BlockReducer.REDUCERS]
+    if invalid or not reducers:
+        raise ValueError(f'Reducers {invalid} do not exist, available reducers are {BlockReducer.REDUCERS}')
+
+    env = _mosaic_env()
+    temp_file = f'{out_path}.temp'
+    files = [p['file'] for p in list_of_params]
+
+    out_profile = out_profile.copy()
+    nodata = out_profile.get('nodata')
+    if nodata is None:
+        nodata = numpy.nan
+    out_profile.update(count=len(reducers), dtype='float32', nodata=nodata)
+    out_profile = _add_bigtiff(out_profile)
+    blocksize = (out_profile['blockysize'], out_profile['blockxsize'])
+    out_shape = (out_profile['height'], out_profile['width'])
+    shape = (math.ceil(out_shape[0]/blocksize[0]), math.ceil(out_shape[1]/blocksize[1]))
+    count_band = reducers.index('count') if 'count' in reducers else None
+
+    with env:
+        footprints = source_footprints(files, out_profile['crs'])
+        ranges = [_touched_blocks(footprints[f], out_profile['transform'], blocksize, shape) 
+                  for f in files]
+        timer = GroupTimer()
+        out_img, state = open_mosaic_temp(temp_file, out_profile, files, resume)
+        used = set(state['used_file'])
+        datasets = OrderedDict()
+        try:
+            for band, reducer_name in enumerate(reducers, start=1):
+                out_img.set_band_description(band, reducer_name)
+            print(f'Reduction ({", ".join(reducers)}) of {len(files)} files in {shape[0]*shape[1]} blocks...')
+            for block_index, (r, c) in enumerate(numpy.ndindex(*shape)):
+                if block_index < state['completed_blocks']:
+                    continue
+                window = _block_window(r, c, blocksize, out_shape)
+                reducer = BlockReducer(reducers, (window.height, window.width))
+                for params, (r0, r1, c0, c1) in zip(list_of_params, ranges):
+                    if not (r0 <= r < r1 and c0 <= c < c1):
+                        continue
+                    timer.start(params)
+                    src = _open_cached(datasets, params['file'])
+                    destination = numpy.full((window.height, window.width), numpy.nan, 'float32')
+                    warp.reproject(source=rasterio.band(src, 1),
+                                   destination=destination,
+                                   src_nodata=src.nodata,
+                                   dst_transform=rasterio.windows.transform(window, out_img.transform),
+                                   dst_crs=out_img.crs,
+                                   dst_nodata=numpy.nan,
+                                   resampling=params['params']['resampling'])
+                    if reducer.update(destination):
+                        used.add(params['file'])
+                    timer.stop()
+                result = reducer.result()
+                if not numpy.isnan(nodata):
+                    for band in range(len(reducers)):
+                        if band != count_band:
+                            result[band][numpy.isnan(result[band])] = nodata
+                out_img.write(result, window=window)
+
+                if (block_index + 1) % _CHECKPOINT_BLOCKS == 0:
+                    state['completed_blocks'] = block_index + 1
+                    state['used_file'] = [f for f in files if f in used]
+                    out_img = checkpoint_mosaic(out_img, temp_file, state)
+        finally:
+            for dataset in datasets.values():
+                dataset.close()
+            out_img.close()
+
+        used_file = [f for f in files if f in used]
+        unused_file = [f for f in files if f not in used]
+        tags = dict(tags or {})
+        tags['DCE_REDUCERS'] = json.dumps(reducers)
+        timer.report()
+        _finalize_mosaic(temp_file, out_path, out_profile, overviews,
+                         resampling=list_of_params[-1]['params']['resampling'],
+                         tags=tags, used_file=used_file)
+
+    return used_file, unused_file
+
+
+class BlockReducer():
+    """
+    Streaming per pixel reducers of a block, the values of the sources are added one 
+    array at a time with update() and never stacked in memory.
+
+    first : first valid value (the latest with the default mosaic order)
+    min, max, count : running minimum, maximum and number of valid values
+    mean : running sum / count
+    median : approximate median with a remedian (Rousseeuw and Bassett, 1990), 
+        each level keeps median_buffer values per pixel, when a level is full its median 
+        goes to the next level. The result is the weighted median of the values left in
+        the levels. It is exact up to median_buffer values per pixel and uses
+        median_levels * median_buffer values per pixel whatever the number of sources.
+    """
+    REDUCERS = ('first', 'min', 'max', 'mean', 'count', 'median')
+
+    def __init__(self, reducers, shape, median_buffer:int=11, median_levels:int=3):
+        self.reducers = list(reducers)
+        self.count = numpy.zeros(shape, dtype='int32')
+        if 'first' in self.reducers:
+            self.first = numpy.full(shape, numpy.nan, dtype='float32')
+        if 'min' in self.reducers:
+            self.min = numpy.full(shape, numpy.nan, dtype='float32')
+        if 'max' in self.reducers:
+            self.max = numpy.full(shape, numpy.nan, dtype='float32')
+        if 'mean' in self.reducers:
+            self.sum = numpy.zeros(shape, dtype='float64')
+        if 'median' in self.reducers:
+            self.median_buffer = median_buffer
+            self.buffers = numpy.full((median_levels, median_buffer) + tuple(shape), 
+                                      numpy.nan, dtype='float32')
+            self.filled = numpy.zeros((median_levels,) + tuple(shape), dtype='int16')
+
+    def update(self, arr)->bool:
+        """Add the values of arr (numpy.nan for nodata), return False if arr has no valid values"""
+        valid = ~numpy.isnan(arr)
+        if not valid.any():
+            return False
+        self.count += valid
+        if 'first' in self.reducers:
+            new = valid & numpy.isnan(self.first)
+            self.first[new] = arr[new]
+        if 'min' in self.reducers:
+            numpy.fmin(self.min, arr, out=self.min)
+        if 'max' in self.reducers:
+            numpy.fmax(self.max, arr, out=self.max)
+        if 'mean' in self.reducers:
+            self.sum[valid] += arr[valid]
+        if 'median' in self.reducers:
+            self._push(0, arr, valid)
+        return True
+
+    def _push(self, level, arr, valid):
+        """Add the valid values of arr to the remedian level"""
+        rows, cols = numpy.nonzero(valid)
+        filled = self.filled[level]
+        self.buffers[level][filled[rows, cols], rows, cols] = arr[rows, cols]
+        filled[rows, cols] += 1
+        full = filled == self.median_buffer
+        if full.any():
+            medians = numpy.full(arr.shape, numpy.nan, dtype='float32')
+            medians[full] = numpy.median(self.buffers[level][:, full], axis=0)
+            self.buffers[level][:, full] = numpy.nan
+            filled[full] = 0
+            if level + 1 < len(self.buffers):
+                self._push(level + 1, medians, full)
+            else:
+                #Last level is full, its median is kept as its only value
+                self.buffers[level][0][full] = medians[full]
+                filled[full] = 1
+
+    def _median(self):
+        """Weighted median of the values left in the remedian levels"""
+        levels, size = self.buffers.shape[:2]
+        values = self.buffers.reshape((levels*size,) + self.buffers.shape[2:])
+        weights = numpy.repeat(float(size)**numpy.arange(levels), size)
+        weights = numpy.where(numpy.isnan(values), 0., weights[:, None, None])
+        order = numpy.argsort(values, axis=0) #nan are last
+        values = numpy.take_along_axis(values, order, axis=0)
+        cumulative = numpy.cumsum(numpy.take_along_axis(weights, order, axis=0), axis=0)
+        total = cumulative[-1]
+        index = numpy.argmax(cumulative >= total/2, axis=0)
+        median = numpy.take_along_axis(values, index[None], axis=0)[0]
+        median[total == 0] = numpy.nan
+        return median
+
+    def result(self):
+        """Return an array (number of reducers, height, width), numpy.nan where there is no value"""
+        no_value = self.count == 0
+        bands = []
+        for reducer in self.reducers:
+            if reducer == 'first':
+                band = self.first
+            elif reducer == 'min':
+                band = self.min
+            elif reducer == 'max':
+                band = self.max
+            elif reducer == 'mean':
+                band = numpy.where(no_value, numpy.nan, self.sum/numpy.maximum(self.count, 1))
+            elif reducer == 'count':
+                band = self.count
+            elif reducer == 'median':
+                band = self._median()
+            bands.append(band.astype('float32'))
+        return numpy.stack(bands)
+
+
+def _open_cached(datasets:OrderedDict, file, max_open:int=32):
+    """Open file or return it from the datasets already opened, closing the least recently used"""
+    if file in datasets:
+        datasets.move_to_end(file)
+        return datasets[file]
+    if len(datasets) >= max_open:
+        _, oldest = datasets.popitem(last=False)
+        oldest.close()
+    datasets[file] = rasterio.open(file)
+    return datasets[file]
+
+def _open_output_cached(datasets:OrderedDict, file, profile:dict, max_open:int=32):
+    """
+    Open file in update mode or return it from the datasets already opened, closing the least
+    recently used, file is created with profile when it does not exist
+    """
+    if file in datasets:
+        datasets.move_to_end(file)
+        return datasets[file]
+    if len(datasets) >= max_open:
+        _, oldest = datasets.popitem(last=False)
+        oldest.close()
+    if os.path.exists(file):
+        datasets[file] = rasterio.open(file, 'r+')
+    else:
+        datasets[file] = rasterio.open(file, 'w+', **profile)
+    return datasets[file]
+
+
+#Mosaic engines
+#Every engine takes the same arguments (list_of_params, out_path, out_profile, overviews=False, resume=False, tags=None)
+#where list_of_params is ordered by priority (first file on top), writes the mosaic
+#to out_path and returns the tuple (used_file, unused_file)
+MOSAIC_ENGINES = {'warped': warped_mosaic,
+                  'window': window_mosaic,
+                  'gdal': gdal_warp_mosaic}
+
+def mosaic_engine(engine:str='warped'):
+    """
+    Return the mosaic engine function registered under the name engine
+
+    Parameters
+    ----------
+    engine : str, optional
+        Name of the engine, one of the keys of MOSAIC_ENGINES. The default is 'warped'.
+
+    Raises
+    ------
+    ValueError
+        If the engine is not registered.
+
+    Returns
+    -------
+    function
+        The mosaic engine.
+
+    """
+    try:
+        return MOSAIC_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f'Mosaic engine "{engine}" does not exist, '
+                         f'available engines are {list(MOSAIC_ENGINES)}')
+
+
+def _mosaic_env():
+    """Return the rasterio.Env used by the mosaic engines"""
+    #TODO : Explore standart env. setup
+    env = rasterio.Env(
+        GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR", # a way to disable loading of side-car or auxiliary files
+        CPL_VSIL_CURL_USE_HEAD=False, #pas certaine de ce que ca fait
+        CPL_VSIL_CURL_ALLOWED_EXTENSIONS="TIF", #considering only files that ends with .tif
+        GDAL_NUM_THREADS='ALL_CPUS',#Enable multi-threaded compression by specifying the number of worker threads
+        # GDAL_HTTP_UNSAFESSL=1,
+        # CPL_CURL_VERBOSE=1,
+          )
+    return env
+
+
+def _finalize_mosaic(temp_file, out_path, out_profile, overviews, resampling,
+                     tags=None, used_file=None):
+    """Move the temp mosaic to out_path, adding the metadata tags and the overviews if needed"""
+    remove_mosaic_checkpoint(temp_file)
+    tags = dict(tags or {})
+    if used_file is not None:
+        tags['DCE_FILES_USED'] = json.dumps([str(f) for f in used_file])
+    if tags:
+        with rasterio.open(temp_file, 'r+') as temp_mosaic:
+            temp_mosaic.update_tags(**tags)
+    if overviews:
+        print(''.rjust(75, ' '))
+        print('Creation of overviews...')
+        with rasterio.open(temp_file, 'r+') as temp_mosaic:
+            temp_mosaic = DatacubeExtract.add_overviews(temp_mosaic, resample=resampling)
+            rscopy(temp_mosaic,out_path,copy_src_overviews=True,**out_profile)
+        os.remove(temp_file)
+       
+    else:
+        print(''.rjust(75, ' '))
+        print('No overviews added to the mosaic')
+        os.rename(temp_file, out_path)
+    return
+
+
+#Mosaic checkpoints
+#Number of blocks written by window_mosaic() between two checkpoints
+_CHECKPOINT_BLOCKS = 256
+#The state of a mosaic in progress is saved beside the temp file, so a killed
+#job can continue with resume=True instead of restarting from the first source.
+#Writing the values of a source in a mosaic is idempotent, so the work done after
+#the last checkpoint is simply done again.
+def mosaic_checkpoint_path(temp_file)->str:
+    """Return the path of the checkpoint of a temp mosaic"""
+    return f'{temp_file}.checkpoint'
+
+
+def mosaic_signature(out_profile:dict, files:list)->dict:
+    """
+    Return what identifies a mosaic : output grid, data type and ordered sources.
+    A checkpoint is only reused if its signature is the same.
+
+    Parameters
+    ----------
+    out_profile : dict
+        Profile of the output raster.
+    files : list
+        Ordered list of the input files.
+
+    Returns
+    -------
+    dict
+
+    """
+    return {'crs': str(out_profile['crs']),
+            'transform': [float(v) for v in list(out_profile['transform'])[:6]],
+            'width': int(out_profile['width']),
+            'height': int(out_profile['height']),
+            'count': int(out_profile.get('count', 1)),
+            'dtype': str(out_profile['dtype']),
+            'nodata': None if out_profile.get('nodata') is None else float(out_profile['nodata']),
+            'files': [str(f) for f in files]}
+
+
+def new_mosaic_state(signature:dict, out_profile:dict)->dict:
+    """
+    Return the state of a mosaic that has not started yet
+
+    next_source : index of the next source to process (all the previous ones are done)
+    completed_blocks : number of blocks done inside the source next_source
+    current_used : if values of the source next_source were already written
+    coverage : bitmap of the output blocks entirely filled with valid values
+    """
+    blockxsize = out_profile.get('blockxsize', 512)
+    blockysize = out_profile.get('blockysize', 512)
+    coverage = numpy.zeros((math.ceil(out_profile['height']/blockysize),
+                            math.ceil(out_profile['width']/blockxsize)), dtype=bool)
+    return {'signature': signature,
+            'next_source': 0,
+            'completed_blocks': 0,
+            'current_used': False,
+            'used_file': [],
+            'unused_file': [],
+            'blocksize': [blockysize, blockxsize],
+            'coverage': coverage}
+
+
+def save_mosaic_checkpoint(temp_file, state:dict):
+    """Write the checkpoint of the temp mosaic (atomic replace of the previous one)"""
+    checkpoint = mosaic_checkpoint_path(temp_file)
+    to_save = state.copy()
+    coverage = state['coverage']
+    to_save['coverage'] = {'shape': list(coverage.shape),
+                           'bits': base64.b64encode(numpy.packbits(coverage.ravel())).decode('ascii')}
+    with open(f'{checkpoint}.tmp', 'w') as f:
+        json.dump(to_save, f)
+    os.replace(f'{checkpoint}.tmp', checkpoint)
+    return
+
+
+def load_mosaic_checkpoint(temp_file, signature:dict)->Union[dict, None]:
+    """
+    Read the checkpoint of the temp mosaic
+
+    Returns
+    -------
+    dict or None
+        The state of the mosaic, None if there is no valid checkpoint or if
+        it was created for a different mosaic (signature).
+
+    """
+    checkpoint = mosaic_checkpoint_path(temp_file)
+    if not (os.path.isfile(checkpoint) and os.path.isfile(temp_file)):
+        print(f'No checkpoint found for {temp_file}, mosaic will start from the beginning')
+        return None
+    try:
+        with open(checkpoint) as f:
+            state = json.load(f)
+        shape = state['coverage']['shape']
+        bits = numpy.frombuffer(base64.b64decode(state['coverage']['bits']), dtype=numpy.uint8)
+        state['coverage'] = numpy.unpackbits(bits)[:shape[0]*shape[1]].reshape(shape).astype(bool)
+    except (ValueError, KeyError) as e:
+        print(f'Checkpoint {checkpoint} is not valid ({e}), mosaic will start from the beginning')
+        return None
+    if state['signature'] != signature:
+        print(f'Checkpoint {checkpoint} was created for another mosaic, mosaic will start from the beginning')
+        return None
+    print(f'Resuming mosaic from checkpoint, {state["next_source"]} of '
+          f'{len(signature["files"])} sources already done')
+    return state
+
+
+def remove_mosaic_checkpoint(temp_file):
+    """Delete the checkpoint of the temp mosaic if it exists"""
+    checkpoint = mosaic_checkpoint_path(temp_file)
+    if os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+    return
+
+
+def open_mosaic_temp(temp_file, out_profile, files, resume=False):
+    """
+    Open the temp mosaic in writing mode with its state
+
+    If resume is True and a valid checkpoint exists, the temp file is reopened
+    as is, otherwise a new temp file (and state) is created.
+    """
+    signature = mosaic_signature(out_profile, files)
+    state = None
+    if resume:
+        state = load_mosaic_checkpoint(temp_file, signature)
+    if state:
+        try:
+            out_img = rasterio.open(temp_file, 'r+')
+        except rasterio.errors.RasterioIOError as e:
+            print(f'Not able to reopen {temp_file} ({e}), mosaic will start from the beginning')
+            state = None
+    if not state:
+        #A checkpoint left by a previous run does not describe the new temp file
+        remove_mosaic_checkpoint(temp_file)
+        state = new_mosaic_state(signature, out_profile)
+        out_img = rasterio.open(temp_file, mode="w+", **out_profile)
+    return out_img, state
+
+
+def checkpoint_mosaic(out_img, temp_file, state):
+    """
+    Flush the temp mosaic to disk, save the checkpoint and reopen the temp mosaic
+    Rasterio has no flush method, closing the dataset is the way to write GDAL cache
+    """
+    out_img.close()
+    save_mosaic_checkpoint(temp_file, state)
+    return rasterio.open(temp_file, 'r+')
+
+
+def _block_range(window, blocksize, shape):
+    """Return the rows and columns of the blocks intersecting (touched) and
+    entirely inside (inner) the window, as (row_start, row_stop, col_start, col_stop)"""
+    row_off = int(round(window.row_off))
+    col_off = int(round(window.col_off))
+    row_end = row_off + int(round(window.height))
+    col_end = col_off + int(round(window.width))
+    by, bx = blocksize
+    touched = (max(row_off//by, 0), min(math.ceil(row_end/by), shape[0]),
+               max(col_off//bx, 0), min(math.ceil(col_end/bx), shape[1]))
+    inner = (max(math.ceil(row_off/by), 0), min(row_end//by, shape[0]),
+             max(math.ceil(col_off/bx), 0), min(col_end//bx, shape[1]))
+    return touched, inner
+
+
+def _window_is_covered(state, window)->bool:
+    """True if all the output blocks under window are already filled (no reading needed)"""
+    (r0, r1, c0, c1), _ = _block_range(window, state['blocksize'], state['coverage'].shape)
+    if r0 >= r1 or c0 >= c1:
+        return False
+    return bool(state['coverage'][r0:r1, c0:c1].all())
+
+
+def _update_coverage(state, window, data, nodata):
+    """Update the coverage bitmap with the values just written in window
+    Only the blocks entirely inside the window can be evaluated from data"""
+    _, (r0, r1, c0, c1) = _block_range(window, state['blocksize'], state['coverage'].shape)
+    by, bx = state['blocksize']
+    row_off = int(round(window.row_off))
+    col_off = int(round(window.col_off))
+    valid = ~_nodata_mask(data, nodata)
+    for r in range(r0, r1):
+        for c in range(c0, c1):
+            block = valid[r*by-row_off:(r+1)*by-row_off, c*bx-col_off:(c+1)*bx-col_off]
+            if block.size:
+                state['coverage'][r, c] = bool(block.all())
+    return
+
+
 def _add_bigtiff(out_profile, verbose=True):
-    dex = DatacubeExtract()
     #Add the bigtiff tag inside the output_profile
-    file_size = dex.calculate_file_size(out_profile['dtype'],
+    file_size = DatacubeExtract.calculate_file_size(out_profile['dtype'],
                                         out_profile['width'],
                                         out_profile['height'])
     
@@ -2096,6 +3676,147 @@ def stac_api_search_query(collections:list,
         
     return query
 
+def read_describe_parquet(path, 
+                          collections:list=None, 
+                          bbox:str=None, 
+                          bbox_crs:str='EPSG:4326',
+                          columns:list=None)->Union[gpd.GeoDataFrame, pandas.DataFrame]:
+    """
+    Read a GeoParquet table of describe.search() (dce_item or dce_asset, partitioned 
+    by collection), only the partitions of collections and the row groups that 
+    intersect the bbox are read (requires pyarrow)
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Directory of the table (ex. './data/search/dce_parquet/dce_item').
+    collections : list, optional
+        Collection ids to read. The default is None, all the collections.
+    bbox : str, optional
+        'minx,miny,maxx,maxy' of the items to read (dce_item only). 
+        The default is None, all the items.
+    bbox_crs : str, optional
+        Crs of the bbox. The default is 'EPSG:4326'.
+    columns : list, optional
+        Columns to read. The default is None, all the columns.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame or pandas.DataFrame
+        The items (EPSG:4326) or the assets.
+
+    """
+    _, dataset = import_pyarrow()
+    table = dataset.dataset(str(path), format='parquet', partitioning='hive')
+    names = table.schema.names
+    filters = []
+    if collections:
+        filters.append(dataset.field('collection_id').isin(list(collections)))
+    if bbox and 'bbox' in names:
+        xmin, ymin, xmax, ymax = dcg.transform_bbox(bbox, bbox_crs, 'EPSG:4326', densify_pts=21)
+        #The statistics of the covering column skip the row groups outside the bbox
+        filters.append((dataset.field('bbox', 'xmin') <= xmax) & (dataset.field('bbox', 'xmax') >= xmin) &
+                       (dataset.field('bbox', 'ymin') <= ymax) & (dataset.field('bbox', 'ymax') >= ymin))
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+    if columns is not None and 'geometry' in names and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    df = table.to_table(filter=expression, columns=columns).to_pandas()
+    df = df.drop(columns=[col for col in ('bbox',) if col in df.columns])
+    if 'geometry' not in df.columns:
+        return df
+    geometry = shapely.from_wkb(df.pop('geometry').to_numpy())
+    gdf = gpd.GeoDataFrame(df, geometry=geometry, crs='EPSG:4326')
+    if bbox and 'bbox' in names:
+        gdf = gdf[gdf.intersects(box(xmin, ymin, xmax, ymax))].reset_index(drop=True)
+    return gdf
+
+#Size limit of a single WCS GetCoverage (pixels), see extract/monitoring/wcs_extract
+WCS_MAX_PIXELS = 100000000
+_WCS_BLOCKSIZE = 512
+#Size of the chunks of the WCS responses written to file or memory (1MB)
+_WCS_CHUNK_SIZE = 1024*1024
+#Default maximum size of the WCS cache (bytes)
+_WCS_CACHE_SIZE = 10*1024**3
+
+
+class WcsCache():
+    """
+    Local cache of the WCS GetCoverage results, keyed by the normalized request
+    (layer, level, snapped EPSG:3979 bounds and cellsize, see DatacubeExtract.wcs_bounds()).
+
+    The results are saved as <key>.tif in cache_dir. The least recently used results 
+    are removed when the cache is over max_size (bytes). The hits, misses and evictions
+    are counted, report() prints and returns them.
+    """
+    def __init__(self, cache_dir:Union[str, pathlib.Path], max_size:int=_WCS_CACHE_SIZE):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(lid:str, level:str, bounds:tuple, cellsize)->str:
+        """Return the cache key of a GetCoverage request"""
+        request = {'lid':lid, 'level':level, 
+                   'bounds':[round(float(v), 6) for v in bounds],
+                   'cellsize':round(float(cellsize), 6)}
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key:str)->pathlib.Path:
+        return self.cache_dir / f'{key}.tif'
+
+    def get(self, key:str)->Union[pathlib.Path, None]:
+        """Return the path of the cached result or None, a hit marks the result as recently used"""
+        path = self.path(key)
+        with self._lock:
+            if path.is_file():
+                os.utime(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+        return None
+
+    def put(self, key:str, data:Union[str, pathlib.Path, bytes])->pathlib.Path:
+        """Add a result (file or bytes) to the cache and remove the least recently used results if needed"""
+        path = self.path(key)
+        temp = path.with_name(f'{path.name}.{threading.get_ident()}.temp')
+        if isinstance(data, bytes):
+            temp.write_bytes(data)
+        else:
+            shutil.copyfile(data, temp)
+        os.replace(temp, path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep:pathlib.Path=None):
+        """Remove the least recently used results until the cache is under max_size"""
+        with self._lock:
+            entries = [(f.stat().st_mtime, f.stat().st_size, f) for f in self.cache_dir.glob('*.tif')]
+            size = sum(e[1] for e in entries)
+            for _, f_size, f in sorted(entries, key=lambda e:e[0]):
+                if size <= self.max_size:
+                    break
+                if f == keep:
+                    continue
+                f.unlink(missing_ok=True)
+                size -= f_size
+                self.evictions += 1
+
+    def report(self)->pandas.DataFrame:
+        """Print and return the statistics of the cache"""
+        files = list(self.cache_dir.glob('*.tif'))
+        report = pandas.DataFrame({'hits':[self.hits], 'misses':[self.misses],
+                                   'evictions':[self.evictions], 'results':[len(files)],
+                                   'size_mb':[round(sum(f.stat().st_size for f in files)/1024**2, 3)]})
+        print(f'WCS cache {self.cache_dir} :')
+        print(report.to_string(index=False))
+        return report
+
 class DatacubeExtract():
     """All standard Datacube Extract parameters and methods
     TODO: Moved def outside of class if not necessary"""
@@ -2217,8 +3938,8 @@ class DatacubeExtract():
         return collection_dict
 
 
-    def add_overviews(self,
-                      img,
+    @staticmethod
+    def add_overviews(img,
                       resample:str='nearest',
                       blocksize:int=512):
         """
@@ -2241,7 +3962,7 @@ class DatacubeExtract():
         """
         # TODO calculate dec_factors based on num of pixels
         rows, columns = img.shape
-        dec_factors = self.overview_level(rows, columns, blocksize)
+        dec_factors = DatacubeExtract.overview_level(rows, columns, blocksize)
         if dec_factors :
             print('Overviews added to the outfile...')
             resamp = resample_value(resample)
@@ -2251,8 +3972,8 @@ class DatacubeExtract():
         return img
 
 
-    def overview_level(self,
-                       rows:int,
+    @staticmethod
+    def overview_level(rows:int,
                        columns:int,
                        blocksize:int=512) -> list:
         """
@@ -2377,8 +4098,67 @@ class DatacubeExtract():
             self.copy_cog(temp_dir_tif,img_name,**kwargs)
 
 
-    def calculate_file_size(self,
-                            dtype:str,
+    def save_cog_from_memory(self,
+                             memfile:MemoryFile,
+                             img_name:pathlib.Path,
+                             cellsize:int,
+                             tifftag_datetime:str=None,
+                             resampling_method:str='average',
+                             blocksize:int=512,
+                             overviews:bool=False) -> bool:
+        """
+        Saves an in memory WCS result to cog in a single write,
+        the result is empty if its resolution (read from the header) is not the cellsize
+
+        Parameters
+        ----------
+        memfile : rasterio.io.MemoryFile
+            The WCS result (see request_to_memory()).
+        img_name : pathlib.Path
+            The output cog.
+        cellsize : int
+            Cellsize in meters of the request.
+        tifftag_datetime : str, optional
+            TIFFTAG_DATETIME value must be in format YYYY:MM:DD hh:mm:ss.
+            The default is None.
+        resampling_method :  Resampling alogrithms ('nearest', 'cubic',
+                                                    'average', 'mode', and 'gauss')
+        blocksize : int, optional
+        overviews : bool, optional
+
+        Returns
+        -------
+        bool
+            False if the WCS result is empty, no cog is written.
+
+        """
+        if tifftag_datetime:
+            self.check_date_time(tifftag_datetime)
+
+        # The overviews and tags are added to the in memory file, then copied to the cog
+        with rasterio.open(memfile.name, 'r+') as img:
+            resx, resy = img.res
+            if resx != cellsize or resy != cellsize:
+                print('Extraction from WCS is empty...')
+                return False
+            if overviews:
+                img = self.add_overviews(img, resampling_method, blocksize)
+            else:
+                print('No overviews added to file')
+            if tifftag_datetime:
+                img.update_tags(TIFFTAG_DATETIME=tifftag_datetime)
+            kwargs = img.profile
+        kwargs['compress'] = 'LZW'
+        kwargs['tiled'] = True
+        kwargs['blockxsize'] = blocksize
+        kwargs['blockysize'] = blocksize
+        kwargs = _add_bigtiff(kwargs, verbose=False)
+        self.copy_cog(memfile.name,img_name,**kwargs)
+        return True
+
+
+    @staticmethod
+    def calculate_file_size(dtype:str,
                             width:int,
                             height:int):
         """
@@ -2562,8 +4342,8 @@ class DatacubeExtract():
         return r
 
 
-    def check_outpath(self,
-                      outpath,
+    @staticmethod
+    def check_outpath(outpath,
                       mode:int=511):
         """
         Creates directory structure if it doesnt already exist
@@ -2587,8 +4367,8 @@ class DatacubeExtract():
         return outpath
 
 
-    def check_outfile(self,
-                      file_path):
+    @staticmethod
+    def check_outfile(file_path):
         """
         Check if a file existe and delete it if so
 
@@ -2675,13 +4455,13 @@ class DatacubeExtract():
         main_log.append(f'getting wcs result stream from  get request {u}')
         main_log.append(f'writing result to {img_name}')
         self.append_to_file(main_log,f_main)
-        r = requests.get(u)
+        r = requests.get(u,stream=True)
         sc = r.status_code
         reason = r.reason
-        # write image out to test.tif in 128 byte chunks if r.status_code=200
+        # write image out to test.tif in _WCS_CHUNK_SIZE chunks if r.status_code=200
         if sc == 200 :
             with open(img_name,'wb') as img:
-                for chunk in r.iter_content(chunk_size=128):
+                for chunk in r.iter_content(chunk_size=_WCS_CHUNK_SIZE):
                      img.write(chunk)                
             img.close()
         else:
@@ -2690,6 +4470,52 @@ class DatacubeExtract():
         return f"{img_name} request sc:{sc} reason:{reason}"
 
 
+    @nrcan_requests_ca_patch
+    def request_to_memory(self,
+                          u:str,
+                          f_main='main.log')->MemoryFile:
+        """
+        Sends get request to wcs and streams the result to an in memory file (/vsimem/)
+
+        Parameters
+        ----------
+        u : str
+            GetCoverage Request.
+        f_main : TYPE, optional
+            The default is 'main.log'.
+
+        Raises
+        ------
+        Exception
+            Error with the wcs call, response is not 200.
+
+        Returns
+        -------
+        rasterio.io.MemoryFile
+            The GetCoverage result, to be closed by the caller.
+
+        """
+        main_log = []
+        main_log.append(f'getting wcs result stream from  get request {u}')
+        main_log.append('writing result to memory')
+        self.append_to_file(main_log,f_main)
+        r = requests.get(u,stream=True)
+        sc = r.status_code
+        if sc != 200:
+            r.close()
+            raise Exception('Error when getting wcs result:', sc)
+        memfile = MemoryFile()
+        try:
+            for chunk in r.iter_content(chunk_size=_WCS_CHUNK_SIZE):
+                memfile.write(chunk)
+        except:
+            memfile.close()
+            raise
+        finally:
+            r.close()
+        return memfile
+
+
     def wcs_coverage_extract(self,bbox_as_dict:dict,
                              crs:str,
                              protocol:str,
@@ -2703,10 +4529,17 @@ class DatacubeExtract():
                              suffix:str='wcs',
                              f_main='main.log',
                              tifftag_datetime=None,
-                             overviews=False):
+                             overviews=False,
+                             max_pixels:int=WCS_MAX_PIXELS,
+                             max_workers:int=4,
+                             retries:int=3,
+                             wcs_cache:Union[str, WcsCache]=None):
         """
         Extract WCS coverage based on bbox
 
+        A request over max_pixels is split in sub-coverages fetched concurrently
+        and assembled in a single cog (see wcs_tiled_extract()).
+
         Parameters
         ----------
         bbox_as_dict : dict
@@ -2739,6 +4572,16 @@ class DatacubeExtract():
             Main log file name. The default is 'main.log'
         overviews : bool, optional
             Trigger the creation of overviews if True in the output cog
+        max_pixels : int, optional
+            Maximum number of pixels of a single GetCoverage.
+            The default is WCS_MAX_PIXELS, the size limit of the service.
+        max_workers : int, optional
+            Number of sub-coverages requested at the same time. The default is 4.
+        retries : int, optional
+            Number of retries of a failed GetCoverage. The default is 3.
+        wcs_cache : str or WcsCache, optional
+            Directory (or WcsCache) of the local cache of the GetCoverage results,
+            consulted before requesting the service. The default is None, no cache.
 
         Returns
         -------
@@ -2761,23 +4604,31 @@ class DatacubeExtract():
         # convert python geojson dict to shapely geom
         cwd = self.check_outpath(cwd)
         bbox = shape(bbox_as_dict)
-        #  get url for request and input bounds tuple for comparison to result
-        u = self.wcs_request(bbox,crs,cellsize,protocol,lid,level,srv_id,
-                               f_main)
-        # print('{} calcd u {}'. format(suffix,u))
-        # write image out to test.tif in 128 byte chunks if r.status_code=200
         img_name=pathlib.Path(os.path.join(cwd,"{}_sample-{}.tif".format(study_area,suffix)))
         self.check_outfile(img_name)
-        self.request_to_file(u[0],img_name,f_main)
-        # TODO ensure tifftag_datetime has actual datetime of WCS data rather than None
-        # Read headers from file to validate theire is data in the file
-        valid = self.validate_wcs_output(img_name, cellsize)
-        # reopen and add overviews
-        if valid:
-            self.save_cog_from_file(img_name,resampling_method=method, overviews=overviews, tifftag_datetime=tifftag_datetime)
-            return img_name
-        else :
-            return None
+        if isinstance(wcs_cache, (str, pathlib.Path)):
+            wcs_cache = WcsCache(wcs_cache)
+        bounds = self.wcs_bounds(bbox,crs,cellsize)
+        nb_pixel = self.calculate_size(bounds[2] - bounds[0], bounds[3] - bounds[1], cellsize)
+        if nb_pixel > max_pixels:
+            img_name = self.wcs_tiled_extract(bounds,cellsize,protocol,lid,level,srv_id,img_name,
+                                              f_main=f_main,method=method,overviews=overviews,
+                                              tifftag_datetime=tifftag_datetime,max_pixels=max_pixels,
+                                              max_workers=max_workers,retries=retries,wcs_cache=wcs_cache)
+        else:
+            #  get url for request
+            u = self.wcs_url(bounds,cellsize,protocol,lid,level,srv_id)
+            # print('{} calcd u {}'. format(suffix,u))
+            # The response is kept in memory and written once to the cog
+            with self.cached_request(u,lid,level,bounds,cellsize,f_main,retries,wcs_cache) as memfile:
+                # TODO ensure tifftag_datetime has actual datetime of WCS data rather than None
+                valid = self.save_cog_from_memory(memfile,img_name,cellsize,resampling_method=method,
+                                                  overviews=overviews,tifftag_datetime=tifftag_datetime)
+            if not valid:
+                img_name = None
+        if wcs_cache:
+            wcs_cache.report()
+        return img_name
             
     
     def validate_wcs_output(self, img_name:pathlib.Path, cellsize:int):
@@ -2794,6 +4645,190 @@ class DatacubeExtract():
             return True
 
 
+    def request_with_retry(self,
+                           u:str,
+                           img_name:str=None,
+                           f_main='main.log',
+                           retries:int=3,
+                           backoff:float=2.):
+        """
+        request_to_file() retried with an exponential backoff (1, backoff, backoff**2... seconds),
+        request_to_memory() if img_name is None
+
+        Raises
+        ------
+        Exception
+            The error of the last try.
+
+        """
+        for attempt in range(retries + 1):
+            try:
+                if img_name is None:
+                    return self.request_to_memory(u,f_main)
+                return self.request_to_file(u,img_name,f_main)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                wait = backoff**attempt
+                print(f'WCS request failed ({e}), retry {attempt + 1}/{retries} in {wait}s')
+                time.sleep(wait)
+
+
+    def cached_request(self,
+                       u:str,
+                       lid:str,
+                       level:str,
+                       bounds:tuple,
+                       cellsize,
+                       f_main='main.log',
+                       retries:int=3,
+                       wcs_cache:WcsCache=None,
+                       img_name:pathlib.Path=None):
+        """
+        GetCoverage result of u, from the wcs_cache if the normalized request 
+        (lid, level, bounds, cellsize) is in it, else from the service (added to the cache)
+
+        Returns
+        -------
+        rasterio.io.MemoryFile or str
+            The result in memory, or the request message if img_name is given 
+            (the result is written to img_name).
+
+        """
+        key = wcs_cache.key(lid,level,bounds,cellsize) if wcs_cache else None
+        cached = wcs_cache.get(key) if wcs_cache else None
+        if cached:
+            print(f'WCS result read from the cache {cached}')
+            if img_name is None:
+                return MemoryFile(cached.read_bytes())
+            shutil.copyfile(cached,img_name)
+            return f'{img_name} read from cache {cached}'
+        result = self.request_with_retry(u,img_name,f_main,retries)
+        if wcs_cache:
+            if img_name is None:
+                wcs_cache.put(key,bytes(result.getbuffer()))
+            else:
+                wcs_cache.put(key,img_name)
+        return result
+
+
+    def wcs_tiled_extract(self,
+                          bounds:tuple,
+                          cellsize:int,
+                          protocol:str,
+                          lid:str,
+                          level:str,
+                          srv_id:str,
+                          img_name:pathlib.Path,
+                          f_main='main.log',
+                          method:str='nearest',
+                          overviews:bool=False,
+                          tifftag_datetime:str=None,
+                          max_pixels:int=WCS_MAX_PIXELS,
+                          max_workers:int=4,
+                          retries:int=3,
+                          wcs_cache:WcsCache=None):
+        """
+        Extract a WCS coverage over the size limit of the service
+
+        The bounds are split in sub-coverages under max_pixels (see wcs_tile_bounds()),
+        requested concurrently with retries and written one at a time in the window
+        of a single cog, the memory is bounded by the size of a sub-coverage.
+
+        Parameters
+        ----------
+        bounds : tuple
+            (minx, miny, maxx, maxy) in EPSG:3979, divisible by the cellsize (see wcs_bounds()).
+        cellsize : int
+            Cellsize in meters.
+        protocol : str
+           Internet protocol (http or https).
+        lid : str
+            Layer name.
+        level : str
+            S3 level (beta, dev, stage, prod) Beta is on stage.
+        srv_id : str
+            Web service name.
+        img_name : pathlib.Path
+            Path of the output cog.
+        f_main : str, optional
+            Main log file name. The default is 'main.log'
+        method : str, optional
+            Resampling method of the overviews. The default is 'nearest'.
+        overviews : bool, optional
+            Trigger the creation of overviews if True in the output cog.
+        tifftag_datetime : str, optional
+            TIFFTAG_DATETIME value must be in format YYYY:MM:DD hh:mm:ss.
+        max_pixels : int, optional
+            Maximum number of pixels of a sub-coverage. The default is WCS_MAX_PIXELS.
+        max_workers : int, optional
+            Number of sub-coverages requested at the same time. The default is 4.
+        retries : int, optional
+            Number of retries of a failed sub-coverage. The default is 3.
+        wcs_cache : WcsCache, optional
+            Local cache of the sub-coverages. The default is None.
+
+        Returns
+        -------
+        img_name : pathlib.Path
+            Path of the cog, None if all the sub-coverages are empty.
+
+        """
+        if tifftag_datetime:
+            self.check_date_time(tifftag_datetime)
+        tiles = self.wcs_tile_bounds(bounds,cellsize,max_pixels)
+        print(f'WCS request over {max_pixels} pixels, split in {len(tiles)} sub-coverages')
+        minx,miny,maxx,maxy = bounds
+        transform = from_origin(minx,maxy,cellsize,cellsize)
+        with TemporaryDirectory() as temp_dir:
+            def _fetch(i):
+                tile_name = pathlib.Path(temp_dir,f'{img_name.stem}_{i}.tif')
+                self.cached_request(self.wcs_url(tiles[i],cellsize,protocol,lid,level,srv_id),
+                                    lid,level,tiles[i],cellsize,f_main,retries,wcs_cache,tile_name)
+                if self.validate_wcs_output(tile_name,cellsize):
+                    return tile_name
+                return None
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                tile_names = list(executor.map(_fetch,range(len(tiles))))
+            valid = [(name,tile) for name,tile in zip(tile_names,tiles) if name]
+            if not valid:
+                print('Extraction from WCS is empty...')
+                return None
+
+            with rasterio.open(valid[0][0]) as src:
+                profile = src.profile
+            profile.update(driver='GTiff',
+                           height=round((maxy - miny)/cellsize),
+                           width=round((maxx - minx)/cellsize),
+                           transform=transform,
+                           compress='LZW',
+                           tiled=True,
+                           blockxsize=_WCS_BLOCKSIZE,
+                           blockysize=_WCS_BLOCKSIZE)
+            profile = _add_bigtiff(profile)
+            temp_tif = pathlib.Path(temp_dir,f'{img_name.name}.temp')
+            with rasterio.open(temp_tif,'w',**profile) as new:
+                for name,tile in valid:
+                    window = rasterio.windows.from_bounds(*tile,transform=transform).round_offsets().round_lengths()
+                    with rasterio.open(name) as src:
+                        # The returned coverage can differ slightly from the requested bounds
+                        src_window = rasterio.windows.from_bounds(*tile,transform=src.transform)
+                        arr = src.read(1,window=src_window,out_shape=(window.height,window.width),
+                                       boundless=True,fill_value=profile['nodata'] or 0)
+                    new.write(arr,indexes=1,window=window)
+                    os.remove(name)
+                if overviews:
+                    new = self.add_overviews(new, method, _WCS_BLOCKSIZE)
+                else:
+                    print('No overviews added to file')
+                if tifftag_datetime:
+                    new.update_tags(TIFFTAG_DATETIME=tifftag_datetime)
+            self.copy_cog(temp_tif,img_name,**profile)
+        print(f'{len(valid)} of {len(tiles)} sub-coverages written to {img_name}')
+        return img_name
+
+
     def wcs_request(self,
                     bbox,
                     crs='EPSG:3979',
@@ -2839,14 +4874,44 @@ class DatacubeExtract():
         request, bbox = dex.wcs_request(poly,cellsize=300,level='stage')
         """
 
+        bounds = self.wcs_bounds(bbox,crs,cellsize)
+        minx,miny,maxx,maxy = bounds
+        nb_pixel = self.calculate_size(maxx - minx, maxy - miny, cellsize)
+
+        if nb_pixel > WCS_MAX_PIXELS:
+            #if nb_pixel > 10000000000:
+            raise ValueError('Request reach the size limit, try a smaller area or a lower resolution.')
+
+        return self.wcs_url(bounds,cellsize,protocol,lid,level,srv_id),bounds
+
+
+    def wcs_bounds(self,
+                   bbox,
+                   crs='EPSG:3979',
+                   cellsize=20) -> tuple:
+        """
+        Return the EPSG:3979 bounds of a WCS GetCoverage, divisible by the cellsize
+
+        Parameters
+        ----------
+        bbox : shapely polygon
+            The bounding box as shapely polygon.
+        crs : str
+            EPSG number.
+        cellsize : int
+            Cellsize in meters.
+
+        Returns
+        -------
+        tuple
+            (minx, miny, maxx, maxy) in EPSG:3979.
+
+        """
         # Converts requests to EPSG:3979
         crs3979='EPSG:3979'
         # Need to select an area evenly divdable by pixel size with bbox
         # Equal to minx-(cellsize/2),minx-(cellsize/2),maxx-(cellsize/2),
         # maxy-cellsize/2)
-        # level='stage'
-        rd=self.get_root_domain(level)
-        srv_id='elevation'
         # convert bbox to 3979 for calculation
         if '3979' in crs:
             bbox3979=bbox
@@ -2866,17 +4931,47 @@ class DatacubeExtract():
         # deltay = self.getEvenCellSizeLength(dy,cellsize)
         deltax = self.get_cells(dx,cellsize)*cellsize
         deltay = self.get_cells(dy,cellsize)*cellsize
-        nb_pixel = self.calculate_size(deltax, deltay, cellsize)
-
-        if nb_pixel > 100000000:
-            #if nb_pixel > 10000000000:
-            raise ValueError('Request reach the size limit, try a smaller area or a lower resolution.')
-
         maxx = minx + deltax
         maxy = miny + deltay
         # print('calced 3979 submited to wcs bbox minx,miny,maxx,maxy {},
               #{}, {}, {}'.format(minx,miny,maxx,maxy))
-        coords=box(minx,miny,maxx,maxy)
+        return box(minx,miny,maxx,maxy).bounds
+
+
+    def wcs_url(self,
+                bounds:tuple,
+                cellsize=20,
+                protocol='https',
+                lid='dtm',
+                level='beta',
+                srv_id='elevation') -> str:
+        """
+        Return the WCS GetCoverage call of EPSG:3979 bounds (see wcs_bounds())
+
+        Parameters
+        ----------
+        bounds : tuple
+            (minx, miny, maxx, maxy) in EPSG:3979, divisible by the cellsize.
+        cellsize : int
+            Cellsize in meters.
+        protocol : str
+           Internet protocol (http or https).
+        lid : str
+            Layer name.
+        level : str
+            S3 level (beta, dev, stage, prod) Beta is on stage.
+        srv_id : str
+            Web service name.
+
+        Returns
+        -------
+        str
+            WCS GetCoverage call
+
+        """
+        minx,miny,maxx,maxy = bounds
+        rd=self.get_root_domain(level)
+        srv_id='elevation'
         # pass bbox and identifier into call
         root = "{}://{}/{}".format(protocol,rd,srv_id)
         params = "service=WCS&version=1.1.1&request=GetCoverage&format=image/geotiff"
@@ -2884,7 +4979,47 @@ class DatacubeExtract():
         params += "&BoundingBox={},{},{},{},urn:ogc:def:crs:EPSG::3979".format(minx,miny,maxx,maxy)
         params += "&GridBaseCRS=urn:ogc:def:crs:EPSG::3979&GridOffsets={:.1f},-{:.1f}"\
             .format(float(cellsize),float(cellsize))
-        return "{}?{}".format(root,params),coords.bounds
+        return "{}?{}".format(root,params)
+
+
+    def wcs_tile_bounds(self,
+                        bounds:tuple,
+                        cellsize=20,
+                        max_pixels:int=WCS_MAX_PIXELS) -> list:
+        """
+        Split the bounds of a WCS GetCoverage in sub-coverages under max_pixels,
+        aligned on the cellsize grid of the bounds
+
+        Parameters
+        ----------
+        bounds : tuple
+            (minx, miny, maxx, maxy) in EPSG:3979, divisible by the cellsize.
+        cellsize : int
+            Cellsize in meters.
+        max_pixels : int, optional
+            Maximum number of pixels of a sub-coverage. The default is WCS_MAX_PIXELS.
+
+        Returns
+        -------
+        list
+            The (minx, miny, maxx, maxy) of the sub-coverages, by row from the top left.
+
+        """
+        minx,miny,maxx,maxy = bounds
+        width = round((maxx - minx)/cellsize)
+        height = round((maxy - miny)/cellsize)
+        # Square sub-coverages, multiple of the output blocksize when possible
+        side = int(math.sqrt(max_pixels))
+        if side >= _WCS_BLOCKSIZE:
+            side -= side % _WCS_BLOCKSIZE
+        tiles = []
+        for row in range(0, height, side):
+            for col in range(0, width, side):
+                tiles.append((minx + col*cellsize,
+                              maxy - min(row + side, height)*cellsize,
+                              minx + min(col + side, width)*cellsize,
+                              maxy - row*cellsize))
+        return tiles
 
 
     def tuple_to_bbox(self,
@@ -2901,8 +5036,7 @@ class DatacubeExtract():
         bbox : str
 
         """
-        bbox = ','.join([str(x) for x in bounds_tuple])
-        return bbox
+        return dcg.tuple_to_bbox(bounds_tuple)
 
 
     def bbox_to_tuple(self,
@@ -2919,8 +5053,7 @@ class DatacubeExtract():
         bbox : tuple
 
         """
-        bbox = tuple(float(v) for v in str_bbox.split(','))
-        return bbox
+        return dcg.bbox_to_tuple(str_bbox)
 
 
     def dict_to_poly(self,
@@ -2937,7 +5070,7 @@ class DatacubeExtract():
         shapely.geometry.polygon.Polygon
 
         """
-        return shape(bbox_dict)
+        return dcg.dict_to_poly(bbox_dict)
 
 
     def poly_to_dict(self,
@@ -2956,7 +5089,7 @@ class DatacubeExtract():
             Dictionnary of the bbox as geojson format.
 
         """
-        return mapping(bbox_poly)
+        return dcg.poly_to_dict(bbox_poly)
 
 
     def dict_to_vector_file(self,
@@ -3012,8 +5145,7 @@ class DatacubeExtract():
             Reprojection dictionnary of the geometry.
 
         """
-        g = warp.transform_geom(in_crs,out_crs,bbox_dict)
-        return g
+        return dcg.transform_dict(bbox_dict,in_crs,out_crs)
 
 
     def transform_dict_to_poly(self,
@@ -3041,8 +5173,7 @@ class DatacubeExtract():
             DESCRIPTION.
 
         """
-        g = warp.transform_geom(in_crs,out_crs,bbox_dict)
-        return self.dict_to_poly(g)
+        return dcg.transform_dict_to_poly(bbox_dict,in_crs,out_crs)
 
 
     def bbox_to_poly(self,
@@ -3059,16 +5190,7 @@ class DatacubeExtract():
         bbox : shapely.polygon
 
         """
-        #bbox='-269985.0,90015.0,-265875.0,95895.0'
-        #crs='EPSG:3979'
-        # convert bounding box strings to dict of floats
-
-        b=[]
-        for t in bbox.split(','):
-            b.append(float(t))
-        #create shapely polygon bbox
-        bbox=box(*b)
-        return bbox
+        return dcg.bbox_to_poly(bbox)
 
 
     def get_root_domain(self,
@@ -83,9 +83,12 @@ import argparse
 import os
 import sys
 import pathlib
+from typing import Union
 
 # Custom packages
 import geopandas as gpd
+import pandas
+import rasterio
 
 # Ensure syspath first  reference is to .../dc_extract/... parent of all local files
 # for this file it is  .../dc_extract/*/<modules> so need parents[1]
@@ -106,7 +109,7 @@ def extract_cog(collections:str,
                 field_value=None,
                 field_id:str=None,
                 geom_file:str=None,
-                resolution:int=None,
+                resolution:Union[int, list]=None,
                 method:str='nearest',
                 out_crs:str=None,
                 out_dir:str=None,
@@ -117,7 +120,13 @@ def extract_cog(collections:str,
                 debug:bool=False,
                 mosaic:bool=False, 
                 orderby:str='date', 
-                desc:bool=True):
+                desc:bool=True,
+                engine:str='warped',
+                resume:bool=False,
+                update:bool=False,
+                reducers:str=None,
+                tile_store:str=None,
+                wcs_cache:str=None):
     """
     Validate the input parameters before calling the _extract_cog() 
 
@@ -158,10 +167,14 @@ def extract_cog(collections:str,
     geom_file : str, optional
         Path to a geojson or geopackage containing the extent for extraction. 
         One of bbox of geom_file must be define for the extraction.
-    resolution : int, optional
+    resolution : int or list, optional
         The output resolution. The default is None,
         which keeps the original resolution for each layer.
         Must be define when mosaic=True
+        With a list of resolutions (ex: [1, 4, 16]), the sources are extracted once 
+        at the finest resolution and the coarser outputs are created by block aggregation 
+        of the finest output (see extract.aggregate_resolution()). The coarser resolutions
+        must be multiples of the finest.
     method : str, optional
         Resampling alogrithms ('nearest', 'cubic', 'average', 'mode', and 'gauss')
         Default is nearest
@@ -204,6 +217,33 @@ def extract_cog(collections:str,
     desc : bool, optional
         The method to order the parameter to create the mosaic.
         Default is True, which take the latest (when orderby='date') or finest (when orderby='resolution') on top and goes from there in descending order
+    engine : str, optional
+        The mosaic engine used to create the mosaic.
+        Default is 'warped'. Other accepted values are 'window' (block by block)
+        and 'gdal' (GDAL multi-threaded warp of all the sources on the output grid)
+    resume : bool, optional
+        Continue a mosaic interrupted (crash, job wallclock) in a previous run from
+        its checkpoint, saved beside the temp output file, instead of starting over.
+        Default is False
+    update : bool, optional
+        If the mosaic already exists in out_dir, only update it with the items added, 
+        changed or removed since its creation (see extract.update_mosaic()).
+        Default is False
+    reducers : str or list, optional
+        Per pixel reducers of all the items of the mosaic, one output band per reducer
+        (see extract.reduce_mosaic()). Accepted values are 'first', 'min', 'max', 
+        'mean', 'count' and 'median', as a list or a comma separated string ('min,max,median').
+        Default is None, the first valid value is kept (latest on top)
+    tile_store : str, optional
+        Root directory of a tile store on the datacube standard grid (EPSG:3979),
+        used to create the mosaic (see extract.tile_mosaic()). The items are warped 
+        once per tile and the tiles are reused by the later extractions that cover them.
+        Requires mosaic=True and out_crs='EPSG:3979', the output is snapped on the standard grid.
+        Default is None
+    wcs_cache : str, optional
+        Directory of a local cache of the WCS GetCoverage results (collection hrdem-wcs),
+        the repeated requests are read from the cache (see extract.WcsCache).
+        Default is None
 
     Returns
     -------
@@ -231,7 +271,13 @@ def extract_cog(collections:str,
                 'debug':debug,
                 'mosaic':mosaic, 
                 'orderby':orderby, 
-                'desc':desc}
+                'desc':desc,
+                'engine':engine,
+                'resume':resume,
+                'update':update,
+                'reducers':reducers,
+                'tile_store':tile_store,
+                'wcs_cache':wcs_cache}
     
 
     validated_parameters = exc_validator.ExtractCogSetting(**params)   
@@ -248,11 +294,20 @@ def _extract_cog(collections,bbox, bbox_crs,
                 resolution,method,out_crs,
                 out_dir,suffix,datetime_filter,
                 resolution_filter,overviews,
-                debug,mosaic,orderby,desc):
+                debug,mosaic,orderby,desc,engine='warped',
+                resume=False,update=False,reducers=None,tile_store=None,wcs_cache=None):
     """
     Wrapper of the extract functionnalities
     """
     dex = dce.DatacubeExtract(debug=debug)
+
+    #With a list of resolutions, only the finest is extracted from the sources
+    if isinstance(resolution, (list, tuple)):
+        resolutions = sorted(resolution)
+        resolution = resolutions[0]
+        coarser_resolutions = resolutions[1:]
+    else:
+        coarser_resolutions = []
     
     #Create the empty list of output files
     out_files = []
@@ -293,6 +348,8 @@ def _extract_cog(collections,bbox, bbox_crs,
     
     # Get the list of all the input file resolutions from all collections
     list_resolutions = df.item_resolution.unique().tolist()
+    #The coarser resolutions are part of the lcm grid so they cover the same extent
+    list_resolutions_grid = list_resolutions + coarser_resolutions
     
     #'Convert' the geometry to a bbox for the extraction if geom was define as input extent
     if geom_file and field_value and field_id:
@@ -311,13 +368,15 @@ def _extract_cog(collections,bbox, bbox_crs,
 
         # Create WCS base cog
         if collection == 'hrdem-wcs':
-            # Create a cog from a wcs
-            out_file = dce.wcs(mosaic=mosaic,collection=collection,asset=asset,bbox=bbox,
-                               bbox_crs=extent_crs,resolution=resolution,out_dir=out_dir,
-                               method=method,overviews=overviews,suffix=suffix)
-            
-            if out_file:
-                out_files.append(out_file)
+            # Create a cog from a wcs, the service resamples each resolution
+            for res in [resolution] + coarser_resolutions:
+                out_file = dce.wcs(mosaic=mosaic,collection=collection,asset=asset,bbox=bbox,
+                                   bbox_crs=extent_crs,resolution=res,out_dir=out_dir,
+                                   method=method,overviews=overviews,suffix=suffix,
+                                   wcs_cache=wcs_cache)
+                
+                if out_file:
+                    out_files.append(out_file)
 
         # Create a cog_chip, minicube or mosaic from a cog
         else:
@@ -338,22 +397,43 @@ def _extract_cog(collections,bbox, bbox_crs,
 
             if urls:
                 
-                if mosaic == True:
+                if mosaic == True and tile_store:
+                    print(f'Mosaic will be created for collection {collection} from the tile store {tile_store}')
+                    out_path = pathlib.Path(out_dir)/_mosaic_file_name(collection, asset, out_crs, resolution, suffix)
+                    out_dict = dce.tile_mosaic(df_collection, bbox=bbox, bbox_crs=extent_crs, 
+                                               resolution=resolution, tile_store=tile_store,
+                                               out_path=out_path, orderby=orderby, desc=desc,
+                                               method=method, overviews=overviews)
+                    if isinstance(out_dict, dict):
+                        out_files.append(out_dict)
+                        for out_path, files_used in out_dict.items():
+                            for coarse_path in _aggregate_outputs(
+                                    out_path, resolution, coarser_resolutions, method, overviews,
+                                    lambda res: pathlib.Path(out_dir)/_mosaic_file_name(collection, asset, out_crs, res, suffix)):
+                                out_files.append({coarse_path:files_used})
+                elif mosaic == True:
                     if len(urls) > 1:
                         # Make mosaic by passing to _mosaic
                         print(f'Mosaic will be created for collection {collection} in crs {out_crs} and resolution {resolution}')
-                        #TODO : do something with suffix
-                        if suffix:
-                            out_file = (f"{collection}_{asset}_mosaic_{out_crs.split(':')[1]}_{resolution}m-{suffix}.tif")
+                        out_file = _mosaic_file_name(collection, asset, out_crs, resolution, suffix)
+                        existing_path = pathlib.Path(out_dir)/out_file
+                        if update and existing_path.is_file():
+                            print(f'Update of the existing mosaic {existing_path}')
+                            out_dict = dce.update_mosaic(existing_path, df_collection)
                         else:
-                            out_file = (f"{collection}_{asset}_mosaic_{out_crs.split(':')[1]}_{resolution}m.tif")
-                        out_dict = dce.mosaic(df=df_collection,orderby=orderby,resolution=resolution,
-                                              desc=desc,list_resolutions=list_resolutions,bbox=bbox,
-                                              bbox_crs=extent_crs,method=method,out_crs=out_crs,
-                                              out_dir=out_dir,out_file=out_file,overviews=overviews)
+                            out_dict = dce.mosaic(df=df_collection,orderby=orderby,resolution=resolution,
+                                                  desc=desc,list_resolutions=list_resolutions_grid,bbox=bbox,
+                                                  bbox_crs=extent_crs,method=method,out_crs=out_crs,
+                                                  out_dir=out_dir,out_file=out_file,overviews=overviews,
+                                                  engine=engine,resume=resume,reducers=reducers)
                         #If None is return, we don't want to add it to the list
                         if isinstance(out_dict, dict):
                             out_files.append(out_dict)
+                            for out_path, files_used in out_dict.items():
+                                for coarse_path in _aggregate_outputs(
+                                        out_path, resolution, coarser_resolutions, method, overviews,
+                                        lambda res: pathlib.Path(out_dir)/_mosaic_file_name(collection, asset, out_crs, res, suffix)):
+                                    out_files.append({coarse_path:files_used})
                             
                     else:
                         # Call cogchip
@@ -361,21 +441,25 @@ def _extract_cog(collections,bbox, bbox_crs,
                         # for url in urls: # Technically, there will be only one url in list
                         for item in df_collection.itertuples():    
                             out_file = dce.cog_chip(url=item.url,out_crs=out_crs,resolution=resolution,
-                                                    list_resolutions=list_resolutions,bbox=bbox,
+                                                    list_resolutions=list_resolutions_grid,bbox=bbox,
                                                     bbox_crs=extent_crs,method=method,out_dir=out_dir,
                                                     overviews=overviews,suffix=suffix,in_res=item.item_resolution)
                             if out_file: 
                                 out_files.append(out_file)
+                                out_files.extend(_aggregate_cog_chip(out_file, item, resolution, coarser_resolutions,
+                                                                     method, overviews, out_dir, suffix))
                 else:
                     # Call cogchip
                     # for url in urls:
                     for item in df_collection.itertuples():
                         out_file = dce.cog_chip(url=item.url,out_crs=out_crs,resolution=resolution,
-                                                list_resolutions=list_resolutions,bbox=bbox,
+                                                list_resolutions=list_resolutions_grid,bbox=bbox,
                                                 bbox_crs=extent_crs,method=method,out_dir=out_dir,
                                                 overviews=overviews,suffix=suffix,in_res=item.item_resolution)
                         if out_file:
                             out_files.append(out_file)
+                            out_files.extend(_aggregate_cog_chip(out_file, item, resolution, coarser_resolutions,
+                                                                 method, overviews, out_dir, suffix))
             else:
                 #todo : modify the message or the logic of urls per collection because not taking into account
                 #if one of the asked collection has urls but the other one does not
@@ -390,6 +474,198 @@ def _extract_cog(collections,bbox, bbox_crs,
         return None
 
 
+@print_time
+def extract_cog_batch(collections:str,
+                      aois,
+                      name_field:str=None,
+                      resolution:int=None,
+                      method:str='nearest',
+                      out_crs:str=None,
+                      out_dir:str=None,
+                      suffix:str=None,
+                      datetime_filter:str=None,
+                      resolution_filter:str=None,
+                      overviews:bool=False,
+                      orderby:str='date',
+                      desc:bool=True)->list:
+    """
+    Extraction of many areas of interest (AOI) at once, ex: hundreds of adjacent basins.
+
+    A single STAC search is done for the extent of all the AOIs, then for each collection 
+    every item is read once and its pixels are written to all the AOI outputs that need 
+    them (see extract.batch_mosaic()). Each output covers the bbox of its AOI and keeps 
+    the first valid value of the items (latest on top by default), like a mosaic.
+
+    Parameters
+    ----------
+    collections : str
+        A List of STAC collection and asset with the convention:collection1:asset,collection2:asset2
+    aois : str, pathlib.Path, list or geopandas.GeoDataFrame
+        Path to a vector file (geopackage, shapefile, geojson) with one feature per AOI, 
+        list of vector files (one AOI per file, the extent of all its features)
+        or GeoDataFrame.
+    name_field : str, optional
+        Field of the features used in the output file names. The default is None, 
+        which uses the file name (list of files) or the index of the feature.
+    resolution : int, optional
+        The output resolution. The default is None, the finest resolution of the items.
+    method : str, optional
+        Resampling alogrithms. Default is nearest
+    out_crs : str, optional
+        The projected CRS of the outputs. The default is None, the crs of the first item.
+    out_dir : str, optional
+        The output directory. The default is None, which gets reassigned to cwd/test-extract.
+    suffix : str, optional
+        Identificator added to output file name. The default is None.
+    datetime_filter : str, optional
+        Filter the items on datetime, see extract_cog(). The default is None.
+    resolution_filter : str, optional
+        Filter the items on resolution, see extract_cog(). The default is None.
+    overviews : bool, optional
+        Trigger the creation of overviews to the ouput cogs. The default is False.
+    orderby : str, optional
+        Order of the items, 'date' or 'resolution'. The default is 'date'.
+    desc : bool, optional
+        Descending order. The default is True.
+
+    Returns
+    -------
+    list
+        [{out_path:files used}, ...], one dictionnary per AOI and collection.
+
+    """
+    dex = dce.DatacubeExtract()
+    collections_asset = dex.collection_str_to_df(collections)
+    gdf = _read_aois(aois, name_field)
+    aoi_crs = gdf.crs.to_string()
+    print(f'Batch extraction of {len(gdf)} AOIs for collection(s) {list(collections_asset["collection"])}')
+
+    # One search for the extent of all the AOIs
+    union_bbox = ','.join(str(v) for v in gdf.total_bounds)
+    df = dce.asset_urls(collections_asset, aoi_crs, union_bbox, None,
+                        datetime_filter=datetime_filter, resolution_filter=resolution_filter)
+    if df is None or df.empty:
+        print(f'No urls for {collections} at {aoi_crs}:{union_bbox}')
+        return None
+    list_resolutions = df.item_resolution.unique().tolist()
+    if not resolution:
+        resolution = min(list_resolutions)
+    if not out_crs:
+        out_crs = f'EPSG:{df.item_epsg.iloc[0]}'
+    crs = rasterio.crs.CRS.from_string(out_crs)
+    if crs.is_geographic:
+        raise ValueError(f'Batch extraction is only available with a projected out_crs, got {out_crs}')
+
+    if not out_dir:
+        out_dir = pathlib.Path.cwd()/'test-extract'
+    out_dir = dex.check_outpath(out_dir)
+
+    out_files = []
+    for x in collections_asset.iloc:
+        collection = x['collection']
+        asset = x['asset']
+        print(f" {collection}, {asset} ".center(80, '#'))
+        if asset:
+            df_collection = df.query('collection_id == @collection and asset_key == @asset')
+        else:
+            df_collection = df.query('collection_id == @collection')
+        if df_collection.empty:
+            print(f'No urls for {collection}')
+            continue
+        in_meta = dce.read_profile(df_collection.url.iloc[0], ['nodata', 'dtype'])
+        aoi_profiles = {}
+        out_paths = {}
+        for name, geom in zip(gdf['aoi_name'], gdf.geometry):
+            bbox = ','.join(str(v) for v in geom.bounds)
+            (dst_transform,
+             dst_height,
+             dst_width) = dce.get_output_dimension(list_resolutions, bbox=bbox, bbox_crs=aoi_crs,
+                                                   out_crs=crs, out_res=resolution)
+            aoi_profiles[name] = dce.update_profile(in_profile=dce.default_profile(),
+                                                    new_crs=crs,
+                                                    new_height=dst_height,
+                                                    new_width=dst_width,
+                                                    new_transform=dst_transform,
+                                                    new_blocksize=512,
+                                                    new_nodata=in_meta['nodata'],
+                                                    new_dtype=in_meta['dtype'])
+            file_name = f"{collection}_{asset}_{name}_{crs.to_epsg()}_{resolution}m"
+            if suffix:
+                file_name = f'{file_name}-{suffix}'
+            out_paths[name] = pathlib.Path(out_dir)/f'{file_name}.tif'
+        out_files.extend(dce.batch_mosaic(df_collection, aoi_profiles, out_paths, 
+                                          orderby=orderby, desc=desc, method=method,
+                                          overviews=overviews))
+
+    if out_files:
+        print(''.rjust(75, '.'))
+        print(f'Extracts are available here {out_dir}{os.sep}')
+        return out_files
+    return None
+
+
+def _read_aois(aois, name_field:str=None)->gpd.GeoDataFrame:
+    """Return the AOIs as a GeoDataFrame with an 'aoi_name' column, in the crs of the first file"""
+    if isinstance(aois, gpd.GeoDataFrame):
+        gdf = aois.copy()
+    elif isinstance(aois, (list, tuple)):
+        frames = []
+        for path in aois:
+            if not os.path.exists(path):
+                print(f'Path not found in the system -> {path}')
+                continue
+            part = gpd.read_file(path)
+            if frames:
+                part = part.to_crs(frames[0].crs)
+            frames.append(gpd.GeoDataFrame({'aoi_name':[pathlib.Path(path).stem]},
+                                           geometry=[part.unary_union], crs=part.crs))
+        if not frames:
+            raise ValueError('None of the AOI files exist')
+        gdf = gpd.GeoDataFrame(pandas.concat(frames, ignore_index=True), crs=frames[0].crs)
+    else:
+        gdf = gpd.read_file(aois)
+    if 'aoi_name' not in gdf.columns:
+        if name_field:
+            gdf['aoi_name'] = gdf[name_field].astype(str)
+        else:
+            gdf['aoi_name'] = [str(i) for i in gdf.index]
+    return gdf
+
+
+def _mosaic_file_name(collection, asset, out_crs, resolution, suffix):
+    """Return the file name of the mosaic of collection and asset"""
+    #TODO : do something with suffix
+    if suffix:
+        return (f"{collection}_{asset}_mosaic_{out_crs.split(':')[1]}_{resolution}m-{suffix}.tif")
+    return (f"{collection}_{asset}_mosaic_{out_crs.split(':')[1]}_{resolution}m.tif")
+
+
+def _aggregate_outputs(out_path, resolution, coarser_resolutions, method, overviews, file_name)->list:
+    """
+    Create the coarser resolutions of out_path by block aggregation.
+    file_name(res) returns the path of the output at the resolution res.
+    """
+    coarse_paths = []
+    for res in coarser_resolutions:
+        coarse_path = dce.aggregate_resolution(out_path, file_name(res), 
+                                               factor=res//resolution, 
+                                               method=method, 
+                                               overviews=overviews)
+        coarse_paths.append(coarse_path)
+    return coarse_paths
+
+
+def _aggregate_cog_chip(out_file, item, resolution, coarser_resolutions, method, overviews, out_dir, suffix)->list:
+    """Create the coarser resolutions of a cog_chip() output"""
+    if not coarser_resolutions:
+        return []
+    with rasterio.open(out_file) as src:
+        epsg = src.crs.to_epsg()
+    return _aggregate_outputs(out_file, resolution, coarser_resolutions, method, overviews,
+                              lambda res: dce.cog_chip_file_name(item.url, out_dir, epsg, res,
+                                                                 item.item_resolution, suffix))
+
+
 # CLI
 def _handle_cli():
     """Processes CLI arguments and passes to appropriate function(s)"""
@@ -410,7 +686,8 @@ def _handle_cli():
     parser.add_argument('-resolution',
                         type=str,
                         default='None',
-                        help='The output resolution, if not specified then native resultion is used')
+                        help='The output resolution, if not specified then native resultion is used. '
+                        'A list (ex: "[1,4,16]") creates one output per resolution from a single extraction at the finest.')
     parser.add_argument('-method',
                         type=str,
                         default='nearest',
@@ -455,6 +732,30 @@ def _handle_cli():
                         type=str,
                         default='True',
                         help='The method to order the parameter to create the mosaic, default is True.')
+    parser.add_argument('-engine',
+                        type=str,
+                        default='warped',
+                        help='The mosaic engine (warped, window or gdal), default is warped.')
+    parser.add_argument('-resume',
+                        type=str,
+                        default='False',
+                        help='Continue an interrupted mosaic from its checkpoint, default is False.')
+    parser.add_argument('-update',
+                        type=str,
+                        default='False',
+                        help='Only update an existing mosaic with the new or changed items, default is False.')
+    parser.add_argument('-reducers',
+                        type=str,
+                        default=None,
+                        help='Comma separated reducers of the mosaic (first, min, max, mean, count, median), one band per reducer, default is None.')
+    parser.add_argument('-tile_store',
+                        type=str,
+                        default=None,
+                        help='Root directory of the standard grid tile store used to create the mosaic (out_crs EPSG:3979), default is None.')
+    parser.add_argument('-wcs_cache',
+                        type=str,
+                        default=None,
+                        help='Directory of the local cache of the WCS GetCoverage results (hrdem-wcs), default is None.')
     
 
     args=parser.parse_args()
@@ -464,7 +765,9 @@ def _handle_cli():
     bbox = args.bbox
     bbox_crs = args.bbox_crs
     resolution = eval(args.resolution)
-    if resolution :
+    if isinstance(resolution, (list, tuple)):
+        resolution=[int(res) for res in resolution]
+    elif resolution :
         resolution=int(resolution)
     else:
         resolution=None
@@ -479,6 +782,12 @@ def _handle_cli():
     mosaic = eval(args.mosaic) #For the plugin, we might need to do the trick like the overview flag for the 3 parameters
     orderby = args.orderby
     desc = eval(args.desc)
+    engine = args.engine
+    resume = eval(args.resume)
+    update = eval(args.update)
+    reducers = args.reducers
+    tile_store = args.tile_store
+    wcs_cache = args.wcs_cache
     print(f'Collections: {collections}')
     print(f'Bounding box: {bbox}')
     print(f'Bounding box crs: {bbox_crs}')
@@ -495,12 +804,20 @@ def _handle_cli():
     print(f'mosaic: {mosaic}')
     print(f'orderby: {orderby}')
     print(f'desc: {desc}')
+    print(f'engine: {engine}')
+    print(f'resume: {resume}')
+    print(f'update: {update}')
+    print(f'reducers: {reducers}')
+    print(f'tile_store: {tile_store}')
+    print(f'wcs_cache: {wcs_cache}')
     
     extract_cog(collections=collections,bbox=bbox,bbox_crs=bbox_crs,
                 resolution=resolution,method=method,out_crs=out_crs,
                 out_dir=out_dir,suffix=suffix,datetime_filter=datetime_filter,
                 resolution_filter=resolution_filter,overviews=overviews,
-                debug=debug,mosaic=mosaic,orderby=orderby,desc=desc)
+                debug=debug,mosaic=mosaic,orderby=orderby,desc=desc,
+                engine=engine,resume=resume,update=update,
+                reducers=reducers,tile_store=tile_store,wcs_cache=wcs_cache)
     return
 
 if __name__ == '__main__':
@@ -29,7 +29,7 @@ Copyright:
     as represented by the Minister of Natural Resources Canada, 2022
 
 """
-from typing import Dict, Optional, Union
+from typing import Dict, List, Optional, Union
 from pydantic import BaseModel, ValidationError, field_validator, model_validator, Field, ConfigDict
 from pydantic_core.core_schema import ValidationInfo
 import pandas
@@ -48,7 +48,7 @@ class ExtractCogSetting(BaseModel):
     field_id: Optional[str]=None
     geom_file: Optional[Union[str, pathlib.Path]]=None
     #greater or equel to 0 (insure the value is not negative)
-    resolution: Optional[int] = Field(ge=0, default=None) #not sure because it is required if mosaic is True
+    resolution: Optional[Union[int, List[int]]] = None #not sure because it is required if mosaic is True
     method: Optional[str] = 'bilinear'
     out_crs: Optional[str]= None #Not sure, because it is required if mosaic is True
     out_dir: Union[str, pathlib.Path]
@@ -60,6 +60,12 @@ class ExtractCogSetting(BaseModel):
     mosaic: Optional[bool]= False
     orderby: Optional[str]= None
     desc: Optional[bool]= True
+    engine: Optional[str]= 'warped'
+    resume: Optional[bool]= False
+    update: Optional[bool]= False
+    reducers: Optional[Union[str, List[str]]]= None
+    tile_store: Optional[Union[str, pathlib.Path]]= None
+    wcs_cache: Optional[Union[str, pathlib.Path]]= None
     
     #User cannot includ other values, ValidationError will occur
     model_config = ConfigDict(extra='forbid')
@@ -75,6 +81,50 @@ class ExtractCogSetting(BaseModel):
             else:
                 return method
     
+    @field_validator("resolution")
+    def resolution_is_valid(cls, resolution: Optional[Union[int, List[int]]]) -> Optional[Union[int, List[int]]]:
+        # print('resolution_is_valid')
+        if resolution is None:
+            return None
+        if isinstance(resolution, list):
+            if not resolution:
+                return None
+            resolutions = sorted(set(resolution))
+        else:
+            resolutions = [resolution]
+        if any(res < 0 for res in resolutions):
+            raise ValueError(f'InputParameterError : resolution must be greater or equal to 0, got {resolution}')
+        if len(resolutions) == 1:
+            return resolutions[0]
+        finest = resolutions[0]
+        if finest == 0 or any(res % finest for res in resolutions):
+            raise ValueError('InputParameterError : with a list of resolution, all the resolutions '
+                             f'must be multiples of the finest one, got {resolution}')
+        return resolutions
+    
+    @field_validator("engine")
+    def engine_is_valid(cls, engine: Optional[str]) -> str:
+        # print('engine_is_valid')
+        allowed_set = {"warped", "window", "gdal"}
+        if engine is None:
+            return 'warped'
+        if engine not in allowed_set:
+            raise ValueError(f'InputParameterError : engine must be in {allowed_set}, got "{engine}"')
+        return engine
+    
+    @field_validator("reducers")
+    def reducers_are_valid(cls, reducers: Optional[Union[str, List[str]]]) -> Optional[List[str]]:
+        # print('reducers_are_valid')
+        allowed_set = {"first", "min", "max", "mean", "count", "median"}
+        if not reducers:
+            return None
+        if isinstance(reducers, str):
+            reducers = [r.strip() for r in reducers.split(',') if r.strip()]
+        invalid = [r for r in reducers if r not in allowed_set]
+        if invalid:
+            raise ValueError(f'InputParameterError : reducers must be in {allowed_set}, got {invalid}')
+        return reducers
+    
     @field_validator("out_crs") #If out_crs is provided, validate that out_crs is not gepgraphic and return out_crs as rasterio.crs.CRS
     def outcrs_is_not_geographic(cls, crs: Optional[str]) -> Optional[str]:
         # print('outcrs_is_not_geographic')
@@ -242,6 +292,20 @@ class ExtractCogSetting(BaseModel):
         else:
             return values
     
+    @model_validator(mode='before') 
+    def tile_store_if_mosaic(cls, values: Dict) -> Dict:
+        # print('tile_store_if_mosaic')
+        #The tile store is on the datacube standard grid, first valid mosaic only
+        if values.get("tile_store"):
+            if values.get("mosaic") is not True:
+                raise ValueError('InputParameterError : "tile_store" is only used with the mosaic functionnality ("mosaic"=True).')
+            crs = values.get("out_crs")
+            if crs and rasterio.crs.CRS.from_string(crs) != rasterio.crs.CRS.from_epsg(3979):
+                raise ValueError(f'InputParameterError : "tile_store" requires the output crs "EPSG:3979", got {crs}.')
+            if values.get("reducers") or values.get("update"):
+                raise ValueError('InputParameterError : "tile_store" cannot be used with "reducers" or "update".')
+        return values
+    
     @model_validator(mode='before')
     def bbox_or_geom_file(cls, values: Dict) -> Dict:
         # print('bbox_or_geom_file')
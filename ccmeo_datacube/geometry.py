@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Stateless geometry and CRS helpers of the extraction tools
+
+The CRS parsing is memoized and the pyproj transformers are cached by
+(source crs, destination crs) and per thread (transformers are not thread safe),
+so the per item and per window calls do not pay the setup of the CRS objects.
+The DatacubeExtract geometry methods delegate to these functions.
+"""
+# Python standard library
+from functools import lru_cache
+import threading
+from typing import Union
+
+# Python custom modules
+import numpy
+from pyproj import Transformer
+import rasterio
+from rasterio import warp
+import shapely
+from shapely.geometry import box, mapping, shape
+
+_LOCAL = threading.local()
+
+
+def parse_crs(crs:Union[str, int, rasterio.crs.CRS])->rasterio.crs.CRS:
+    """
+    Return the rasterio.crs.CRS of crs, a str or an epsg code is parsed only once
+
+    Parameters
+    ----------
+    crs : str, int or rasterio.crs.CRS
+        Crs as string (ex. 'EPSG:3979' or wkt), epsg code or rasterio.crs.CRS (returned as is).
+
+    Returns
+    -------
+    rasterio.crs.CRS
+
+    """
+    if isinstance(crs, rasterio.crs.CRS):
+        return crs
+    if isinstance(crs, int):
+        return crs_from_epsg(crs)
+    return _crs_from_string(str(crs))
+
+
+@lru_cache(maxsize=None)
+def crs_from_epsg(epsg:int)->rasterio.crs.CRS:
+    """Return the rasterio.crs.CRS of an epsg code, parsed only once per code"""
+    return rasterio.crs.CRS.from_epsg(int(epsg))
+
+
+@lru_cache(maxsize=256)
+def _crs_from_string(crs:str)->rasterio.crs.CRS:
+    return rasterio.crs.CRS.from_string(crs)
+
+
+def _crs_key(crs)->str:
+    """Return a str usable by pyproj and as a cache key"""
+    if isinstance(crs, rasterio.crs.CRS):
+        return crs.to_wkt()
+    if isinstance(crs, int):
+        return f'EPSG:{crs}'
+    return str(crs)
+
+
+def get_transformer(src_crs, dst_crs)->Transformer:
+    """
+    Return the pyproj Transformer (always_xy) from src_crs to dst_crs,
+    created only once per pair of crs and per thread
+
+    Parameters
+    ----------
+    src_crs : str, int or rasterio.crs.CRS
+        Source crs.
+    dst_crs : str, int or rasterio.crs.CRS
+        Destination crs.
+
+    Returns
+    -------
+    pyproj.Transformer
+
+    """
+    key = (_crs_key(src_crs), _crs_key(dst_crs))
+    transformers = getattr(_LOCAL, 'transformers', None)
+    if transformers is None:
+        transformers = _LOCAL.transformers = {}
+    if key not in transformers:
+        transformers[key] = Transformer.from_crs(*key, always_xy=True)
+    return transformers[key]
+
+
+def bbox_to_tuple(str_bbox:str)->tuple:
+    """Convert bbox string 'minx,miny,maxx,maxy' to bounds tuple of floats"""
+    return tuple(float(v) for v in str_bbox.split(','))
+
+
+def tuple_to_bbox(bounds_tuple:tuple)->str:
+    """Convert bounds tuple to bbox string"""
+    return ','.join([str(x) for x in bounds_tuple])
+
+
+def bbox_to_poly(bbox:str)->shapely.geometry.polygon.Polygon:
+    """Convert bbox string to shapely polygon"""
+    return box(*bbox_to_tuple(bbox))
+
+
+def dict_to_poly(bbox_dict:dict)->shapely.geometry.polygon.Polygon:
+    """Convert GeoJson style dictionary to shapely polygon"""
+    return shape(bbox_dict)
+
+
+def poly_to_dict(bbox_poly:shapely.geometry.polygon.Polygon)->dict:
+    """Convert shapely polygon to GeoJson style dict"""
+    return mapping(bbox_poly)
+
+
+def transform_dict(geom_dict:dict, in_crs, out_crs)->dict:
+    """Reproject geojson dict to geojson dict"""
+    return warp.transform_geom(in_crs, out_crs, geom_dict)
+
+
+def transform_dict_to_poly(geom_dict:dict, in_crs, out_crs)->shapely.geometry.polygon.Polygon:
+    """Reproject geojson dict to shapely polygon"""
+    return dict_to_poly(transform_dict(geom_dict, in_crs, out_crs))
+
+
+def transform_bboxes(bounds, in_crs, out_crs, densify_pts:int=0)->numpy.ndarray:
+    """
+    Reproject many bounds at once, with a single call to the cached transformer
+
+    Parameters
+    ----------
+    bounds : array like
+        (n, 4) bounds (minx, miny, maxx, maxy) in in_crs.
+    in_crs : str, int or rasterio.crs.CRS
+        Crs of the bounds.
+    out_crs : str, int or rasterio.crs.CRS
+        Output crs.
+    densify_pts : int, optional
+        Number of points added on each edge of the bounds before the reprojection.
+        The default is 0, only the corners are reprojected
+        (same as the bounds of the reprojected bbox polygon).
+
+    Returns
+    -------
+    numpy.ndarray
+        (n, 4) bounds in out_crs.
+
+    """
+    bounds = numpy.asarray(bounds, dtype='float64').reshape(-1, 4)
+    if _crs_key(in_crs) == _crs_key(out_crs):
+        return bounds.copy()
+    minx, miny, maxx, maxy = (bounds[:, i:i+1] for i in range(4))
+    # Points along the 4 edges of each bbox (corners included), (n, 4*(densify_pts+1))
+    steps = numpy.linspace(0., 1., densify_pts + 2)[:-1][None, :]
+    ones = numpy.ones_like(steps)
+    xs = numpy.concatenate([minx + (maxx - minx)*steps, maxx*ones,
+                            maxx - (maxx - minx)*steps, minx*ones], axis=1)
+    ys = numpy.concatenate([miny*ones, miny + (maxy - miny)*steps,
+                            maxy*ones, maxy - (maxy - miny)*steps], axis=1)
+    out_x, out_y = get_transformer(in_crs, out_crs).transform(xs.ravel(), ys.ravel())
+    out_x = numpy.asarray(out_x).reshape(xs.shape)
+    out_y = numpy.asarray(out_y).reshape(ys.shape)
+    out_x[~numpy.isfinite(out_x)] = numpy.nan
+    out_y[~numpy.isfinite(out_y)] = numpy.nan
+    return numpy.stack([numpy.nanmin(out_x, axis=1), numpy.nanmin(out_y, axis=1),
+                        numpy.nanmax(out_x, axis=1), numpy.nanmax(out_y, axis=1)], axis=1)
+
+
+def transform_bbox(bbox:Union[str, tuple], in_crs, out_crs, densify_pts:int=0)->tuple:
+    """
+    Reproject a bbox (string 'minx,miny,maxx,maxy' or bounds tuple),
+    see transform_bboxes()
+
+    Returns
+    -------
+    tuple
+        (minx, miny, maxx, maxy) in out_crs.
+
+    """
+    if isinstance(bbox, str):
+        bbox = bbox_to_tuple(bbox)
+    return tuple(transform_bboxes([bbox], in_crs, out_crs, densify_pts)[0].tolist())
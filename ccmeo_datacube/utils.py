@@ -153,4 +153,17 @@ def _valid_rfc3339(dt):
             udt = datetime.fromisoformat(dt.replace('Z','')).isoformat() + 'Z'
         return udt
     except:
-        return None
\ No newline at end of file
+        return None
+
+def import_pyarrow():
+    """
+    Returns the pyarrow modules (pyarrow, pyarrow.dataset) used for the GeoParquet files.
+    pyarrow is an optional dependency (pip install ccmeo_datacube[parquet]), imported on use.
+    """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError as e:
+        raise ImportError('pyarrow is required for the GeoParquet files, '
+                          'install it with "pip install pyarrow"') from e
+    return pyarrow,pyarrow.dataset
@@ -15,6 +15,7 @@ import json
 import os
 import pathlib
 import shutil
+import sqlite3
 import sys
 
 from unittest.mock import Mock,MagicMock,patch
@@ -23,6 +24,7 @@ from unittest.mock import Mock,MagicMock,patch
 import geopandas
 import pandas
 import pytest
+import shapely
 from shapely.geometry import Polygon
 
 SUB_DIRS = 2
@@ -189,12 +191,179 @@ class TestCollections():
             gdf_c,df_a,gdf_ca = d.collections_to_gdf('url')
             assert len(gdf_c) == 17
 
+    def test_collections_to_gdf_order(self,collections_200):
+        """The concurrent item requests keep the order of the collections"""
+        ids = [c['id'] for c in collections_200['collections']]
+        def _get(req_url,params=None):
+            response = MagicMock()
+            response.status_code = 200
+            if req_url.endswith('/items'):
+                cid = req_url.split('/')[-2]
+                response.json.return_value = {'features':[{'id':f'{cid}-item','geometry':{'type':'Point','coordinates':[0,0]},
+                                                           'bbox':[0,0,1,1],'properties':{'datetime':None},
+                                                           'collection':cid,'assets':{'data':{'href':'x'}}}]}
+            else:
+                response.json.return_value = {'collections':collections_200['collections'],'links':[]}
+            return response
+        with patch('ccmeo_datacube.describe.requests') as mock_requests:
+            mock_requests.get.side_effect = _get
+            gdf_c,df_a,gdf_ca = d.collections_to_gdf('url',max_workers=4)
+            assert list(gdf_c.collection_id) == ids
+            assert list(df_a.collection_id) == ids
+            item_calls = [c for c in mock_requests.get.call_args_list if c.args[0].endswith('/items')]
+            assert len(item_calls) == len(ids)
+            assert all(c.kwargs['params'] == {'limit':1} for c in item_calls)
         
     def test_collections(self,test_gpkg,mock_collection_to_gpkg):
         d.collections(test_gpkg)
         assert mock_collection_to_gpkg.called
         assert test_gpkg.is_file()
 
+class TestCreateDb():
+    """The geopackage is written in a single transaction, dce_collection_asset is a view"""
+
+    def test_create_db(self,test_gpkg,search_200_no_next,collection_200):
+        items,assets = d._parse_items_assets(search_200_no_next,'url')
+        item_header,asset_header = d._ia_headers()
+        gdf_i = geopandas.GeoDataFrame(items,columns=item_header,geometry='geometry',crs='EPSG:4326')
+        df_a = pandas.DataFrame(assets,columns=asset_header).drop_duplicates()
+        records = []
+        for cid in df_a.collection_id.unique():
+            record = d._parse_collection(collection_200,'url')
+            record[0] = cid
+            records.append(record)
+        gdf_c = geopandas.GeoDataFrame(records,columns=d._c_headers(),geometry='geometry',crs='EPSG:4326')
+        gdf_ca = gdf_c.merge(df_a,on='collection_id')
+        test_gpkg.parent.mkdir(parents=True,exist_ok=True)
+        
+        d._create_db(test_gpkg,gdf_c,df_a,gdf_ca,gdf_i)
+        
+        ca = geopandas.read_file(test_gpkg,layer='dce_collection_asset')
+        assert sorted(ca.columns) == sorted(gdf_ca.columns)
+        assert len(ca) == len(gdf_ca)
+        assert len(geopandas.read_file(test_gpkg,layer='dce_item')) == len(gdf_i)
+        conn = sqlite3.connect(test_gpkg)
+        assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'dce_collection_asset'").fetchone()[0] == 'view'
+        assert conn.execute('SELECT count(*) FROM rtree_dce_item_geom').fetchone()[0] == len(gdf_i)
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+        conn.close()
+
+class TestParquet():
+    """GeoParquet outputs of the items and assets"""
+
+    def _frames(self,search):
+        items,assets = d._parse_items_assets(search,'url')
+        item_header,asset_header = d._ia_headers()
+        gdf_i = geopandas.GeoDataFrame(items,columns=item_header,geometry='geometry',crs='EPSG:4326')
+        df_a = pandas.DataFrame(assets,columns=asset_header).drop_duplicates()
+        return gdf_i,df_a
+
+    def test_geoparquet_metadata(self,search_200_no_next):
+        gdf_i,_ = self._frames(search_200_no_next)
+        meta = d._geoparquet_metadata(gdf_i)
+        column = meta['columns']['geometry']
+        assert meta['primary_column'] == 'geometry'
+        assert column['covering']['bbox']['xmin'] == ['bbox','xmin']
+        assert column['bbox'] == gdf_i.total_bounds.tolist()
+        assert column['crs']['id']['code'] == 4326
+
+    def test_parquet_round_trip(self,tmp_path,search_200_no_next):
+        pytest.importorskip('pyarrow')
+        import ccmeo_datacube.extract as dce
+        gdf_i,df_a = self._frames(search_200_no_next)
+        d._write_to_parquet(tmp_path/'dce_parquet',df_a,gdf_i)
+        
+        items = dce.read_describe_parquet(tmp_path/'dce_parquet'/'dce_item',collections=['msi'])
+        assert len(items) == (gdf_i.collection_id == 'msi').sum()
+        minx,miny,maxx,maxy = gdf_i.total_bounds
+        bbox = f'{minx},{miny},{(minx + maxx)/2},{maxy}'
+        items = dce.read_describe_parquet(tmp_path/'dce_parquet'/'dce_item',bbox=bbox)
+        assert len(items) == gdf_i.intersects(shapely.geometry.box(minx,miny,(minx + maxx)/2,maxy)).sum()
+        assets = dce.read_describe_parquet(tmp_path/'dce_parquet'/'dce_asset')
+        assert len(assets) == len(df_a)
+
+class TestIncremental():
+    """Incremental describe, only the changed collections are scraped and upserted"""
+
+    def _get(self,colls):
+        """Mock of requests.get routing the collections and items urls"""
+        def _route(req_url,params=None,headers=None):
+            response = MagicMock()
+            response.status_code = 200
+            if req_url.endswith('/items'):
+                cid = req_url.split('/')[-2]
+                response.json.return_value = {'features':[{'id':f'{cid}-item','geometry':{'type':'Point','coordinates':[0,0]},
+                                                           'bbox':[0,0,1,1],'properties':{'datetime':None},
+                                                           'collection':cid,'assets':{'data':{'href':'x','title':cid}}}]}
+            else:
+                response.json.return_value = {'collections':colls,'links':[]}
+            return response
+        return _route
+
+    def _item_calls(self,mock_requests):
+        return [c.args[0] for c in mock_requests.get.call_args_list if c.args[0].endswith('/items')]
+
+    def test_collections_incremental(self,test_gpkg,collections_200):
+        colls = collections_200['collections']
+        for coll in colls:
+            coll['updated'] = '2023-01-01T00:00:00Z'
+        ids = [coll['id'] for coll in colls]
+        with patch('ccmeo_datacube.describe.requests') as mock_requests:
+            mock_requests.get.side_effect = self._get(colls)
+            d.collections(test_gpkg,urls=['url'],incremental=True)
+            assert len(self._item_calls(mock_requests)) == len(ids)
+            
+            # Nothing changed
+            mock_requests.get.reset_mock()
+            d.collections(test_gpkg,urls=['url'],incremental=True)
+            assert self._item_calls(mock_requests) == []
+            
+            # One collection updated and one removed
+            colls[0]['updated'] = '2024-01-01T00:00:00Z'
+            colls[0]['title'] = 'new title'
+            removed = colls.pop()
+            mock_requests.get.reset_mock()
+            d.collections(test_gpkg,urls=['url'],incremental=True)
+            assert self._item_calls(mock_requests) == [f'url/collections/{ids[0]}/items']
+        
+        gdf_c = geopandas.read_file(test_gpkg,layer='dce_collection')
+        assert sorted(gdf_c.collection_id) == sorted(ids[:-1])
+        assert gdf_c.loc[gdf_c.collection_id == ids[0],'title'].tolist() == ['new title']
+        assert gdf_c.geometry.notna().all()
+        assert removed['id'] not in set(geopandas.read_file(test_gpkg,layer='dce_collection_asset').collection_id)
+        # The spatial index is updated by the triggers
+        conn = sqlite3.connect(test_gpkg)
+        assert conn.execute('SELECT count(*) FROM rtree_dce_collection_geom').fetchone()[0] == len(ids) - 1
+        conn.close()
+
+    def test_incremental_cols(self,test_gpkg,collections_200):
+        """The collections filtered out by cols are not removed"""
+        colls = collections_200['collections']
+        for coll in colls:
+            coll['updated'] = '2023-01-01T00:00:00Z'
+        ids = [coll['id'] for coll in colls]
+        with patch('ccmeo_datacube.describe.requests') as mock_requests:
+            mock_requests.get.side_effect = self._get(colls)
+            d._update_describe(test_gpkg,'url')
+
+            colls[0]['updated'] = '2024-01-01T00:00:00Z'
+            mock_requests.get.reset_mock()
+            assert d._update_describe(test_gpkg,'url',cols=ids[0]) == [ids[0]]
+            assert self._item_calls(mock_requests) == [f'url/collections/{ids[0]}/items']
+
+            # Nothing changed for the other collections
+            mock_requests.get.reset_mock()
+            assert d._update_describe(test_gpkg,'url',cols=','.join(ids[1:])) == []
+
+        assert sorted(geopandas.read_file(test_gpkg,layer='dce_collection').collection_id) == sorted(ids)
+        assert sorted(d._read_describe_state(test_gpkg,'url')) == sorted(ids)
+
+    def test_gpkg_blob(self):
+        poly = Polygon([[0, 0], [2, 0], [2, 1], [0, 1], [0, 0]])
+        blob = d._gpkg_blob(poly)
+        assert d._gpkg_envelope(blob) == (0.0, 2.0, 0.0, 1.0)
+        assert d._gpkg_envelope(d._gpkg_blob(Polygon())) is None
+
 class TestSearch():
     """All of the Search and associated functions tests
     
@@ -243,6 +412,31 @@ class TestSearch():
         # TODO need to verify if mock is called
         assert mock_search_requests_get.called
 
+    def test_search_stream(self,test_gpkg,mock_response_search_with_next,mock_response_collection):
+        """The search is posted once, the next page requested once, the items appended by batches"""
+        bbox = '-75,45,-74,46'
+        last_page = MagicMock()
+        last_page.status_code = 200
+        with (data_dir()/'stac_search_result_no_next.json').open() as jfp:
+            last_page.json.return_value = json.load(jfp)
+        with patch('ccmeo_datacube.describe.requests.post') as mock_requests_post, \
+             patch('ccmeo_datacube.describe.requests.get') as mock_requests_get, \
+             patch('ccmeo_datacube.describe._STREAM_BATCH',25):
+            mock_requests_get.side_effect = [last_page] + [mock_response_collection]*3
+            mock_requests_post.return_value = mock_response_search_with_next
+            d.search(test_gpkg,urls=['url'],bbox=bbox,collections='msi,flood-susceptibility',stream=True)
+            assert mock_requests_post.call_count == 1
+            assert mock_requests_post.call_args.kwargs['json'] == {'bbox':[-75.0,45.0,-74.0,46.0],
+                                                                    'collections':['msi','flood-susceptibility']}
+            # 1 next page and 3 collections
+            assert mock_requests_get.call_count == 4
+        assert len(geopandas.read_file(test_gpkg,layer='dce_item')) == 60
+        assert len(geopandas.read_file(test_gpkg,layer='dce_asset')) == 13
+        assert len(geopandas.read_file(test_gpkg,layer='dce_collection')) == 3
+        conn = sqlite3.connect(test_gpkg)
+        assert conn.execute('SELECT count(*) FROM rtree_dce_item_geom').fetchone()[0] == 60
+        conn.close()
+
 class Debug():
     """Carry over tests and debugs, needs to be cleaned or deleted"""
     def debug_test_geojson_collection_asset(self,test_gpkg,mock_collection_to_gpkg):
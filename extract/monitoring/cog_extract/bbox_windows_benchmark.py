@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of extract.bbox_windows() (numpy on the cached block grid) versus
+the previous implementation (python loop calling img.block_window() and
+clip_window() per block).
+
+The image is a national scale cog (ex: cdem) or, by default, a sparse synthetic
+GeoTIFF of the same size (nothing is written in the blocks, only the header
+is read by both implementations).
+
+Usage :
+    python bbox_windows_benchmark.py -out_dir <path>
+    python bbox_windows_benchmark.py -out_dir <path> -img <url_of_a_cog> -bbox "<minx,miny,maxx,maxy>" -bbox_crs EPSG:3979
+
+Results are written in <out_dir>/bbox_windows_benchmark.csv
+"""
+# Python standard library
+import argparse
+import math
+import pathlib
+import sys
+import time
+
+# Python custom modules
+import pandas
+import rasterio
+from rasterio.transform import from_origin
+
+_CHILD_LEVEL = 3
+_DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
+if _DIR_NEEDED not in sys.path:
+    sys.path.insert(0,_DIR_NEEDED)
+
+import ccmeo_datacube.extract as dce
+
+CRS = 'EPSG:3979'
+
+def create_sparse_image(out_dir:pathlib.Path, size:int=500000, block:int=512)->str:
+    """Creates a sparse tiled GeoTIFF of size x size pixels (about (size/block)**2 blocks)"""
+    file = out_dir / f'sparse_{size}.tif'
+    if not file.exists():
+        with rasterio.open(file, 'w', driver='GTiff', height=size, width=size, count=1,
+                           dtype='int16', crs=CRS, nodata=-32767, tiled=True,
+                           blockxsize=block, blockysize=block, compress='lzw',
+                           sparse_ok=True, bigtiff='YES',
+                           transform=from_origin(-2600000, 3900000, 20, 20)):
+            pass
+    return str(file)
+
+
+def bbox_windows_loop(img_path, bbox, bbox_crs, band=1, clip=True):
+    """bbox_windows() before the vectorization, kept as the reference"""
+    with rasterio.open(img_path) as img:
+        w_tap = dce.tap_window(img.transform,bbox,bbox_crs, img.crs)
+        pix_per_block = img.block_shapes[0][0]
+        block_col_index_start = math.floor(w_tap.col_off/pix_per_block)
+        block_row_index_start = math.floor(w_tap.row_off/pix_per_block)
+        col_index_start = block_col_index_start*pix_per_block
+        row_index_start = block_row_index_start*pix_per_block
+        corrected_width = w_tap.width+w_tap.col_off - col_index_start
+        corrected_height = w_tap.height+w_tap.row_off - row_index_start
+        num_block_cols = math.ceil(corrected_width/pix_per_block)
+        num_block_rows = math.ceil(corrected_height/pix_per_block)
+        extract_windows = []
+        for bl_idx_row in range(block_row_index_start,block_row_index_start+num_block_rows):
+            for bl_idx_col in range(block_col_index_start,block_col_index_start+num_block_cols):
+                extract_window = img.block_window(band,bl_idx_row,bl_idx_col)
+                if clip:
+                    current_window = dce.clip_window(win=extract_window,clip_to=w_tap)
+                    if current_window:
+                        extract_windows.append(current_window)
+                else:
+                    extract_windows.append(extract_window)
+    return extract_windows
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark(out_dir:str, img:str=None, bbox:str=None, bbox_crs:str=CRS, 
+              size:int=500000, bands:int=3):
+    """Runs both implementations for each band and writes bbox_windows_benchmark.csv in out_dir"""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not img:
+        img = create_sparse_image(out_dir, size)
+    if not bbox:
+        with rasterio.open(img) as src:
+            #Whole image, minus one pixel on each side
+            left, bottom, right, top = src.bounds
+            res = src.res[0]
+            bbox = f'{left+res},{bottom+res},{right-res},{top-res}'
+            bbox_crs = src.crs.to_string()
+            bands = min(bands, src.count)
+
+    dce.image_block_grid.cache_clear()
+    rows = []
+    for band in range(1, bands+1):
+        loop, loop_time = _timed(bbox_windows_loop, img, bbox, bbox_crs, band)
+        vect, vect_time = _timed(dce.bbox_windows, img, bbox, bbox_crs, band)
+        arrays, arrays_time = _timed(dce.bbox_block_arrays, img, bbox, bbox_crs, band)
+        rows.append({'band':band, 'blocks':len(loop),
+                     'loop_s':round(loop_time, 3),
+                     'bbox_windows_s':round(vect_time, 3),
+                     'bbox_block_arrays_s':round(arrays_time, 3),
+                     'speedup_arrays':round(loop_time/max(arrays_time, 1e-9), 1),
+                     'same_windows':loop == vect})
+    df = pandas.DataFrame(rows)
+    df.to_csv(out_dir / 'bbox_windows_benchmark.csv', index=False)
+    print(df.to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of bbox_windows')
+    parser.add_argument('-out_dir', type=str, required=True)
+    parser.add_argument('-img', type=str, default=None)
+    parser.add_argument('-bbox', type=str, default=None)
+    parser.add_argument('-bbox_crs', type=str, default=CRS)
+    parser.add_argument('-size', type=int, default=500000)
+    parser.add_argument('-bands', type=int, default=3)
+    args = parser.parse_args()
+    benchmark(args.out_dir, args.img, args.bbox, args.bbox_crs, args.size, args.bands)
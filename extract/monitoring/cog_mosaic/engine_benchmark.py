@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the mosaic engines of extract.py (extract.MOSAIC_ENGINES)
+
+Every engine is run in its own process on identical inputs (synthetic
+overlapping tiles in UTM 18N, mosaic in EPSG:3979) and compared on :
+    - run time (seconds)
+    - peak memory of the process (MB, includes GDAL cache and buffers)
+    - output equality with the reference engine (warped)
+
+Usage :
+    python engine_benchmark.py -out_dir <path> -tiles 4 -tile_size 2000 -resolution 2
+
+Results are written in <out_dir>/engine_benchmark.csv
+"""
+# Python standard library
+import argparse
+import multiprocessing
+import pathlib
+import resource
+import sys
+import time
+
+# Python custom modules
+import numpy
+import pandas
+import rasterio
+from rasterio.transform import from_origin
+
+_CHILD_LEVEL = 3
+_DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
+if _DIR_NEEDED not in sys.path:
+    sys.path.insert(0,_DIR_NEEDED)
+
+import ccmeo_datacube.extract as dce
+
+SRC_CRS = 'EPSG:2960' #UTM 18N
+OUT_CRS = 'EPSG:3979'
+NODATA = -32767.0
+
+def create_sources(out_dir:pathlib.Path, tiles:int, tile_size:int, src_res:int)->list:
+    """Creates a row of overlapping (25%) synthetic dem tiles, with a nodata collar"""
+    files = []
+    step = int(tile_size*0.75)*src_res
+    rng = numpy.random.default_rng(0)
+    for t in range(tiles):
+        file = out_dir / f'source_{t}.tif'
+        x_ori = 300000 + t*step
+        y_ori = 5000000
+        arr = rng.normal(100+t*10, 5, (tile_size, tile_size)).astype('float32')
+        arr[:, :tile_size//20] = NODATA
+        with rasterio.open(file, 'w', driver='GTiff', height=tile_size, width=tile_size,
+                           count=1, dtype='float32', crs=SRC_CRS, nodata=NODATA,
+                           tiled=True, blockxsize=512, blockysize=512, compress='lzw',
+                           transform=from_origin(x_ori, y_ori, src_res, src_res)) as dst:
+            dst.write(arr, 1)
+        files.append(str(file))
+    return files
+
+
+def mosaic_inputs(files:list, src_res:int, out_res:int, method:str):
+    """Returns the list of params and the output profile shared by all the engines"""
+    bounds = [rasterio.open(f).bounds for f in files]
+    bbox = (f'{min(b.left for b in bounds)},{min(b.bottom for b in bounds)},'
+            f'{max(b.right for b in bounds)},{max(b.top for b in bounds)}')
+    out_crs = rasterio.crs.CRS.from_string(OUT_CRS)
+    (dst_transform,
+     dst_height,
+     dst_width) = dce.get_output_dimension([src_res], bbox=bbox, bbox_crs=SRC_CRS,
+                                           out_crs=out_crs, out_res=out_res)
+    out_profile = dce.update_profile(in_profile=dce.default_profile(),
+                                     new_crs=out_crs,
+                                     new_height=dst_height,
+                                     new_width=dst_width,
+                                     new_transform=dst_transform,
+                                     new_blocksize=512,
+                                     new_nodata=NODATA,
+                                     new_dtype='float32')
+    list_params = [{'file':f,
+                    'params':dce.get_extract_params(out_profile, src_res, SRC_CRS, out_res, method)}
+                   for f in files]
+    return list_params, out_profile
+
+
+def _run_engine(engine, list_params, out_path, out_profile, queue):
+    """Runs one engine inside a child process and return time and peak memory"""
+    start = time.perf_counter()
+    used, unused = dce.mosaic_engine(engine)(list_params, out_path, out_profile.copy())
+    run_time = time.perf_counter() - start
+    #ru_maxrss is in KB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    queue.put((run_time, peak, len(used), len(unused)))
+
+
+def compare(reference:str, other:str):
+    """Returns the % of equal pixels and the max absolute difference of valid pixels"""
+    with rasterio.open(reference) as ref, rasterio.open(other) as oth:
+        equal = 0
+        max_diff = 0.
+        for _, window in ref.block_windows(1):
+            a = ref.read(1, window=window, masked=True)
+            b = oth.read(1, window=window, masked=True)
+            same_mask = (a.mask == b.mask)
+            both = ~a.mask & ~b.mask
+            equal += numpy.count_nonzero(same_mask & (a.mask | (a.data == b.data)))
+            if both.any():
+                max_diff = max(max_diff, float(numpy.abs(a.data[both]-b.data[both]).max()))
+        total = ref.width*ref.height
+    return round(equal/total*100, 4), max_diff
+
+
+def benchmark(out_dir:str, tiles:int=4, tile_size:int=2000, src_res:int=2,
+              out_res:int=2, method:str='nearest', engines:list=None):
+    """Runs every engine on the same inputs and write engine_benchmark.csv in out_dir"""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not engines:
+        engines = list(dce.MOSAIC_ENGINES)
+    files = create_sources(out_dir, tiles, tile_size, src_res)
+    list_params, out_profile = mosaic_inputs(files, src_res, out_res, method)
+
+    ctx = multiprocessing.get_context('spawn')
+    rows = []
+    outputs = {}
+    for engine in engines:
+        out_path = out_dir / f'mosaic_{engine}.tif'
+        if out_path.exists():
+            out_path.unlink()
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_engine,
+                           args=(engine, list_params, out_path, out_profile, queue))
+        proc.start()
+        run_time, peak, used, unused = queue.get()
+        proc.join()
+        outputs[engine] = out_path
+        rows.append({'engine':engine, 'run_time_s':round(run_time, 3),
+                     'peak_memory_mb':round(peak, 1), 'used_files':used,
+                     'unused_files':unused,
+                     'num_pixel':out_profile['width']*out_profile['height']})
+
+    reference = outputs[engines[0]]
+    for row in rows:
+        row['equal_pixels_pct'], row['max_abs_diff'] = compare(reference, outputs[row['engine']])
+
+    df = pandas.DataFrame(rows)
+    df.to_csv(out_dir / 'engine_benchmark.csv', index=False)
+    print(df.to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the mosaic engines')
+    parser.add_argument('-out_dir', type=str, required=True)
+    parser.add_argument('-tiles', type=int, default=4)
+    parser.add_argument('-tile_size', type=int, default=2000)
+    parser.add_argument('-src_res', type=int, default=2)
+    parser.add_argument('-resolution', type=int, default=2)
+    parser.add_argument('-method', type=str, default='nearest')
+    args = parser.parse_args()
+    benchmark(args.out_dir, args.tiles, args.tile_size, args.src_res,
+              args.resolution, args.method)
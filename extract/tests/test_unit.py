@@ -12,6 +12,7 @@ Best pratices :
 """
 # Python standard library
 import json
+import math
 import os
 # import re
 import sys
@@ -39,6 +40,7 @@ DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
 if DIR_NEEDED not in sys.path:
     sys.path.append(DIR_NEEDED)
 import ccmeo_datacube.extract as dce
+import ccmeo_datacube.geometry as dcg
 
 
 # setup
@@ -108,6 +110,48 @@ def create_temp_tif(temp_file_name:str):
     return kwargs
 
 
+def create_mosaic_sources(tmp_path, dtype='float32', nodata=-32767.0):
+    """
+    Creating two overlapping tif in EPSG:3979 (2m) and the output profile of their mosaic
+
+    Source a : x 0 to 80, value 1, the 10 first columns are nodata
+    Source b : x 40 to 120, value 2
+    Mosaic : x 0 to 120, y 20 to 100, 60x40 pixels
+
+    Returns
+    -------
+    list_params : list
+        List of dictionnary {'file':path, 'params':extract params}, a is on top.
+    out_profile : dict
+        Profile of the mosaic.
+
+    """
+    crs = rasterio.crs.CRS.from_epsg(3979)
+    files = []
+    for name, x_ori, value in (('a', 0, 1), ('b', 40, 2)):
+        arr = np.full((40, 40), value, dtype)
+        if name == 'a':
+            arr[:, :10] = nodata
+        file = str(tmp_path / f'{name}.tif')
+        with rasterio.open(file, 'w', driver='GTiff', height=40, width=40, count=1,
+                           dtype=dtype, crs=crs, nodata=nodata,
+                           transform=rasterio.transform.from_origin(x_ori, 100, 2, 2)) as dst:
+            dst.write(arr, 1)
+        files.append(file)
+    out_profile = dce.update_profile(in_profile=dce.default_profile(),
+                                     new_crs=crs,
+                                     new_height=40,
+                                     new_width=60,
+                                     new_transform=rasterio.transform.from_origin(0, 100, 2, 2),
+                                     new_blocksize=512,
+                                     new_nodata=nodata,
+                                     new_dtype=dtype)
+    list_params = [{'file': file,
+                    'params': dce.get_extract_params(out_profile, 2, 'EPSG:3979', 2, 'nearest')}
+                   for file in files]
+    return list_params, out_profile
+
+
 @pytest.fixture
 def value_list():
     res = [('img_2020_2m','2020:04:29 12:00:00', 2.0,'c1a1','c1'),
@@ -922,4 +966,677 @@ class TestAssetURLs():
         assert len(df) == 33
         assert len(df.asset_key.unique()) == 1
         assert df.asset_key.unique()[0] == 'dtm'
-        
\ No newline at end of file
+        
+
+class TestMosaicEngine():
+
+    def test_mosaic_engine_valid(self):
+        for engine, func in dce.MOSAIC_ENGINES.items():
+            assert dce.mosaic_engine(engine) is func
+
+    def test_mosaic_engine_invalid(self):
+        with pytest.raises(ValueError):
+            dce.mosaic_engine('toto')
+
+    @pytest.mark.parametrize('engine', ['warped', 'window', 'gdal'])
+    def test_mosaic_engine_result(self, tmp_path, engine):
+        """Every engine gives the same mosaic, first file on top"""
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        out_path = tmp_path / f'mosaic_{engine}.tif'
+        print('Execution')
+        used, unused = dce.mosaic_engine(engine)(list_params, out_path, out_profile)
+        print('Validation')
+        assert used == [p['file'] for p in list_params]
+        assert not unused
+        assert not os.path.exists(f'{out_path}.temp')
+        with rasterio.open(out_path) as src:
+            arr = src.read(1)
+        assert (arr[:, :10] == -32767).all()
+        assert (arr[:, 10:40] == 1).all()
+        assert (arr[:, 40:] == 2).all()
+
+
+class TestMosaicCheckpoint():
+
+    def test_checkpoint_round_trip(self, tmp_path):
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        temp_file = tmp_path / 'mosaic.tif.temp'
+        temp_file.touch()
+        signature = dce.mosaic_signature(out_profile, files)
+        state = dce.new_mosaic_state(signature, out_profile)
+        state['next_source'] = 1
+        state['coverage'][0, 0] = True
+        print('Execution')
+        dce.save_mosaic_checkpoint(temp_file, state)
+        result = dce.load_mosaic_checkpoint(temp_file, signature)
+        other = dce.load_mosaic_checkpoint(temp_file, dce.mosaic_signature(out_profile, files[::-1]))
+        print('Validation')
+        assert result['next_source'] == 1
+        assert (result['coverage'] == state['coverage']).all()
+        assert other is None
+
+    @pytest.mark.parametrize('engine,first,second', [('warped', 'a', 'b'),
+                                                     ('window', 'a', 'b'),
+                                                     ('gdal', 'b', 'a')])
+    def test_mosaic_resume(self, tmp_path, engine, first, second):
+        """The mosaic is interrupted on the second source, then resumed 
+        without the first source which must not be read again"""
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        out_path = tmp_path / f'mosaic_{engine}.tif'
+        second_file = tmp_path / f'{second}.tif'
+        os.rename(second_file, tmp_path / 'hidden.tif')
+        with pytest.raises(rasterio.errors.RasterioIOError):
+            dce.mosaic_engine(engine)(list_params, out_path, out_profile.copy())
+        assert os.path.exists(dce.mosaic_checkpoint_path(f'{out_path}.temp'))
+        os.rename(tmp_path / 'hidden.tif', second_file)
+        os.remove(tmp_path / f'{first}.tif')
+        print('Execution')
+        used, unused = dce.mosaic_engine(engine)(list_params, out_path, out_profile.copy(), resume=True)
+        print('Validation')
+        assert used == [p['file'] for p in list_params]
+        assert not os.path.exists(dce.mosaic_checkpoint_path(f'{out_path}.temp'))
+        with rasterio.open(out_path) as src:
+            arr = src.read(1)
+        assert (arr[:, 10:40] == 1).all()
+        assert (arr[:, 40:] == 2).all()
+
+
+class TestUpdateMosaic():
+
+    def _mosaic(self, df, out_dir, out_file, bbox='0,20,120,100', overviews=False, method='nearest'):
+        return dce.mosaic(df=df, orderby='date', resolution=2, desc=True, list_resolutions=[2],
+                          bbox=bbox, bbox_crs='EPSG:3979', method=method,
+                          out_crs='EPSG:3979', out_dir=out_dir, out_file=out_file, overviews=overviews)
+
+    def _df(self, files, datetimes):
+        return pandas.DataFrame({'url':files, 'collection_id':'c1', 'item_datetime':datetimes,
+                                 'item_resolution':2, 'item_epsg':3979, 'asset_key':'dsm'})
+
+    def test_update_mosaic_new_item(self, tmp_path):
+        """Updated mosaic is the same as a new mosaic with all the items"""
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        df = self._df(files, ['2022-01-01', '2020-01-01'])
+        out_dict = self._mosaic(df, tmp_path, 'mosaic.tif')
+        out_path = list(out_dict)[0]
+        #New item on top of a, fills the nodata of a
+        new_file = str(tmp_path / 'c.tif')
+        with rasterio.open(new_file, 'w', driver='GTiff', height=40, width=20, count=1,
+                           dtype='float32', crs='EPSG:3979', nodata=-32767.0,
+                           transform=rasterio.transform.from_origin(0, 100, 2, 2)) as dst:
+            dst.write(np.full((40, 20), 3, 'float32'), 1)
+        df_new = self._df(files + [new_file], ['2022-01-01', '2020-01-01', '2023-01-01'])
+        print('Execution')
+        result = dce.update_mosaic(out_path, df_new)
+        print('Validation')
+        expected = list(self._mosaic(df_new, tmp_path, 'expected.tif'))[0]
+        with rasterio.open(out_path) as src, rasterio.open(expected) as exp:
+            assert (src.read(1) == exp.read(1)).all()
+            assert (src.read(1)[:, :20] == 3).all()
+        assert result[out_path] == [new_file] + files
+        info = dce.read_mosaic_tags(out_path)
+        assert [source['url'] for source in info['sources']] == [new_file] + files
+
+    @pytest.mark.parametrize('method', ['nearest', 'bilinear'])
+    def test_update_mosaic_overviews(self, tmp_path, method):
+        """The overviews of the updated mosaic are the same as the ones of a new mosaic"""
+        print('Preparation')
+        rng = np.random.default_rng(0)
+        files = []
+        #a covers the 3 output blocks (1200x40 pixels), c covers the end of the first block and the second one
+        for name, x_ori, width in (('a', 0, 1200), ('c', 1001, 300)):
+            file = str(tmp_path / f'{name}.tif')
+            with rasterio.open(file, 'w', driver='GTiff', height=40, width=width, count=1,
+                               dtype='float32', crs='EPSG:3979', nodata=-32767.0,
+                               transform=rasterio.transform.from_origin(x_ori, 100, 2, 2)) as dst:
+                dst.write((rng.random((40, width))*100).astype('float32'), 1)
+            files.append(file)
+        bbox = '0,20,2400,100'
+        out_path = list(self._mosaic(self._df(files[:1], ['2020-01-01']), tmp_path, 'mosaic.tif',
+                                     bbox=bbox, overviews=True, method=method))[0]
+        df_new = self._df(files, ['2020-01-01', '2023-01-01'])
+        print('Execution')
+        dce.update_mosaic(out_path, df_new)
+        print('Validation')
+        expected = list(self._mosaic(df_new, tmp_path, 'expected.tif', bbox=bbox, overviews=True,
+                                     method=method))[0]
+        with rasterio.open(out_path) as src, rasterio.open(expected) as exp:
+            assert src.overviews(1) == exp.overviews(1) == [2, 4]
+            assert np.array_equal(src.read(1), exp.read(1))
+            for factor in src.overviews(1):
+                shape = (math.ceil(src.height/factor), math.ceil(src.width/factor))
+                assert np.array_equal(src.read(1, out_shape=shape), exp.read(1, out_shape=shape))
+
+    def test_update_mosaic_up_to_date(self, tmp_path):
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        df = self._df(files, ['2022-01-01', '2020-01-01'])
+        out_path = list(self._mosaic(df, tmp_path, 'mosaic.tif'))[0]
+        mtime = os.path.getmtime(out_path)
+        print('Execution')
+        result = dce.update_mosaic(out_path, df)
+        print('Validation')
+        assert result[out_path] == files
+        assert os.path.getmtime(out_path) == mtime
+
+
+class TestReduceMosaic():
+
+    def test_reduce_mosaic(self, tmp_path):
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        out_path = tmp_path / 'reduced.tif'
+        reducers = ['first', 'min', 'max', 'mean', 'count', 'median']
+        print('Execution')
+        used, unused = dce.reduce_mosaic(list_params, out_path, out_profile, reducers=reducers)
+        print('Validation')
+        assert used == [p['file'] for p in list_params]
+        assert unused == []
+        with rasterio.open(out_path) as src:
+            assert src.count == len(reducers)
+            assert list(src.descriptions) == reducers
+            arr = src.read()
+            nodata = src.nodata
+        first, mini, maxi, mean, count, median = arr
+        #Only the nodata columns of a
+        assert (first[:, :10] == nodata).all() and (count[:, :10] == 0).all()
+        #Only a
+        assert (first[:, 10:20] == 1).all() and (mean[:, 10:20] == 1).all()
+        #a and b
+        assert (first[:, 20:40] == 1).all() and (count[:, 20:40] == 2).all()
+        assert (mini[:, 20:40] == 1).all() and (maxi[:, 20:40] == 2).all()
+        assert (mean[:, 20:40] == 1.5).all() and (median[:, 20:40] == 1).all()
+        #Only b
+        assert (first[:, 40:] == 2).all() and (median[:, 40:] == 2).all()
+
+    def test_reduce_mosaic_invalid(self, tmp_path):
+        print('Preparation')
+        list_params, out_profile = create_mosaic_sources(tmp_path)
+        print('Execution')
+        with pytest.raises(ValueError):
+            dce.reduce_mosaic(list_params, tmp_path / 'reduced.tif', out_profile, reducers=['mode'])
+
+    @pytest.mark.parametrize('n_values', [7, 200])
+    def test_block_reducer_median(self, n_values):
+        print('Preparation')
+        rng = np.random.default_rng(0)
+        values = rng.normal(0, 1, (n_values, 4, 4)).astype('float32')
+        values[::2, 0, 0] = np.nan
+        reducer = dce.BlockReducer(['min', 'median', 'count'], (4, 4), median_buffer=11)
+        print('Execution')
+        for arr in values:
+            reducer.update(arr)
+        mini, median, count = reducer.result()
+        print('Validation')
+        assert np.allclose(mini, np.nanmin(values, axis=0))
+        assert (count == (~np.isnan(values)).sum(axis=0)).all()
+        if n_values <= 11:
+            #Exact when all the values fit in the first level (odd number of values)
+            assert np.allclose(median, np.nanmedian(values, axis=0))
+        else:
+            #Approximate median : between the quartiles
+            q25, q75 = np.nanpercentile(values, [25, 75], axis=0)
+            assert ((median >= q25) & (median <= q75)).all()
+
+
+class TestAggregateResolution():
+
+    def _fine_raster(self, tmp_path):
+        """8x8 pixels at 2m, value = row*8 + col, first pixel is nodata"""
+        arr = np.arange(64, dtype='float32').reshape(8, 8)
+        arr[0, 0] = -32767.0
+        file = tmp_path / 'fine.tif'
+        with rasterio.open(file, 'w', driver='GTiff', height=8, width=8, count=1,
+                           dtype='float32', crs='EPSG:3979', nodata=-32767.0,
+                           transform=rasterio.transform.from_origin(0, 16, 2, 2)) as dst:
+            dst.write(arr, 1)
+        return file, arr
+
+    @pytest.mark.parametrize('method', ['nearest', 'average', 'max'])
+    def test_aggregate_resolution(self, tmp_path, method):
+        print('Preparation')
+        fine, arr = self._fine_raster(tmp_path)
+        cells = np.ma.masked_equal(arr, -32767.0).reshape(2, 4, 2, 4).transpose(0, 2, 1, 3).reshape(2, 2, 16)
+        expected = {'nearest':arr[2::4, 2::4],
+                    'average':cells.mean(axis=-1).filled(-32767.0),
+                    'max':cells.max(axis=-1).filled(-32767.0)}[method]
+        print('Execution')
+        out_path = dce.aggregate_resolution(fine, tmp_path / 'coarse.tif', factor=4, method=method)
+        print('Validation')
+        with rasterio.open(out_path) as src:
+            assert (src.width, src.height) == (2, 2)
+            assert src.transform == rasterio.transform.from_origin(0, 16, 8, 8)
+            assert np.allclose(src.read(1), expected)
+
+    def test_aggregate_resolution_invalid(self, tmp_path):
+        print('Preparation')
+        fine, _ = self._fine_raster(tmp_path)
+        print('Execution')
+        with pytest.raises(ValueError):
+            dce.aggregate_resolution(fine, tmp_path / 'coarse.tif', factor=0)
+
+
+class TestPlanMosaic():
+
+    def test_plan_mosaic_groups(self, tmp_path):
+        print('Preparation')
+        _, out_profile = create_mosaic_sources(tmp_path)
+        df = pandas.DataFrame({'url':['u1', 'u2', 'u3', 'u4'],
+                               'item_epsg':[2960, 2959, 2960, 2960],
+                               'item_resolution':[2, 2, 2, 1]})
+        print('Execution')
+        list_params = dce.plan_mosaic(df, ['u3', 'u1', 'u2', 'u4'], out_profile, 2, 'bilinear')
+        print('Validation')
+        assert [p['file'] for p in list_params] == ['u3', 'u1', 'u2', 'u4']
+        assert [p['group'] for p in list_params] == ['EPSG:2960', 'EPSG:2960', 'EPSG:2959', 'EPSG:2960']
+        #Same crs and resolution share their parameters
+        assert list_params[0]['params'] is list_params[1]['params']
+        assert list_params[0]['params'] is not list_params[3]['params']
+        assert list_params[3]['params']['transform'].a == 1
+
+    def test_source_footprints(self, tmp_path):
+        print('Preparation')
+        list_params, _ = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        print('Execution')
+        footprints = dce.source_footprints(files, 'EPSG:4326')
+        print('Validation')
+        for file in files:
+            with rasterio.open(file) as src:
+                expected = rasterio.warp.transform_bounds(src.crs, 'EPSG:4326', *src.bounds)
+            assert np.allclose(footprints[file], expected)
+
+    def test_group_timer(self):
+        print('Preparation')
+        timer = dce.GroupTimer()
+        print('Execution')
+        timer.start({'file':'a', 'group':'EPSG:2960'})
+        timer.start({'file':'b', 'group':'EPSG:2960'})
+        timer.start({'file':'c', 'group':'EPSG:2959'})
+        report = timer.report()
+        print('Validation')
+        assert report.set_index('group')['files'].to_dict() == {'EPSG:2960':2, 'EPSG:2959':1}
+        assert (report.seconds >= 0).all()
+
+
+class TestBboxWindows():
+
+    def _tiled_raster(self, tmp_path):
+        """100x70 pixels at 2m, 16x16 blocks"""
+        file = tmp_path / 'tiled.tif'
+        with rasterio.open(file, 'w', driver='GTiff', height=70, width=100, count=1,
+                           dtype='int16', crs='EPSG:3979', nodata=-32767, tiled=True,
+                           blockxsize=16, blockysize=16,
+                           transform=rasterio.transform.from_origin(0, 140, 2, 2)) as dst:
+            dst.write(np.ones((70, 100), 'int16'), 1)
+        return str(file)
+
+    @pytest.mark.parametrize('clip', [True, False])
+    def test_bbox_windows(self, tmp_path, clip):
+        print('Preparation')
+        file = self._tiled_raster(tmp_path)
+        bbox = '21,33,121,99'
+        with rasterio.open(file) as img:
+            w_tap = dce.tap_window(img.transform, bbox, 'EPSG:3979', img.crs)
+            expected = []
+            for _, win in img.block_windows(1):
+                clipped = dce.clip_window(win, w_tap)
+                if clipped:
+                    expected.append(clipped if clip else win)
+        print('Execution')
+        dce.image_block_grid.cache_clear()
+        result = dce.bbox_windows(file, bbox, 'EPSG:3979', clip=clip)
+        print('Validation')
+        assert result == expected
+        assert dce.image_block_grid.cache_info().currsize == 1
+
+    def test_bbox_block_arrays(self, tmp_path):
+        print('Preparation')
+        file = self._tiled_raster(tmp_path)
+        print('Execution')
+        blocks = dce.bbox_block_arrays(file, '0,0,200,140', 'EPSG:3979', clip=False)
+        print('Validation')
+        #7 block columns, 5 block rows, the last ones truncated by the image
+        assert len(blocks['block_row']) == 35
+        assert blocks['width'].sum() == 100*5
+        assert blocks['height'].sum() == 70*7
+
+
+class TestGeometry():
+
+    def test_transform_bbox(self):
+        print('Preparation')
+        bbox = '-75.5,45.1,-73.2,46.9'
+        geom = rasterio.warp.transform_geom('EPSG:4326', 'EPSG:3979', DEX.poly_to_dict(DEX.bbox_to_poly(bbox)))
+        expected = shapely.geometry.shape(geom).bounds
+        print('Execution')
+        result = dcg.transform_bbox(bbox, 'EPSG:4326', 'EPSG:3979')
+        print('Validation')
+        assert np.allclose(result, expected, rtol=0, atol=1e-6)
+
+    def test_transform_bboxes(self):
+        print('Preparation')
+        bounds = [(-75.5, 45.1, -73.2, 46.9), (-120, 49, -119, 50), (-64, 44, -63, 45)]
+        print('Execution')
+        result = dcg.transform_bboxes(bounds, 'EPSG:4326', 3979, densify_pts=21)
+        print('Validation')
+        assert result.shape == (3, 4)
+        for b, r in zip(bounds, result):
+            assert np.allclose(r, rasterio.warp.transform_bounds('EPSG:4326', 'EPSG:3979', *b), 
+                               rtol=0, atol=1e-3)
+
+    def test_cached_crs_and_transformer(self):
+        print('Execution')
+        transformer = dcg.get_transformer('EPSG:4326', 'EPSG:3979')
+        print('Validation')
+        assert dcg.get_transformer('EPSG:4326', 'EPSG:3979') is transformer
+        assert dcg.parse_crs('EPSG:3979') is dcg.parse_crs('EPSG:3979')
+        assert dcg.parse_crs(3979) == rasterio.crs.CRS.from_epsg(3979)
+
+
+class TestBatchMosaic():
+
+    def _profile(self, bbox):
+        crs = rasterio.crs.CRS.from_epsg(3979)
+        transform, height, width = dce.get_output_dimension([2], bbox=bbox, bbox_crs='EPSG:3979',
+                                                            out_crs=crs, out_res=2)
+        return dce.update_profile(in_profile=dce.default_profile(), new_crs=crs,
+                                  new_height=height, new_width=width, new_transform=transform,
+                                  new_blocksize=512, new_nodata=-32767.0, new_dtype='float32')
+
+    @pytest.mark.parametrize('max_open', [32, 1])
+    def test_batch_mosaic(self, tmp_path, max_open):
+        print('Preparation')
+        list_params, _ = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        df = pandas.DataFrame({'url':files, 'collection_id':'c1',
+                               'item_datetime':['2022-01-01', '2020-01-01'],
+                               'item_resolution':2, 'item_epsg':3979, 'asset_key':'dsm'})
+        aoi_profiles = {'west':self._profile('0,20,60,100'),
+                        'east':self._profile('50,20,120,100'),
+                        'outside':self._profile('500,20,560,100')}
+        out_paths = {name:tmp_path / f'{name}.tif' for name in aoi_profiles}
+        print('Execution')
+        #max_open=1, the outputs are closed and opened again between the sources
+        out_files = dce.batch_mosaic(df, aoi_profiles, out_paths, max_open=max_open)
+        print('Validation')
+        #b is under a in the west AOI
+        assert out_files == [{out_paths['west']:files[:1]}, {out_paths['east']:files}]
+        assert not out_paths['outside'].exists()
+        with rasterio.open(out_paths['west']) as src:
+            arr = src.read(1)
+            assert (arr[:, :10] == -32767.0).all()
+            assert (arr[:, 10:] == 1).all()
+        with rasterio.open(out_paths['east']) as src:
+            arr = src.read(1)
+            #x 50 to 80 from a, 80 to 120 from b
+            assert (arr[:, :15] == 1).all()
+            assert (arr[:, 15:] == 2).all()
+
+
+class TestTileMosaic():
+
+    def _df(self, files, datetimes=('2022-01-01', '2020-01-01')):
+        return pandas.DataFrame({'url':files, 'collection_id':'c1',
+                                 'item_datetime':list(datetimes),
+                                 'item_resolution':2, 'item_epsg':3979, 'asset_key':'dsm'})
+
+    def test_standard_grid_dimension(self):
+        print('Preparation')
+        bbox = '1,21,119,99'
+        print('Execution')
+        transform, height, width = dce.standard_grid_dimension(bbox, 'EPSG:3979', 2)
+        print('Validation')
+        assert transform == rasterio.transform.from_origin(0, 100, 2, 2)
+        assert (height, width) == (40, 60)
+        #The tile of the origin starts at the standard grid origin
+        assert dce.standard_tile_transform(0, 0, 2) == rasterio.transform.from_origin(*dce.STANDARD_GRID_ORIGIN, 2, 2)
+
+    def test_tile_mosaic(self, tmp_path):
+        print('Preparation')
+        list_params, _ = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        store = tmp_path / 'store'
+        print('Execution')
+        out_dict = dce.tile_mosaic(self._df(files), '0,20,120,100', 'EPSG:3979', 2, store,
+                                   tmp_path / 'mosaic.tif')
+        print('Validation')
+        assert out_dict == {tmp_path / 'mosaic.tif':files}
+        with rasterio.open(tmp_path / 'mosaic.tif') as src:
+            assert src.transform == rasterio.transform.from_origin(0, 100, 2, 2)
+            arr = src.read(1)
+            assert (arr[:, :10] == -32767.0).all()
+            assert (arr[:, 10:40] == 1).all()
+            assert (arr[:, 40:] == 2).all()
+        tiles = sorted(store.rglob('*.tif'))
+        assert len(tiles) == 2
+        assert all(t.parent.parent.parent.name == '2m' for t in tiles)
+        assert all(t.parent.parent.name == 'nearest' for t in tiles)
+        assert all(t.parent.name == 'float32_-32767' for t in tiles)
+
+    def test_tile_mosaic_method(self, tmp_path):
+        print('Preparation')
+        #Random values shifted by half a pixel of the standard grid, the resampling matters
+        rng = np.random.default_rng(0)
+        file = str(tmp_path / 'random.tif')
+        with rasterio.open(file, 'w', driver='GTiff', height=40, width=40, count=1, dtype='float32',
+                           crs='EPSG:3979', nodata=-32767.0,
+                           transform=rasterio.transform.from_origin(1, 101, 2, 2)) as dst:
+            dst.write((rng.random((40, 40))*100).astype('float32'), 1)
+        df = self._df([file], ('2022-01-01',))
+        store = tmp_path / 'store'
+        print('Execution')
+        arrs = {}
+        for method in ('nearest', 'bilinear', 'nearest'):
+            out_path = tmp_path / f'{method}.tif'
+            dce.tile_mosaic(df, '10,30,70,90', 'EPSG:3979', 2, store, out_path, method=method)
+            with rasterio.open(out_path) as src:
+                arrs.setdefault(method, []).append(src.read(1))
+        print('Validation')
+        #One tile per method, the bilinear request does not reuse the nearest tile
+        tiles = sorted(store.rglob('*.tif'))
+        assert sorted(t.parent.parent.name for t in tiles) == ['bilinear', 'nearest']
+        with rasterio.open(tiles[0]) as bilinear, rasterio.open(tiles[1]) as nearest:
+            assert not np.array_equal(bilinear.read(1), nearest.read(1))
+        assert not np.array_equal(arrs['nearest'][0], arrs['bilinear'][0])
+        assert np.array_equal(arrs['nearest'][0], arrs['nearest'][1])
+
+    def test_tile_mosaic_reuse(self, tmp_path):
+        print('Preparation')
+        list_params, _ = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        store = tmp_path / 'store'
+        dce.tile_mosaic(self._df(files), '0,20,120,100', 'EPSG:3979', 2, store, tmp_path / 'first.tif')
+        #The source a is changed without a new version, the stored tiles are used
+        with rasterio.open(files[0], 'r+') as src:
+            src.write(np.full((40, 40), 5, 'float32'), 1)
+        print('Execution')
+        same = dce.tile_mosaic(self._df(files), '20,20,100,100', 'EPSG:3979', 2, store, tmp_path / 'same.tif')
+        new = dce.tile_mosaic(self._df(files, ('2023-01-01', '2020-01-01')), '20,20,100,100', 'EPSG:3979', 2,
+                              store, tmp_path / 'new.tif')
+        print('Validation')
+        assert same == {tmp_path / 'same.tif':files}
+        with rasterio.open(tmp_path / 'same.tif') as src:
+            arr = src.read(1)
+            assert arr.shape == (40, 40)
+            assert (arr[:, :30] == 1).all()
+        #A new version of a is warped in new tiles
+        assert new == {tmp_path / 'new.tif':files}
+        with rasterio.open(tmp_path / 'new.tif') as src:
+            arr = src.read(1)
+            assert (arr[:, :30] == 5).all()
+            assert (arr[:, 30:] == 2).all()
+        assert len(list(store.rglob('*.tif'))) == 3
+
+    def test_tile_mosaic_outside(self, tmp_path):
+        print('Preparation')
+        list_params, _ = create_mosaic_sources(tmp_path)
+        files = [p['file'] for p in list_params]
+        print('Execution')
+        out_dict = dce.tile_mosaic(self._df(files), '2000,20,2100,100', 'EPSG:3979', 2,
+                                   tmp_path / 'store', tmp_path / 'outside.tif')
+        print('Validation')
+        assert out_dict is None
+        assert not (tmp_path / 'outside.tif').exists()
+
+
+class TestWcsExtract():
+
+    def _request_to_file(self, failures:list):
+        """Mock of request_to_file writing the value 1 over the BoundingBox of the request"""
+        def _write(u, img_name, f_main='main.log'):
+            if failures:
+                failures.pop()
+                raise Exception('Error when getting wcs result:', 503)
+            bbox = u.split('BoundingBox=')[1].split(',urn')[0]
+            minx, miny, maxx, maxy = (float(v) for v in bbox.split(','))
+            cellsize = float(u.split('GridOffsets=')[1].split(',')[0])
+            width, height = round((maxx - minx)/cellsize), round((maxy - miny)/cellsize)
+            with rasterio.open(img_name, 'w', driver='GTiff', height=height, width=width, count=1,
+                               dtype='float32', crs='EPSG:3979', nodata=-32767.,
+                               transform=rasterio.transform.from_origin(minx, maxy, cellsize, cellsize)) as dst:
+                dst.write(np.full((height, width), 1, 'float32'), 1)
+            return f'{img_name} request sc:200 reason:OK'
+        return _write
+
+    def test_wcs_tile_bounds(self):
+        print('Preparation')
+        bounds = (0., 0., 100., 60.)
+        print('Execution')
+        tiles = DEX.wcs_tile_bounds(bounds, 2, max_pixels=400)
+        print('Validation')
+        #Sub-coverages of 20x20 pixels at most, covering the bounds
+        assert len(tiles) == 6
+        assert tiles[0] == (0., 20., 40., 60.)
+        assert tiles[-1] == (80., 0., 100., 20.)
+        assert sum((t[2] - t[0])*(t[3] - t[1]) for t in tiles) == 100*60
+
+    def test_wcs_tiled_extract(self, tmp_path):
+        print('Preparation')
+        poly_dic = DEX.poly_to_dict(DEX.bbox_to_poly('0,0,100,60'))
+        failures = [True]
+        print('Execution')
+        with patch.object(dce.DatacubeExtract, 'request_to_file', side_effect=self._request_to_file(failures)), \
+             patch('ccmeo_datacube.extract.time.sleep') as mock_sleep:
+            img_name = DEX.wcs_coverage_extract(poly_dic, 'EPSG:3979', 'HTTPS', 'dtm', 'stage', 'elevation',
+                                                cellsize=2, cwd=tmp_path / 'out', max_pixels=400, max_workers=2,
+                                                f_main=tmp_path / 'main.log')
+        print('Validation')
+        #The failed request is retried once
+        assert mock_sleep.call_count == 1
+        assert failures == []
+        with rasterio.open(img_name) as src:
+            assert src.transform == rasterio.transform.from_origin(0, 60, 2, 2)
+            assert src.shape == (30, 50)
+            assert src.profile['tiled']
+            assert (src.read(1) == 1).all()
+        assert list((tmp_path / 'out').glob('*.tif')) == [img_name]
+
+    def _response(self, tmp_path, cellsize):
+        """Mock of a GetCoverage response streaming a 30x50 GeoTIFF of cellsize"""
+        src = tmp_path / 'response.tif'
+        with rasterio.open(src, 'w', driver='GTiff', height=30, width=50, count=1, dtype='float32',
+                           crs='EPSG:3979', nodata=-32767.,
+                           transform=rasterio.transform.from_origin(0, 60, cellsize, cellsize)) as dst:
+            dst.write(np.full((30, 50), 1, 'float32'), 1)
+        data = src.read_bytes()
+        src.unlink()
+        response = MagicMock()
+        response.status_code = 200
+        response.iter_content.side_effect = lambda chunk_size: (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+        return response
+
+    def test_wcs_coverage_extract_memory(self, tmp_path):
+        print('Preparation')
+        poly_dic = DEX.poly_to_dict(DEX.bbox_to_poly('0,0,100,60'))
+        print('Execution')
+        with patch('ccmeo_datacube.extract.requests.get', return_value=self._response(tmp_path, 2)) as mock_get, \
+             patch('ccmeo_datacube.extract._WCS_CHUNK_SIZE', 1000):
+            img_name = DEX.wcs_coverage_extract(poly_dic, 'EPSG:3979', 'HTTPS', 'dtm', 'stage', 'elevation',
+                                                cellsize=2, cwd=tmp_path / 'out', overviews=True,
+                                                tifftag_datetime='2020:01:01 00:00:00',
+                                                f_main=tmp_path / 'main.log')
+        print('Validation')
+        #A single request streamed by chunks, the cog is written once
+        assert mock_get.call_count == 1
+        assert mock_get.call_args.kwargs['stream']
+        assert list((tmp_path / 'out').glob('*')) == [img_name]
+        with rasterio.open(img_name) as src:
+            assert src.transform == rasterio.transform.from_origin(0, 60, 2, 2)
+            assert src.profile['tiled'] and src.profile['compress'] == 'lzw'
+            assert src.tags()['TIFFTAG_DATETIME'] == '2020:01:01 00:00:00'
+            assert (src.read(1) == 1).all()
+
+    def test_wcs_coverage_extract_empty(self, tmp_path):
+        print('Preparation')
+        poly_dic = DEX.poly_to_dict(DEX.bbox_to_poly('0,0,100,60'))
+        print('Execution')
+        #The service returns an empty result at another resolution
+        with patch('ccmeo_datacube.extract.requests.get', return_value=self._response(tmp_path, 5)):
+            img_name = DEX.wcs_coverage_extract(poly_dic, 'EPSG:3979', 'HTTPS', 'dtm', 'stage', 'elevation',
+                                                cellsize=2, cwd=tmp_path / 'out', f_main=tmp_path / 'main.log')
+        print('Validation')
+        assert img_name is None
+        assert list((tmp_path / 'out').glob('*')) == []
+
+    def test_wcs_cache(self, tmp_path):
+        print('Preparation')
+        poly_dic = DEX.poly_to_dict(DEX.bbox_to_poly('0,0,100,60'))
+        cache = dce.WcsCache(tmp_path / 'cache')
+        out_dir = tmp_path / 'out'
+        print('Execution')
+        with patch('ccmeo_datacube.extract.requests.get', return_value=self._response(tmp_path, 2)) as mock_get:
+            for _ in range(2):
+                img_name = DEX.wcs_coverage_extract(poly_dic, 'EPSG:3979', 'HTTPS', 'dtm', 'stage', 'elevation',
+                                                    cellsize=2, cwd=out_dir, wcs_cache=cache,
+                                                    f_main=tmp_path / 'main.log')
+        print('Validation')
+        #The second extraction is read from the cache
+        assert mock_get.call_count == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+        with rasterio.open(img_name) as src:
+            assert (src.read(1) == 1).all()
+        #Another layer is another request
+        assert cache.key('dsm', 'stage', (0, 0, 100, 60), 2) != cache.key('dtm', 'stage', (0, 0, 100, 60), 2)
+        assert cache.key('dtm', 'stage', (0, 0, 100, 60), 2) == cache.key('dtm', 'stage', (0., 0., 100., 60.), 2.)
+
+    def test_wcs_cache_tiled(self, tmp_path):
+        print('Preparation')
+        poly_dic = DEX.poly_to_dict(DEX.bbox_to_poly('0,0,100,60'))
+        cache = dce.WcsCache(tmp_path / 'cache')
+        mock_request = self._request_to_file([])
+        print('Execution')
+        with patch.object(dce.DatacubeExtract, 'request_to_file', side_effect=mock_request) as mock_file:
+            for _ in range(2):
+                img_name = DEX.wcs_coverage_extract(poly_dic, 'EPSG:3979', 'HTTPS', 'dtm', 'stage', 'elevation',
+                                                    cellsize=2, cwd=tmp_path / 'out', max_pixels=400,
+                                                    wcs_cache=str(tmp_path / 'cache'),
+                                                    f_main=tmp_path / 'main.log')
+        print('Validation')
+        #6 sub-coverages requested once
+        assert mock_file.call_count == 6
+        assert len(list((tmp_path / 'cache').glob('*.tif'))) == 6
+        with rasterio.open(img_name) as src:
+            assert (src.read(1) == 1).all()
+
+    def test_wcs_cache_eviction(self, tmp_path):
+        print('Preparation')
+        cache = dce.WcsCache(tmp_path, max_size=35)
+        print('Execution')
+        for i in range(3):
+            cache.put(str(i), b'0123456789')
+            os.utime(cache.path(str(i)), (i, i))
+        cache.get('0')
+        cache.put('3', b'0123456789')
+        print('Validation')
+        #The least recently used result (1) is removed
+        assert sorted(f.stem for f in tmp_path.glob('*.tif')) == ['0', '2', '3']
+        report = cache.report()
+        assert report.loc[0, 'evictions'] == 1
+        assert report.loc[0, 'hits'] == 1
@@ -23,7 +23,7 @@ else:
 
     
 
-# defaults to window write, bilinear resampling, blocksize 1028, and compression LZW
+# defaults to window write, bilinear resampling, blocksize 1024, and compression LZW
 file = ef.fabdem3979_canada_mosaic()
 print(f'created {file}, now building overviews')
 ef.build_overviews(file,resampling='nearest')
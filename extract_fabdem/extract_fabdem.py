@@ -13,11 +13,17 @@ Example Usage:
 
 """
 # python standard library
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import hashlib
 import json
 import math
 import os
 import pathlib
+import pickle
 import sys
+import threading
+import time
 
 
 # python cusomt modules
@@ -25,6 +31,8 @@ import pandas
 import geopandas
 import shapely
 import rasterio
+import rasterio.features
+import rasterio.warp
 from rasterio.transform import Affine
 import numpy
 
@@ -39,27 +47,50 @@ import ccmeo_datacube.extract as dce
 
 def fabdem3979_canada_mosaic(mosaic_by_window=True,
                              resample='bilinear',
-                             blocksize=1028,
+                             blocksize=1024,
                              compression='LZW',
-                             pixel_size=30):
+                             pixel_size=30,
+                             resume=False,
+                             parallel=False,
+                             max_workers=None):
     """Generate a mosaic of all of Canada using the fabdem 3979 tifs
 
     Should be run as a job file
 
+    With parallel, the output blocks are composited from their intersecting
+    fabdems by max_workers threads (see parallel_block_mosaic), mosaic_by_window
+    is then not used.
+
+    blocksize is the output block size, it must be a multiple of 16.
+
+    With mosaic_by_window, the mosaic is written in canada_mosaic.tif.temp and a
+    checkpoint is saved after each fabdem, resume=True continues a run killed
+    by the scheduler from the last checkpoint instead of starting over.
+
     #TODO rewrite calls based on new functionality in extract
 
     """
+    if blocksize % 16:
+        raise ValueError(f'blocksize {blocksize} must be a multiple of 16')
 
     # Set up location and file name of out file
     canada_subdir = get_fabdem_path().joinpath(f'mosaics/{resample}/canada')
-    dce.checkOutpath(canada_subdir)
+    dce.DatacubeExtract.check_outpath(canada_subdir)
     out_file = canada_subdir.joinpath('canada_mosaic.tif')
 
     opened_imgs = []
     # Get a list of fabdem3979 tifs
     fabdems = get_3979_fabdems(resample=resample)
-    # sort the list and ensure unique
-    fabdems = list(set(fabdems))
+    # sort the list and ensure unique, the order must be the same to resume
+    fabdems = sorted(set(fabdems))
+
+    if parallel:
+        print(f'Start mosaic by parallel blocks {dce.datetime.now()}')
+        parallel_block_mosaic(fabdems,out_file,pixel_size=pixel_size,blocksize=blocksize,
+                              compression=compression,max_workers=max_workers,resume=resume)
+        print(f'End mosaic by parallel blocks {dce.datetime.now()}')
+        print(f'Finished processing {out_file.absolute()}')
+        return out_file.absolute()
 
     # Open each one and add to list to be passed to merge
     for fabdem in fabdems:
@@ -109,7 +140,7 @@ def fabdem3979_canada_mosaic(mosaic_by_window=True,
                                    dst_transform=dst_transform,
                                    dst_w=dst_width,
                                    dst_h=dst_height,
-                                   blocksize=1024)
+                                   blocksize=blocksize)
         # add bigtiff to kwargs
         kwargs['BIGTIFF'] = 'IF_SAFER'
         # Band count from first image
@@ -117,9 +148,18 @@ def fabdem3979_canada_mosaic(mosaic_by_window=True,
         kwargs['count'] = band_count
 
         # Write all the files into a single file using the total imagery bounds
-        # Write out the canada mosaic
-        with rasterio.open(out_file,'w+',**kwargs) as dst:
-            for opened_img in opened_imgs:
+        # Write out the canada mosaic in a temp file, with checkpoints
+        temp_file = f'{out_file}.temp'
+        dst, state = dce.open_mosaic_temp(temp_file, kwargs, fabdems, resume)
+        try:
+            for i, opened_img in enumerate(opened_imgs):
+                if i < state['next_source']:
+                    continue
+                if i > state['next_source']:
+                    # All the fabdems before i are written
+                    state['next_source'] = i
+                    dst = dce.checkpoint_mosaic(dst, temp_file, state)
+                print(f'{i+1}/{len(opened_imgs)} {opened_img.name} {dce.datetime.now()}')
                 # Get the no data value
                 nodata = opened_img.nodata
                 # For each band
@@ -147,6 +187,10 @@ def fabdem3979_canada_mosaic(mosaic_by_window=True,
                         dst.write(window_arr,indexes=band,window=dst_window)
                 # #close the opened image
                 # opened_img.close()
+        finally:
+            dst.close()
+        dce.remove_mosaic_checkpoint(temp_file)
+        os.replace(temp_file, out_file)
 
         print(f'End mosaic by window {dce.datetime.now()}')
         # close open images
@@ -168,7 +212,7 @@ def fabdem3979_canada_mosaic(mosaic_by_window=True,
                                    dst_transform=dst_transform,
                                    dst_w=dst_arr.width,
                                    dst_h=dst_arr.height,
-                                   blocksize=1028)
+                                   blocksize=blocksize)
         # Write out the canada mosaic
         dce.checkOutpath(out_file)
         with rasterio.open(out_file,'w+',**kwargs) as dst:
@@ -178,6 +222,119 @@ def fabdem3979_canada_mosaic(mosaic_by_window=True,
 
     return out_file.absolute()
 
+def parallel_block_mosaic(files,out_file,pixel_size=30,blocksize=1024,
+                          compression='LZW',max_workers=None,resume=False):
+    """Mosaic of aligned EPSG:3979 files on the datacube standard grid,
+    output block by output block
+
+    The footprints of the files are indexed in a shapely STRtree, each output
+    block is composited from the files it intersects (in the order of files,
+    the valid values of the later files on top, like the window mosaic)
+    by max_workers threads and the blocks are written in order by the main thread.
+    The memory is bounded by 2*max_workers blocks, only the headers are read up front.
+
+    The mosaic is written in <out_file>.temp with a checkpoint every
+    dce._CHECKPOINT_BLOCKS blocks, resume=True continues from the last checkpoint.
+    """
+    files = [str(f) for f in files]
+    max_workers = max_workers or os.cpu_count()
+    # Footprints and profile from the headers only
+    footprints = []
+    for file in files:
+        with rasterio.open(file) as img:
+            footprints.append(shapely.geometry.box(*img.bounds))
+            if len(footprints) == 1:
+                meta = img.meta.copy()
+    tree = shapely.STRtree(footprints)
+    dst_w,dst_s,dst_e,dst_n = shapely.total_bounds(footprints)
+    (dst_transform,
+     dst_width,
+     dst_height) = datacube_standard_transform(dst_w,dst_s,dst_e,dst_n,pixel_size)
+    kwargs = modify_kwargs(kwargs=meta,
+                           dst_crs=meta['crs'],
+                           dst_transform=dst_transform,
+                           dst_w=dst_width,
+                           dst_h=dst_height,
+                           blocksize=blocksize)
+    kwargs['compress'] = compression
+    kwargs['BIGTIFF'] = 'IF_SAFER'
+    nodata = kwargs.get('nodata')
+    fill = numpy.nan if nodata is None else nodata
+    windows = [rasterio.windows.Window(col,row,
+                                       min(blocksize,dst_width-col),
+                                       min(blocksize,dst_height-row))
+               for row in range(0,dst_height,blocksize)
+               for col in range(0,dst_width,blocksize)]
+    print(f'{len(files)} files, {len(windows)} output blocks, {max_workers} workers')
+
+    # Opened files per thread, datasets are not thread safe
+    local = threading.local()
+    all_opened = []
+    lock = threading.Lock()
+
+    def _composite(window):
+        bounds = rasterio.windows.bounds(window,dst_transform)
+        indexes = sorted(tree.query(shapely.geometry.box(*bounds),predicate='intersects'))
+        if not indexes:
+            return None
+        if not hasattr(local,'datasets'):
+            local.datasets = OrderedDict()
+            with lock:
+                all_opened.append(local.datasets)
+        arr = numpy.full((kwargs['count'],window.height,window.width),fill,dtype=kwargs['dtype'])
+        for i in indexes:
+            img = dce._open_cached(local.datasets,files[i])
+            src_window = rasterio.windows.from_bounds(*bounds,transform=img.transform)
+            src_window = rasterio.windows.Window(round(src_window.col_off),round(src_window.row_off),
+                                                 window.width,window.height)
+            try:
+                read_window = src_window.intersection(rasterio.windows.Window(0,0,img.width,img.height))
+            except rasterio.errors.WindowError:
+                # Only touching
+                continue
+            data = img.read(window=read_window)
+            valid = ~dce._nodata_mask(data,img.nodata)
+            if data.dtype.kind == 'f':
+                valid &= ~numpy.isnan(data)
+            row = read_window.row_off - src_window.row_off
+            col = read_window.col_off - src_window.col_off
+            target = arr[:,row:row+read_window.height,col:col+read_window.width]
+            target[valid] = data[valid]
+        return arr
+
+    temp_file = f'{out_file}.temp'
+    dst, state = dce.open_mosaic_temp(temp_file,kwargs,files,resume)
+    try:
+        start = state['completed_blocks']
+        todo = deque()
+        next_window = iter(range(start,len(windows)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit ahead of the writer, at most 2*max_workers blocks in memory
+            for b in next_window:
+                todo.append((b,executor.submit(_composite,windows[b])))
+                if len(todo) >= 2*max_workers:
+                    break
+            while todo:
+                b,future = todo.popleft()
+                arr = future.result()
+                if arr is not None:
+                    dst.write(arr,window=windows[b])
+                b_next = next(next_window,None)
+                if b_next is not None:
+                    todo.append((b_next,executor.submit(_composite,windows[b_next])))
+                state['completed_blocks'] = b + 1
+                if state['completed_blocks'] % dce._CHECKPOINT_BLOCKS == 0:
+                    dst = dce.checkpoint_mosaic(dst,temp_file,state)
+                    print(f'{b+1}/{len(windows)} blocks {dce.datetime.now()}')
+    finally:
+        dst.close()
+        for datasets in all_opened:
+            for img in datasets.values():
+                img.close()
+    dce.remove_mosaic_checkpoint(temp_file)
+    os.replace(temp_file,out_file)
+    return out_file
+
 def dst_shape_transform(dst_w,dst_s,dst_e,dst_n,pixel_size):
     """Calculates shape and transform for output extent as
     integer mulitiples of pixel size.  Assumes coords and pixel size
@@ -535,29 +692,92 @@ def get_fabdem_path():
     p = pathlib.Path('/gpfs/fs3/nrcan/nrcan_geobase/work/data/hem/ref/FAUDEM/')
     return p
 
-def get_fabdem_files(study_area,resample='bilinear',national_grid=True):
-    files = []
+def get_fabdem_files(study_area,resample='bilinear',national_grid=True,geometry=None,crs=None):
+    """The fabdem files intersecting the study area grid id or the geometry (any AOI)
+    The files are found with the footprint index (see footprint_index)"""
+    if geometry is None:
+        geometry,crs = _get_study_area_geometry(study_area,national_grid)
+    return query_files(geometry,crs=crs,fabdem=True,resample=resample)
+
+def get_copernicus_files(study_area,national_grid=True,geometry=None,crs=None):
+    """The copernicus files intersecting the study area grid id or the geometry (any AOI)
+    The files are found with the footprint index (see footprint_index)"""
+    if geometry is None:
+        geometry,crs = _get_study_area_geometry(study_area,national_grid)
+    return query_files(geometry,crs=crs,fabdem=False)
+
+# The footprint indexes loaded in this process {(fabdem,resample):(tree,files,crs)}
+_FOOTPRINT_INDEXES = {}
+
+def _footprint_index_path(fabdem=True,resample='bilinear'):
+    """The file path to the persisted footprint index, next to the footprints geojson"""
+    if fabdem:
+        fgj = _fabdems_geojson_path(resample)
+    else:
+        fgj = _copernicus_geojson_path()
+    return fgj.with_suffix('.strtree.pkl')
 
-    f = _grid_id_fabdems_geojson_path(resample,national_grid)
+def footprint_index(fabdem=True,resample='bilinear',rebuild=False):
+    """STRtree of the footprints of the local fabdem (or copernicus) 3979 files
+    Returns tree,files,crs, the tree query indices are indices of files
 
-    if f.is_file():
-        #convert comma seperated string of files into list
-        gdf = geopandas.read_file(f)
-        files_str = gdf[gdf['study_area']==study_area]['files'].values[0]
-        files = files_str.split(',')
+    The tree is built once from the footprints geojson (made by make_fabdem_geojson
+    or make_copernicus_geojson if missing) and pickled next to it, it is rebuilt
+    when the geojson is newer or rebuild=True
+    """
+    key = (fabdem,resample)
+    if key in _FOOTPRINT_INDEXES and not rebuild:
+        return _FOOTPRINT_INDEXES[key]
+    if fabdem:
+        fgj = _fabdems_geojson_path(resample)
     else:
-        print(f'File {f} does not exist')
-    return files
-
-def get_copernicus_files(study_area):
-    files = []
-    f = _grid_id_copernicus_json_path()
-    if f.is_file():
-        fp = f.open()
-        j = json.load(fp)
-        fp.close()
-        files = j[study_area]
-    return files
+        fgj = _copernicus_geojson_path()
+    index_path = _footprint_index_path(fabdem,resample)
+    if not fgj.is_file():
+        if fabdem:
+            make_fabdem_geojson(resample)
+        else:
+            make_copernicus_geojson()
+        rebuild = True
+    if (not rebuild and index_path.is_file()
+        and index_path.stat().st_mtime >= fgj.stat().st_mtime):
+        with index_path.open('rb') as fp:
+            index = pickle.load(fp)
+    else:
+        footprints = geopandas.GeoDataFrame.from_file(fgj)
+        tree = shapely.STRtree(footprints.geometry.values)
+        index = (tree,list(footprints['file'].values),footprints.crs.to_wkt())
+        temp_path = index_path.with_name(f'{index_path.name}.temp')
+        with temp_path.open('wb') as fp:
+            pickle.dump(index,fp)
+        os.replace(temp_path,index_path)
+        print(f'Footprint index created {index_path}')
+    _FOOTPRINT_INDEXES[key] = index
+    return index
+
+def query_files(geometry,crs=None,fabdem=True,resample='bilinear'):
+    """The local fabdem (or copernicus) 3979 files intersecting geometry
+    geometry is a shapely geometry, a geojson geometry dict, a GeoSeries or a GeoDataFrame
+    and crs its crs when it is not the crs of the footprints (EPSG:3979)"""
+    tree,files,index_crs = footprint_index(fabdem,resample)
+    if isinstance(geometry,(geopandas.GeoDataFrame,geopandas.GeoSeries)):
+        if crs is None:
+            crs = geometry.crs
+        geometry = geometry.unary_union
+    elif isinstance(geometry,dict):
+        geometry = shapely.geometry.shape(geometry)
+    if crs is not None and rasterio.crs.CRS.from_user_input(crs) != rasterio.crs.CRS.from_wkt(index_crs):
+        geometry = geopandas.GeoSeries([geometry],crs=crs).to_crs(index_crs).values[0]
+    indices = tree.query(geometry,predicate='intersects')
+    return [files[i] for i in sorted(indices)]
+
+def _get_study_area_geometry(grid_id,national_grid=True):
+    """The geometry and crs of the study area grid id"""
+    study_area = _get_sample_area_gdf(grid_id,national_grid)
+    if study_area.empty:
+        print(f'Study area {grid_id} is not in {_get_study_areas_file_path(national_grid)}')
+        return shapely.geometry.GeometryCollection(),None
+    return study_area.geometry.values[0],study_area.crs
 
 def _get_study_areas_file_path(national_grid=True):
     """Path to the geojson defining study area grids"""
@@ -576,8 +796,8 @@ def _get_study_areas_file_path(national_grid=True):
     fp = p.joinpath(subdir,file)
     return fp
 
-def _get_sample_area_gdf(grid_id='AY-39'):
-    p = _get_study_areas_file_path()
+def _get_sample_area_gdf(grid_id='AY-39',national_grid=True):
+    p = _get_study_areas_file_path(national_grid)
     study_areas = geopandas.GeoDataFrame.from_file(p)
     study_area = study_areas[study_areas['GRID_ID']==grid_id]
     return study_area
@@ -650,7 +870,9 @@ def make_copernicus_geojson():
 
 def make_gridid_copernicus_json():
     """Creaes copernicus json linking flood susceptability study area grid ids
-    to local copernicus files both in 3979 projection"""
+    to local copernicus files both in 3979 projection
+    No longer used by get_copernicus_files, which queries
+    the footprint index (see footprint_index)"""
     fgj = _copernicus_geojson_path()
     saj = _get_study_areas_file_path()
     fjf = _grid_id_copernicus_json_path()
@@ -681,7 +903,9 @@ def make_gridid_copernicus_json():
 
 def make_gridid_fabdem_json(resample='bilinear'):
     """Creaes FABDEM json linking flood susceptability study area grid ids
-    to local fabdem files both in 3979 projection"""
+    to local fabdem files both in 3979 projection
+    No longer used by get_fabdem_files, which queries
+    the footprint index (see footprint_index)"""
     fgj = _fabdems_geojson_path()
     saj = _get_study_areas_file_path()
     fjf = _grid_id_fabdems_json_path()
@@ -715,6 +939,8 @@ def make_gridid_fabdem_geojson(resample='bilinear',national_grid=True):
     and bounding boxes to
     to local fabdem files both in 3979 projection
     {"<grid_id>":{"geometry":<geometry>,"files":[<files>]}
+    No longer used by get_fabdem_files, which queries the footprint index
+    (see footprint_index)
     """
 
     fgj = _fabdems_geojson_path(resample)
@@ -770,10 +996,10 @@ def getExtractFromHPC(cwd,study_area,g,dex,crs,f_main,f_error,resample='bilinear
     file_names = []
 
     if fabdem:
-        hpc_files = get_fabdem_files(study_area,resample,national_grid)
+        hpc_files = get_fabdem_files(study_area,resample,national_grid,geometry=g,crs=crs)
         dem_source = 'fabdem'
     else:
-        hpc_files = get_copernicus_files(study_area)
+        hpc_files = get_copernicus_files(study_area,national_grid,geometry=g,crs=crs)
         dem_source = 'copernicus'
 
     for hpc_file in hpc_files:
@@ -799,10 +1025,12 @@ def getExtractFromHPC(cwd,study_area,g,dex,crs,f_main,f_error,resample='bilinear
     return file_names,internal_log
 
 def make_image_file_from_cog(url,cwd,name,geom_d,crs,f_main,f_error,blocksize=512):
-    """Uses local 3979 30 m reprojects of copernicus"""
+    """Uses local 3979 30 m reprojects of copernicus
+    Clips the cog to the geometry window (as mask with crop=True) block by block,
+    pixels outside the geometry are nodata, the memory is bounded by one block"""
     main_log = []
     error_log = []
-    cwd = dce.checkOutpath(cwd)
+    cwd = dce.DatacubeExtract.check_outpath(cwd)
     # print(f'makeImageFilesFromCog cwd {cwd}')
     # write the sample out to a file 'sample_<filename>'
     file_name="%s/%s_sample-%s"%(cwd,name,url.split('/')[-1])
@@ -810,89 +1038,99 @@ def make_image_file_from_cog(url,cwd,name,geom_d,crs,f_main,f_error,blocksize=51
 
     #print(file_name)
     # open cog with all types of GeoTIFF georeference except that within the TIFF file’s keys and tags turned off
-    cog=rasterio.open(url,GEOREF_SOURCES='INTERNAL')
-
-    # input crs matches cog crs
-    t = dce.transform_geom(crs,cog.crs,geom_d)
-
-    geom_cog = shapely.geometry.shape(t)
-
-    main_log.append(f'makeImageFilesFromCog geom_cog : {geom_cog}')
-    dce.appendListToFile(main_log,f_main)
-    # convert geom dict to a list and pass in to mask
-    # want crop = True and all other params default values
-    try:
-        sample_cog,cog_transform = dce.mask(dataset=cog,shapes=[geom_cog],crop=True)
-
-        #calculate height and width index of shape from number of dimensions
-        height=sample_cog.shape[sample_cog.ndim-2]
-        width=sample_cog.shape[sample_cog.ndim-1]
-
-        dst=rasterio.open(
-            file_name,
-            'w+',
-            driver='GTiff',
-            height=height,
-            width=width,
-            count=1,
-            dtype=cog.dtypes[0],
-            crs=cog.crs,
-            transform=cog_transform,
-            nodata=cog.nodata,
-            GEOREF_SOURCES='INTERNAL',
-            compress='LZW',
-            tiled=True,
-            blockxsize=blocksize,
-            blockysize=blocksize
-            )
-        dst.write(sample_cog)
-        dst.close()
-        cog.close()
-    except Exception as e:
-        error_log.append(f'MakeImageFileFromCog Error with mask or writing file {e}')
-        dce.appendListToFile(error_log,f_error)
+    with rasterio.open(url,GEOREF_SOURCES='INTERNAL') as cog:
+
+        # input crs matches cog crs
+        t = rasterio.warp.transform_geom(crs,cog.crs,geom_d)
+
+        geom_cog = shapely.geometry.shape(t)
+
+        main_log.append(f'makeImageFilesFromCog geom_cog : {geom_cog}')
+        _append_to_file(main_log,f_main)
+        try:
+            # the cropped window of mask(crop=True)
+            window = rasterio.features.geometry_window(cog,[geom_cog])
+            cog_transform = cog.window_transform(window)
+            # mask fills with 0 without nodata
+            fill = cog.nodata if cog.nodata is not None else 0
+
+            with rasterio.open(
+                file_name,
+                'w+',
+                driver='GTiff',
+                height=window.height,
+                width=window.width,
+                count=1,
+                dtype=cog.dtypes[0],
+                crs=cog.crs,
+                transform=cog_transform,
+                nodata=cog.nodata,
+                GEOREF_SOURCES='INTERNAL',
+                compress='LZW',
+                tiled=True,
+                blockxsize=blocksize,
+                blockysize=blocksize
+                ) as dst:
+                for row in range(0,window.height,blocksize):
+                    for col in range(0,window.width,blocksize):
+                        dst_window = rasterio.windows.Window(col,row,
+                                                             min(blocksize,window.width-col),
+                                                             min(blocksize,window.height-row))
+                        src_window = rasterio.windows.Window(window.col_off+col,
+                                                             window.row_off+row,
+                                                             dst_window.width,
+                                                             dst_window.height)
+                        arr = cog.read(1,window=src_window,masked=True)
+                        outside = rasterio.features.geometry_mask(
+                            [geom_cog],
+                            out_shape=arr.shape,
+                            transform=dst.window_transform(dst_window))
+                        block = numpy.where(outside | numpy.ma.getmaskarray(arr),
+                                            fill,arr.data).astype(arr.dtype)
+                        dst.write(block,indexes=1,window=dst_window)
+        except Exception as e:
+            error_log.append(f'MakeImageFileFromCog Error with mask or writing file {e}')
+            _append_to_file(error_log,f_error)
     return file_name
 
+def _append_to_file(lines,fname):
+    """Appends the lines to the file fname, used for logging"""
+    with open(fname,'a') as f:
+        for line in lines:
+            f.write(f'{line}\n')
+    return f'Wrote {len(lines)} lines to {fname}.'
+
 
 def merge_reproject_files(datasets,dex,cwd,study_area,suffix,crs,nodata,goal_csize,resample,goal_precision):
+    """Merges the open datasets block by block (see windowed_merge) in
+    <cwd>/<study_area><suffix>, the datasets are closed"""
     # cog default block size
     blocksize=512
-    cwd=dex.checkOutpath(cwd)
-    mergedfiles=[]
     # res=getResolution(datasets,goal_csize)
     # print(f'resolution {res}')
     # precision=4
-    #merge the open datasets to a numpy array
-    merge_arr,merge_affine=dex.merge.merge(datasets)
-
-    for dataset in datasets:
-        dataset.close()
-    #sa_merge_file=os.path.join(cwd,"{}_{}_p{}-{}".format(study_area,resample.name,res[0],suffix))
     #Heather wants GRIDID_DTM_O_30
-    sa_merge_file = os.path.join(cwd,f'{study_area}{crs}{suffix}')
-    final_file = os.path.join(cwd,f'{study_area}{suffix}')
-    #write array to cog
-    m=rasterio.open(
-        final_file,'w',
-        height=merge_arr.shape[1],
-        width=merge_arr.shape[2],
-        transform=merge_affine,
-        dtype=merge_arr.dtype,
-        crs=crs,
-        count=1,
-        driver='GTiff',
-        compress='LZW',
-        tiled=True,
-        blockxsize=blocksize,
-        blockysize=blocksize,
-        nodata=nodata,
-        GEOREF_SOURCES='INTERNAL'
-        )
-    m.write(merge_arr)
+    #merge the open datasets to the cog block by block
+    try:
+        cwd = dce.DatacubeExtract.check_outpath(cwd)
+        final_file = os.path.join(cwd,f'{study_area}{suffix}')
+        windowed_merge(datasets,final_file,
+                       dst_kwds={'crs':crs,
+                                 'count':1,
+                                 'driver':'GTiff',
+                                 'compress':'LZW',
+                                 'tiled':True,
+                                 'blockxsize':blocksize,
+                                 'blockysize':blocksize,
+                                 'nodata':nodata,
+                                 'GEOREF_SOURCES':'INTERNAL'},
+                       blocksize=blocksize)
+    finally:
+        for dataset in datasets:
+            dataset.close()
       ## cant add description header with all of the source files - not working
       ## does not work m.update_tags(a= ','.join(datasets))
       ## does not work m.set_band_description(1, ','.join(datasets))
-    m.close()
     # No longer reprojecting at end, fabdems reprojected to 3979 are used from beggining
     # reproject_image(sa_merge_file,final_file)
     return final_file
@@ -943,7 +1181,7 @@ def merge_reproject_files(datasets,dex,cwd,study_area,suffix,crs,nodata,goal_csi
 #                 src_crs=src_img.crs,
 #                 dst_transform=dst_transform,
 #                 dst_crs=dst_crs,
-#                 resampling=dce.getResampleEnum(resample)
+#                 resampling=dce.resample_value(resample)
 #
 #                 )
 #     src_img.close()
@@ -953,6 +1191,92 @@ def merge_reproject_files(datasets,dex,cwd,study_area,suffix,crs,nodata,goal_csi
 #     return
 # =============================================================================
 
+def windowed_merge(datasets,dst_path,dst_kwds=None,blocksize=512,
+                   resampling=rasterio.enums.Resampling.nearest):
+    """Same result as rasterio.merge.merge(datasets,dst_path=dst_path,dst_kwds=dst_kwds)
+    (method 'first', extent of all the datasets, resolution, dtype and nodata of the first one)
+    written block by block, the memory is bounded by the blocksize instead of the merged extent
+
+    The source and destination windows of each dataset are computed once like
+    rasterio.merge, then each output block reads the part of the source window under it.
+    """
+    first = datasets[0]
+    nodataval = first.nodatavals[0]
+    dst_kwds = dst_kwds or {}
+    if dst_kwds.get('nodata') is not None:
+        nodataval = dst_kwds['nodata']
+    # Extent of all inputs and resolution of the first one
+    xs = []
+    ys = []
+    for dataset in datasets:
+        left, bottom, right, top = dataset.bounds
+        xs.extend([left, right])
+        ys.extend([bottom, top])
+    dst_w, dst_s, dst_e, dst_n = min(xs), min(ys), max(xs), max(ys)
+    res = first.res
+    output_width = int(round((dst_e - dst_w) / res[0]))
+    output_height = int(round((dst_n - dst_s) / res[1]))
+    output_transform = Affine.translation(dst_w, dst_n) * Affine.scale(res[0], -res[1])
+
+    profile = first.profile
+    profile.update(**dst_kwds)
+    profile.update({'transform':output_transform,
+                    'height':output_height,
+                    'width':output_width,
+                    'dtype':first.dtypes[0]})
+    count = first.count
+    fill = 0 if nodataval is None else nodataval
+
+    # Source and destination windows of each dataset (as rasterio.merge)
+    merge_windows = []
+    for src in datasets:
+        src_w, src_s, src_e, src_n = src.bounds
+        int_w, int_s = max(src_w, dst_w), max(src_s, dst_s)
+        int_e, int_n = min(src_e, dst_e), min(src_n, dst_n)
+        src_window = rasterio.windows.from_bounds(int_w, int_s, int_e, int_n, src.transform).round_lengths()
+        dst_window = rasterio.windows.from_bounds(int_w, int_s, int_e, int_n, output_transform
+                                                  ).round_lengths().round_offsets()
+        merge_windows.append((src, src_window, dst_window))
+
+    with rasterio.open(dst_path,'w',**profile) as dst:
+        for row in range(0,output_height,blocksize):
+            for col in range(0,output_width,blocksize):
+                window = rasterio.windows.Window(col,row,
+                                                 min(blocksize,output_width-col),
+                                                 min(blocksize,output_height-row))
+                dest = numpy.full((count,window.height,window.width),fill,dtype=profile['dtype'])
+                for src,src_window,dst_window in merge_windows:
+                    # Part of the destination window of the dataset in the block
+                    r0 = max(window.row_off, max(0, dst_window.row_off))
+                    c0 = max(window.col_off, max(0, dst_window.col_off))
+                    r1 = min(window.row_off + window.height, dst_window.row_off + dst_window.height)
+                    c1 = min(window.col_off + window.width, dst_window.col_off + dst_window.width)
+                    if r0 >= r1 or c0 >= c1:
+                        continue
+                    # Same part of the source window
+                    yscale = src_window.height / dst_window.height
+                    xscale = src_window.width / dst_window.width
+                    part = rasterio.windows.Window(src_window.col_off + (c0 - dst_window.col_off)*xscale,
+                                                   src_window.row_off + (r0 - dst_window.row_off)*yscale,
+                                                   (c1 - c0)*xscale,
+                                                   (r1 - r0)*yscale)
+                    region = dest[:, r0 - window.row_off:r1 - window.row_off,
+                                  c0 - window.col_off:c1 - window.col_off]
+                    temp = src.read(out_shape=(count, r1 - r0, c1 - c0),
+                                    window=part, boundless=False, masked=True,
+                                    resampling=resampling)
+                    if math.isnan(fill):
+                        region_mask = numpy.isnan(region)
+                    elif numpy.issubdtype(region.dtype, numpy.floating):
+                        region_mask = numpy.isclose(region, fill)
+                    else:
+                        region_mask = region == fill
+                    # Method first, only the pixels without a value yet
+                    copy = region_mask & ~numpy.ma.getmaskarray(temp)
+                    region[copy] = temp.data[copy]
+                dst.write(dest,window=window)
+    return dst_path
+
 def modify_kwargs(kwargs,dst_crs,dst_transform,dst_w,dst_h,blocksize):
     kwargs.update({
         'crs':dst_crs,
@@ -1019,7 +1343,7 @@ def reproject_image(src_file,dst_file,
                 src_crs=src_img.crs,
                 dst_transform=dst_transform,
                 dst_crs=dst_crs,
-                resampling=dce.getResampleEnum(resample)
+                resampling=dce.resample_value(resample)
 
                 )
     src_img.close()
@@ -1041,12 +1365,9 @@ def reproject_image_to_pixel_size(src_file,dst_file,
     """
     src_img = rasterio.open(src_file)
     if src_img.crs != dst_crs:
-        # convert to bbox wkt dict
-        bbox = dce.box(*src_img.bounds)
-        # get bounds from return polygon
-        src_bounds = dce.transform_dict_to_poly(bbox_dict=bbox,
-                                                    in_crs=src_img.crs,
-                                                    out_crs=dst_crs).bounds
+        # bounds of the reprojected corners
+        src_bounds = rasterio.warp.transform_bounds(src_img.crs,dst_crs,
+                                                    *src_img.bounds,densify_pts=0)
     else:
         src_bounds = src_img.bounds
     west,south,east,north = src_bounds
@@ -1072,7 +1393,7 @@ def reproject_image_to_pixel_size(src_file,dst_file,
                 src_crs=src_img.crs,
                 dst_transform=dst_transform,
                 dst_crs=dst_crs,
-                resampling=dce.getResampleEnum(resample)
+                resampling=dce.resample_value(resample)
 
                 )
     src_img.close()
@@ -1141,106 +1462,294 @@ def get_3979_copernicus(resample='bilinear'):
 # =============================================================================
 
 
-def reproject_fabdems(resample='bilinear',pixel_size=30,subdir_filter=None):
-    """Reprojecting fabdems to 3979 with bilinear reprojection sampling"""
+def reproject_fabdems(resample='bilinear',pixel_size=30,subdir_filter=None,
+                      max_workers=None,checksum=False):
+    """Reprojecting fabdems to 3979 with bilinear reprojection sampling
+    Only the fabdems changed since their last reprojection are processed (see batch_reproject)"""
     start = dce.datetime.now()
     print(f'Start : {start}')
     fp = get_fabdem_path()
     # make a bilinear subdir
     fd3979 = fp.joinpath(_fabdem3979_dir(),resample)
-    fd3979 = dce.checkOutpath(fd3979)
+    fd3979 = dce.DatacubeExtract.check_outpath(fd3979)
     original_fabdems = get_original_fabdems(subdir_filter)
-    for original_fabdem in original_fabdems:
-        src_file = str(original_fabdem.absolute())
-        dst_file = fd3979.joinpath(original_fabdem.name)
-        # reproject_image(src_file,dst_file,resample='bilinear')
-        reproject_image_to_pixel_size(src_file,dst_file,
-                                      resample='bilinear',
-                                      pixel_size=pixel_size)
-        print(f'reprojected {src_file} to {dst_file}')
+    pairs = [(str(original_fabdem.absolute()),fd3979.joinpath(original_fabdem.name))
+             for original_fabdem in original_fabdems]
+    batch_reproject(pairs,reproject_image_to_pixel_size,
+                    max_workers=max_workers,checksum=checksum,
+                    resample=resample,pixel_size=pixel_size)
     finish = dce.datetime.now()
     print(f'Finish : {finish}')
     return
 
-def compare_fabdems():
-    sames = []
-    differents = []
-    msgs = []
+def batch_reproject(pairs,reproject=reproject_image_to_pixel_size,
+                    max_workers=None,checksum=False,**kwargs):
+    """Reprojects the (src_file,dst_file) pairs with a process pool
+
+    An output is skipped if it is newer than its input (a remote input is only
+    reprojected if the output does not exist), or with checksum=True if the
+    sha256 of its input and the reprojection parameters did not change since
+    it was written (saved in <dst dir>/reproject_checksums.json).
+    The outputs are written to a temp file then renamed, an interrupted run
+    never leaves a partial output. The throughput of each file is printed.
+
+    kwargs are passed to reproject (ex: resample, pixel_size)
+    Returns the list of the dst_file reprojected
+    """
+    manifests = {}
+    jobs = []
+    for src_file,dst_file in pairs:
+        dst_file = pathlib.Path(dst_file)
+        manifest = _checksum_manifest(dst_file.parent,manifests) if checksum else None
+        previous = manifest.get(dst_file.name) if manifest is not None else None
+        if not checksum and _is_up_to_date(str(src_file),dst_file):
+            print(f'up to date {dst_file}')
+            continue
+        jobs.append((reproject,str(src_file),dst_file,kwargs,previous if dst_file.is_file() else None))
+    print(f'{len(jobs)} of {len(pairs)} files to reproject')
+
+    done = []
+    total_mb = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_reproject_job,*job):job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                src_file,dst_file,signature,seconds,mb = future.result()
+            except Exception as e:
+                print(f'error reprojecting {futures[future][1]} : {e}')
+                continue
+            if checksum:
+                manifest = manifests[dst_file.parent]
+                manifest[dst_file.name] = signature
+                _save_checksum_manifest(dst_file.parent,manifest)
+            if seconds is None:
+                print(f'unchanged {src_file}')
+                continue
+            done.append(dst_file)
+            total_mb += mb
+            print(f'reprojected {src_file} to {dst_file} '
+                  f'{seconds:.1f}s {mb:.1f}MB {mb/max(seconds,1e-6):.1f}MB/s')
+    elapsed = time.perf_counter() - start
+    print(f'{len(done)} files reprojected in {elapsed:.1f}s, {total_mb/max(elapsed,1e-6):.1f}MB/s')
+    return done
+
+def _is_up_to_date(src_file,dst_file):
+    """True if dst_file exists and is newer than src_file (exists only for a remote src_file)"""
+    if not dst_file.is_file():
+        return False
+    if '://' in src_file:
+        return True
+    return dst_file.stat().st_mtime >= pathlib.Path(src_file).stat().st_mtime
+
+def _file_sha256(file,chunk_size=16*1024*1024):
+    sha = hashlib.sha256()
+    with open(file,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _reproject_job(reproject,src_file,dst_file,kwargs,previous=None):
+    """Process pool job of batch_reproject,
+    returns (src_file,dst_file,signature,seconds,MB of the input) with seconds None if unchanged"""
+    signature = None
+    if previous is not None and '://' not in src_file:
+        signature = {'sha256':_file_sha256(src_file),
+                     'reproject':reproject.__name__,
+                     'kwargs':json.dumps(kwargs,sort_keys=True,default=str)}
+        if signature == previous:
+            return src_file,dst_file,signature,None,0
+    start = time.perf_counter()
+    temp_file = dst_file.with_name(f'{dst_file.stem}.temp{dst_file.suffix}')
+    try:
+        reproject(src_file,temp_file,**kwargs)
+        os.replace(temp_file,dst_file)
+    finally:
+        if temp_file.is_file():
+            temp_file.unlink()
+    seconds = time.perf_counter() - start
+    if signature is None and '://' not in src_file:
+        signature = {'sha256':_file_sha256(src_file),
+                     'reproject':reproject.__name__,
+                     'kwargs':json.dumps(kwargs,sort_keys=True,default=str)}
+    size = dst_file.stat().st_size if '://' in src_file else os.path.getsize(src_file)
+    return src_file,dst_file,signature,seconds,size/1024**2
+
+def _checksum_manifest(dst_dir,manifests):
+    """The checksums of the inputs of the outputs in dst_dir, read once"""
+    if dst_dir not in manifests:
+        manifest_file = dst_dir.joinpath('reproject_checksums.json')
+        manifests[dst_dir] = json.loads(manifest_file.read_text()) if manifest_file.is_file() else {}
+    return manifests[dst_dir]
+
+def _save_checksum_manifest(dst_dir,manifest):
+    manifest_file = dst_dir.joinpath('reproject_checksums.json')
+    temp_file = manifest_file.with_suffix('.json.temp')
+    temp_file.write_text(json.dumps(manifest,indent=1))
+    os.replace(temp_file,manifest_file)
+
+def compare_fabdems(max_workers=4):
     compare_file = 'fabdem_deltas.json'
 
     fp3979 = get_fabdem_path().joinpath(_fabdem3979_dir())
     bilinears = fp3979.joinpath('bilinear').glob('**/*.tif')
+    pairs = []
     for bilinear in bilinears:
         if 'diff_b-n' not in bilinear.name:
             nearest = pathlib.Path(fp3979,bilinear.name)
-            # update lists with delta info
-            delta(nearest,bilinear,sames,differents,msgs)
-    d = {
-        'sames':sames,
-        'differents':differents,
-        'msgs':msgs}
-    jp = pathlib.Path(compare_file)
-    with jp.open('w') as fp:
-        json.dump(d,fp)
+            pairs.append((nearest,bilinear))
+    compare_pairs(pairs,compare_file,max_workers=max_workers)
     return
 
-def compare_fabdem_mosaics():
-    sames = []
-    differents = []
-    msgs = []
+def compare_fabdem_mosaics(max_workers=4):
     compare_file = 'fabdem_mosiac_deltas.json'
     fpmosaics = get_fabdem_path().joinpath(get_fabdem_path(),'mosaics')
     bilinears = fpmosaics.joinpath('bilinear').glob('**/*.tif')
+    pairs = []
     for bilinear in bilinears:
         if 'diff_b-n' not in bilinear.name:
             nearest = pathlib.Path(fpmosaics,bilinear.parts[-2],bilinear.parts[-1])
-            # update lists with delta info
-            delta(nearest,bilinear,sames,differents,msgs,make_image=True)
+            pairs.append((nearest,bilinear))
+    compare_pairs(pairs,compare_file,make_image=True,max_workers=max_workers)
+    return
+
+def compare_pairs(pairs,compare_file,make_image=False,max_workers=4):
+    """Compares the (image 1,image 2) pairs, max_workers pairs at the same time
+    Writes the sames, differents, msgs and stats of the pairs in compare_file (json)"""
+    def _delta(pair):
+        sames = []
+        differents = []
+        msgs = []
+        stats = []
+        delta(pair[0],pair[1],sames,differents,msgs,make_image=make_image,stats=stats)
+        return sames,differents,msgs,stats
+
     d = {
-        'sames':sames,
-        'differents':differents,
-        'msgs':msgs}
+        'sames':[],
+        'differents':[],
+        'msgs':[],
+        'stats':[]}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # results in the order of the pairs
+        for result in executor.map(_delta,pairs):
+            for key,values in zip(['sames','differents','msgs','stats'],result):
+                d[key].extend(values)
     jp = pathlib.Path(compare_file)
     with jp.open('w') as fp:
         json.dump(d,fp)
-    return
+    return d
 
-def delta(i1,i2,sames,differents,msgs,make_image=False):
+def delta(i1,i2,sames,differents,msgs,make_image=False,stats=None):
     """Compares per pixel values for two images
-    Optionally writes delta out as own image"""
+    Optionally writes delta out as own image (<image 2 stem>_diff_b-n.tif),
+    only when the images are different
+    The images are compared block by block (see delta_stats), stats is
+    extended with the statistics of the comparison"""
     p1 = pathlib.Path(i1)
     p2 = pathlib.Path(i2)
     if p1.is_file() and p2.is_file():
-        c1 = rasterio.open(p1)
-        c2 = rasterio.open(p2)
-        #compare shapes
-        if c1.shape == c2.shape:
-            a1 = c1.read(1)
-            a2 = c2.read(1)
-            d = a2-a1
-            non_zeros = numpy.count_nonzero(d)
-            percent = (non_zeros/(c1.width*c1.height))*100
+        # One delta image per pair, the pairs are compared at the same time
+        diff_file = p2.with_name(f'{p2.stem}_diff_b-n.tif') if make_image else None
+        d = delta_stats(p1,p2,diff_file=diff_file)
+        if d:
+            percent = (d['different']/d['pixels'])*100
             msg = f'{p2}-{p1} -> {percent} % pixels that are different'
             msgs.append(msg)
-            if non_zeros > 0:
+            if stats is not None:
+                stats.append(d)
+            if d['different'] > 0:
                 differents.append(p2.name)
-                if make_image:
-                    kwargs = c2.meta.copy()
-                    new_name = p2.with_name('diff_b-n.tif')
-                    save_cog(new_name,d,kwargs)
             else:
                 sames.append(p2.name)
-
-        else:
-            print('Images must be the same size')
-            print(f'Image 1 {p1} is {c1.shape}')
-            print(f'Image 2 {p2} is {c2.shape}')
-        c1.close()
-        c2.close
+                if diff_file:
+                    # Only the different images have a delta image
+                    diff_file.unlink(missing_ok=True)
     else:
         print(f'at least one not a file {p1} {p2}')
     return
 
+# Upper edges of the histogram of the absolute differences
+_DELTA_BINS = [0,0.01,0.1,0.5,1,2,5,10,50,100,numpy.inf]
+
+def delta_stats(i1,i2,diff_file=None,band=1,blocksize=1024,max_workers=4,bins=_DELTA_BINS):
+    """Compares two images of the same shape block by block with max_workers threads,
+    the memory is bounded by a few blocks of both images
+
+    Returns a dict of the statistics of image 2 - image 1 or None if the shapes differ
+        pixels, different (number of pixels !=, nan included),
+        max_abs, mean_abs (of the pixels with a value in both images),
+        histogram (counts of abs diff per bins interval)
+    If diff_file, image 2 - image 1 is written to it (cog blocks, profile of image 2)
+    """
+    with rasterio.open(i1) as c1, rasterio.open(i2) as c2:
+        if c1.shape != c2.shape:
+            print('Images must be the same size')
+            print(f'Image 1 {i1} is {c1.shape}')
+            print(f'Image 2 {i2} is {c2.shape}')
+            return None
+        height,width = c2.shape
+        kwargs = c2.meta.copy()
+        nodata1,nodata2 = c1.nodata,c2.nodata
+    windows = [rasterio.windows.Window(col,row,min(blocksize,width-col),min(blocksize,height-row))
+               for row in range(0,height,blocksize)
+               for col in range(0,width,blocksize)]
+
+    # Opened images per thread, datasets are not thread safe
+    local = threading.local()
+    all_opened = []
+    lock = threading.Lock()
+
+    def _block(window):
+        if not hasattr(local,'imgs'):
+            local.imgs = (rasterio.open(i1),rasterio.open(i2))
+            with lock:
+                all_opened.append(local.imgs)
+        a1 = local.imgs[0].read(band,window=window)
+        a2 = local.imgs[1].read(band,window=window)
+        d = a2-a1
+        valid = ~(dce._nodata_mask(a1,nodata1) | dce._nodata_mask(a2,nodata2))
+        abs_d = numpy.abs(d[valid].astype('float64'))
+        abs_d = abs_d[numpy.isfinite(abs_d)]
+        block_stats = {'different':int(numpy.count_nonzero(d)),
+                       'valid':int(abs_d.size),
+                       'sum_abs':float(abs_d.sum()),
+                       'max_abs':float(abs_d.max()) if abs_d.size else 0.,
+                       'histogram':numpy.histogram(abs_d,bins=bins)[0]}
+        return block_stats,(d if diff_file else None)
+
+    result = {'image_1':str(i1),'image_2':str(i2),
+              'pixels':width*height,'different':0,'valid':0,
+              'max_abs':0.,'mean_abs':0.,'histogram':numpy.zeros(len(bins)-1,dtype='int64')}
+    sum_abs = 0.
+    dst = None
+    if diff_file:
+        kwargs.update({'compress':'LZW','tiled':True,'blockxsize':512,'blockysize':512})
+        dst = rasterio.open(diff_file,'w',**kwargs)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # A chunk of blocks at a time, the diff blocks are written in order
+            chunk = 4*max_workers
+            for i in range(0,len(windows),chunk):
+                for window,(block_stats,d) in zip(windows[i:i+chunk],
+                                                  executor.map(_block,windows[i:i+chunk])):
+                    result['different'] += block_stats['different']
+                    result['valid'] += block_stats['valid']
+                    result['max_abs'] = max(result['max_abs'],block_stats['max_abs'])
+                    result['histogram'] += block_stats['histogram']
+                    sum_abs += block_stats['sum_abs']
+                    if dst is not None:
+                        dst.write(d,indexes=1,window=window)
+    finally:
+        if dst is not None:
+            dst.close()
+        for imgs in all_opened:
+            for img in imgs:
+                img.close()
+    result['mean_abs'] = sum_abs/result['valid'] if result['valid'] else 0.
+    result['histogram'] = {f'{lower}-{upper}':int(count) for lower,upper,count
+                           in zip(bins[:-1],bins[1:],result['histogram'])}
+    return result
+
 def save_cog(file_name,arr,kwargs,blocksize=512):
     """TODO read array or image per band per window
     # with rasterio.open(dst_file,'w+',**kwargs) as dst:
@@ -1258,10 +1767,10 @@ def save_cog(file_name,arr,kwargs,blocksize=512):
         new.write(arr,indexes=1)
     return
 
-def create_local_copernicus(resample='bilinear'):
+def create_local_copernicus(resample='bilinear',max_workers=None):
     print(f'Start : {dce.datetime.now()}')
     dst = get_fabdem_path().joinpath('copernicus3979',resample)
-    dce.checkOutpath(dst)
+    dce.DatacubeExtract.check_outpath(dst)
 
     coperns = ['http://copernicus-dem-30m.s3.amazonaws.com/Copernicus_DSM_COG_10_N49_00_W098_00_DEM/Copernicus_DSM_COG_10_N49_00_W098_00_DEM.tif',
                'http://copernicus-dem-30m.s3.amazonaws.com/Copernicus_DSM_COG_10_N49_00_W099_00_DEM/Copernicus_DSM_COG_10_N49_00_W099_00_DEM.tif',
@@ -1273,13 +1782,10 @@ def create_local_copernicus(resample='bilinear'):
                'http://copernicus-dem-30m.s3.amazonaws.com/Copernicus_DSM_COG_10_N49_00_W097_00_DEM/Copernicus_DSM_COG_10_N49_00_W097_00_DEM.tif'
                ]
     # coperns = [coperns[0]]
-    for copern in coperns:
-        dst_file = dst.joinpath(copern.split('/')[-1])
-        print(f'reprojectiong {copern}')
-        print(f'to {dst}')
-        reproject_image(copern,dst_file.absolute(),resample='bilinear')
-    return
+    pairs = [(copern,dst.joinpath(copern.split('/')[-1]).absolute()) for copern in coperns]
+    batch_reproject(pairs,reproject_image,max_workers=max_workers,resample=resample)
     print(f'End : {dce.datetime.now()}')
+    return
 
 def build_overviews(file,
                     dec_factors=[2,4,8,16,32,64,128,256],
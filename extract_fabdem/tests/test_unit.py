@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Unit Testing module for extract_fabdem.py
+
+"""
+# Python standard library
+import pathlib
+import sys
+
+# Custom packages
+import numpy as np
+import pytest
+import rasterio
+import rasterio.merge
+from rasterio.transform import from_origin
+
+# Datacube custom packages
+_CHILD_LEVEL = 2
+DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
+if DIR_NEEDED not in sys.path:
+    sys.path.append(DIR_NEEDED)
+import extract_fabdem.extract_fabdem as ef
+
+
+def create_merge_sources(tmp_path, origins, sizes, resolutions, nodata=-9999.):
+    """Random float32 tifs with nodata pixels, one per (origin, size, resolution)"""
+    rng = np.random.default_rng(0)
+    files = []
+    for i, ((left, top), (height, width), res) in enumerate(zip(origins, sizes, resolutions)):
+        arr = (rng.random((height, width))*100).astype('float32')
+        arr[rng.random((height, width)) < 0.2] = nodata
+        file = tmp_path / f'src{i}.tif'
+        with rasterio.open(file, 'w', driver='GTiff', height=height, width=width, count=1,
+                           dtype='float32', crs='EPSG:3979', nodata=nodata,
+                           transform=from_origin(left, top, res, res)) as dst:
+            dst.write(arr, 1)
+        files.append(file)
+    return files
+
+
+class TestWindowedMerge():
+
+    @pytest.mark.parametrize('origins, sizes, resolutions', [
+        #aligned
+        ([(0, 1000), (600, 1400), (300, 700)], [(40, 50), (45, 35), (30, 60)], [30, 30, 30]),
+        #shifted by a fraction of a pixel
+        ([(0, 1000), (613, 1411), (297.5, 708)], [(40, 50), (45, 35), (30, 60)], [30, 30, 30]),
+        #different resolutions
+        ([(0, 1000), (600, 1400)], [(40, 50), (70, 55)], [30, 20]),
+        ])
+    def test_windowed_merge(self, tmp_path, origins, sizes, resolutions):
+        print('Preparation')
+        files = create_merge_sources(tmp_path, origins, sizes, resolutions)
+        datasets = [rasterio.open(file) for file in files]
+        print('Execution')
+        try:
+            ef.windowed_merge(datasets, tmp_path / 'windowed.tif', blocksize=16)
+            rasterio.merge.merge(datasets, dst_path=tmp_path / 'merge.tif')
+        finally:
+            for dataset in datasets:
+                dataset.close()
+        print('Validation')
+        #Same grid and values as rasterio.merge
+        with rasterio.open(tmp_path / 'windowed.tif') as windowed, rasterio.open(tmp_path / 'merge.tif') as merged:
+            assert windowed.transform == merged.transform
+            assert windowed.shape == merged.shape
+            assert windowed.nodata == merged.nodata
+            assert np.array_equal(windowed.read(), merged.read())
+
+    def test_merge_reproject_files(self, tmp_path):
+        print('Preparation')
+        files = create_merge_sources(tmp_path, [(0, 1000), (600, 1400)], [(40, 50), (45, 35)], [30, 30])
+        datasets = [rasterio.open(file) for file in files]
+        print('Execution')
+        out_file = ef.merge_reproject_files(datasets, None, tmp_path / 'out', 'T-39', '_dtm.tif',
+                                            datasets[0].crs, -9999., 30, None, 2)
+        print('Validation')
+        #The output dir is created and the datasets are closed
+        assert pathlib.Path(out_file) == tmp_path / 'out' / 'T-39_dtm.tif'
+        assert all(dataset.closed for dataset in datasets)
+        with rasterio.open(out_file) as src:
+            assert src.profile['tiled'] and src.nodata == -9999.
+
+
+class TestDelta():
+
+    def test_compare_pairs(self, tmp_path):
+        print('Preparation')
+        files = create_merge_sources(tmp_path, [(0, 1000)]*4, [(40, 50)]*4, [30]*4)
+        #src0 and src1 differ, src3 is a copy of src2
+        files[3].write_bytes(files[2].read_bytes())
+        pairs = [(files[0], files[1]), (files[2], files[3])]
+        print('Execution')
+        d = ef.compare_pairs(pairs, tmp_path / 'deltas.json', make_image=True, max_workers=2)
+        print('Validation')
+        assert d['differents'] == ['src1.tif'] and d['sames'] == ['src3.tif']
+        #One delta image per different pair
+        assert sorted(f.name for f in tmp_path.glob('*diff_b-n.tif')) == ['src1_diff_b-n.tif']
+        with rasterio.open(files[0]) as c1, rasterio.open(files[1]) as c2, \
+             rasterio.open(tmp_path / 'src1_diff_b-n.tif') as diff:
+            assert np.array_equal(diff.read(1), c2.read(1) - c1.read(1))
+        assert d['stats'][1]['different'] == 0 and d['stats'][1]['max_abs'] == 0
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Unit Testing module for util.py
+
+util imports the whole geospatial and deep learning stack (torch, pcraster,
+whitebox, hydra...), the tests are skipped when it cannot be imported.
+
+"""
+# Python standard library
+import pathlib
+import sys
+
+# Custom packages
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+_CHILD_LEVEL = 1
+DIR_NEEDED = str(pathlib.Path(__file__).parents[_CHILD_LEVEL].absolute())
+if DIR_NEEDED not in sys.path:
+    sys.path.append(DIR_NEEDED)
+util = pytest.importorskip('util')
+
+
+class TestNeighbours():
+
+    def test_neighbours_from_array(self):
+        print('Preparation')
+        arr = np.arange(1, 13, dtype='float32').reshape(3, 4)
+        arr[0, 3] = -9999
+        arr[2, 0] = -9999
+        print('Execution')
+        neighbours = util.neighboursFromArray(arr, -9999)
+        print('Validation')
+        assert neighbours.shape == (3, 4, 8)
+        #(i-1,j-1), (i-1,j), (i-1,j+1), (i,j-1), (i,j+1), (i+1,j-1), (i+1,j), (i+1,j+1)
+        assert np.array_equal(neighbours[1, 1], [1, 2, 3, 5, 7, np.nan, 10, 11], equal_nan=True)
+        #Out of the raster and NoData neighbours are NaN
+        assert np.array_equal(neighbours[0, 2], [np.nan, np.nan, np.nan, 2, np.nan, 6, 7, 8], equal_nan=True)
+        #NoData pixel, all NaN
+        assert np.isnan(neighbours[0, 3]).all()
+        assert np.isnan(neighbours[2, 0]).all()
+
+    def test_neighbours_by_block(self, tmp_path):
+        print('Preparation')
+        rng = np.random.default_rng(0)
+        arr = (rng.random((37, 53))*100).astype('float32')
+        arr[rng.random(arr.shape) < 0.1] = -9999
+        file = tmp_path / 'dem.tif'
+        with rasterio.open(file, 'w', driver='GTiff', height=37, width=53, count=1, dtype='float32',
+                           crs='EPSG:3979', nodata=-9999, transform=from_origin(1000, 2000, 30, 30)) as dst:
+            dst.write(arr, 1)
+        print('Execution')
+        neighbours = util.getNeighboursValues(file)
+        blocks = np.full_like(neighbours, np.nan)
+        for window, block in util.getNeighboursValuesByBlock(file, blockSize=10):
+            blocks[window.row_off:window.row_off + window.height,
+                   window.col_off:window.col_off + window.width] = block
+        print('Validation')
+        #The halos give the same neighbours across the block edges
+        assert np.array_equal(neighbours, util.neighboursFromArray(arr, -9999), equal_nan=True)
+        assert np.array_equal(blocks, neighbours, equal_nan=True)
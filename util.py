@@ -461,39 +461,66 @@ def plotHistComparison(DEM1,DEM2, bins:int = 50):
 
 def getNeighboursValues(raster)-> np.array:
     '''
-    Inspect the 8 neighbours of each pixel to list their values. If the pixel being NoData, the neighbour list is empty. 
-    @raster: os.path to the raster to inst=pect.
-    @return: array of lists. 
-    '''
-    # Convert raster to NumPy array
-    arr,profil = readRasterWithRasterio(raster)
-    NOData = profil['nodata']
-    # Get dimensions of array
-    rows, cols = arr.shape
-
-    # Create empty array to store neighbours
-    neighbours = np.empty((rows, cols), dtype=object)
-
-    # Iterate over each cell in array
-    for i in range(rows):
-        for j in range(cols):
-            # Get value of current cell
-            val = arr[i, j]
-
-            # Check if value is NaN or NoData
-            if np.isnan(val) or val == NOData:
-                neighbours[i, j] = []
-            else:
-                # Get indices of neighbouring cells
-                indices = [(i-1, j-1), (i-1, j), (i-1, j+1),
-                           (i, j-1),             (i, j+1),
-                           (i+1, j-1), (i+1, j), (i+1, j+1)]
-
-                # Get values of neighbouring cells
-                vals = [arr[x, y] for x, y in indices if 0 <= x < rows and 0 <= y < cols]
-                # Add values to neighbours array
-                neighbours[i, j] = vals
-
+    Inspect the 8 neighbours of each pixel to list their values (first band). 
+    The neighbours order is: (i-1,j-1), (i-1,j), (i-1,j+1), (i,j-1), (i,j+1), (i+1,j-1), (i+1,j), (i+1,j+1).
+    Neighbours out of the raster or NoData are NaN. If the pixel is NoData, all its neighbours are NaN. 
+    @raster: os.path to the raster to inspect.
+    @return: np.array of shape (H, W, 8). 
+    '''
+    with rio.open(raster, mode="r") as src:
+        arr = src.read(1)
+        NOData = src.nodata
+    return neighboursFromArray(arr, NOData)
+
+def getNeighboursValuesByBlock(raster, blockSize:int = 1024):
+    '''
+    Block-wise getNeighboursValues for rasters larger than memory. Each block is read with a 1-pixel halo 
+    so the neighbours across the block edges are the same as for the whole raster. 
+    @raster: os.path to the raster to inspect.
+    @blockSize: height and width of the blocks.
+    @yield: (window, np.array of shape (window.height, window.width, 8)) for each block.
+    '''
+    with rio.open(raster, mode="r") as src:
+        NOData = src.nodata
+        H, W = src.height, src.width
+        for row in range(0, H, blockSize):
+            for col in range(0, W, blockSize):
+                window = rio.windows.Window(col, row, min(blockSize, W-col), min(blockSize, H-row))
+                # Halo clipped to the raster, the missing sides are padded with NaN
+                top, left = min(row, 1), min(col, 1)
+                bottom = min(H-(row+window.height), 1)
+                right = min(W-(col+window.width), 1)
+                haloWindow = rio.windows.Window(col-left, row-top, window.width+left+right, window.height+top+bottom)
+                arr = _noDataToNaN(src.read(1, window=haloWindow), NOData)
+                padded = np.pad(arr, ((1-top, 1-bottom), (1-left, 1-right)), constant_values=np.nan)
+                yield window, _neighboursFromPadded(padded)
+
+def neighboursFromArray(arr:np.array, noData = None)-> np.array:
+    '''
+    Vectorized 8 neighbours of each pixel of a 2D array, see getNeighboursValues for the order. 
+    @arr: 2D np.array.
+    @noData: NoData value of arr, NaN is always NoData.
+    @return: np.array of shape (H, W, 8).
+    '''
+    padded = np.pad(_noDataToNaN(arr, noData), 1, constant_values=np.nan)
+    return _neighboursFromPadded(padded)
+
+def _noDataToNaN(arr:np.array, noData = None)-> np.array:
+    arr = arr.astype(np.result_type(arr.dtype, np.float32))
+    if noData is not None and not np.isnan(noData):
+        arr[arr == noData] = np.nan
+    return arr
+
+def _neighboursFromPadded(padded:np.array)-> np.array:
+    '''
+    @padded: float 2D np.array with NaN for NoData and a 1-pixel border (halo or NaN).
+    @return: np.array of shape (H-2, W-2, 8) of the interior pixels.
+    '''
+    H, W = padded.shape[0]-2, padded.shape[1]-2
+    # (H, W, 3, 3) views of the 3x3 stencils, the centre (index 4) is dropped
+    stencils = np.lib.stride_tricks.sliding_window_view(padded, (3, 3)).reshape(H, W, 9)
+    neighbours = stencils[:, :, [0, 1, 2, 3, 5, 6, 7, 8]].copy()
+    neighbours[np.isnan(padded[1:-1, 1:-1])] = np.nan
     return neighbours
 
 def crop_TifList_WithMaskList(cfg: DictConfig, maskList:os.path):
@@ -1480,20 +1507,35 @@ def dc_extraction(cfg: DictConfig, args:dict=None)-> str:
 
 def multiple_dc_extract_ByPolygonList(cfg: DictConfig):
     '''
+    Extract all the polygons of the list in one batch (extract_cog_batch()): one search 
+    for the extent of all the polygons and each source item read once for all the polygons. 
+    The output files are named with the polygon file names.
     @cfg: DictConfig
     @csvPolygonList
     @Return: True if no error, otherwise dc_extraction tool errors report.
     '''
     polygList = createListFromCSV(cfg.dc_Extract_params['polygonListCSV'])
+    existing = []
     for polyg in polygList:
         if os.path.exists(polyg):
-            print(f"Currently working on -> {polyg}")
-            _,name,_ = get_parenPath_name_ext(polyg)
-            bbox = get_Shpfile_bbox_str(polyg)
-            args = {"bbox":bbox,"suffix":name}
-            dc_extraction(cfg,args=args)
+            existing.append(polyg)
         else:
             print(f"Path not found in the ssytem -> {polyg}")
+    if not existing:
+        return True
+    print(f"Currently working on {len(existing)} polygons")
+    dict_DcExtract = OmegaConf.to_container(cfg.dc_Extract_params['dc_extrac_cog'])
+    ## extract_cog_batch lives beside extract_cog
+    target = dict_DcExtract.pop('_target_')
+    batch_args = {'_target_': target.rsplit('.', 1)[0] + '.extract_cog_batch', '_convert_': 'all',
+                  'aois': existing}
+    for key in ['collections', 'resolution', 'method', 'out_crs', 'out_dir', 'datetime_filter',
+                'resolution_filter', 'overviews', 'orderby', 'desc']:
+        if key in dict_DcExtract:
+            batch_args[key] = dict_DcExtract[key]
+    if dict_DcExtract.get('suffix'):
+        batch_args['suffix'] = dict_DcExtract['suffix']
+    instantiate(OmegaConf.create(batch_args))
     return True
 
 